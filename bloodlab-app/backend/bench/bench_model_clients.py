@@ -0,0 +1,138 @@
+"""
+Connection setup overhead of model calls against a local stub server: a new
+client per call vs the shared, long-lived clients from model_clients (Gemini
+REST transport and OpenAI).
+
+    cd backend && python bench/bench_model_clients.py [--concurrency 24] [--calls 480]
+
+The stub is plain HTTP on localhost, so a new connection costs only the TCP
+handshake and client setup here; against the real APIs a TLS handshake is added.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "bench-placeholder-key")
+
+import google.generativeai as genai  # noqa: E402
+from google.generativeai import client as genai_client  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+from model_clients import configure_genai, ModelRegistry  # noqa: E402
+
+SERVER_DELAY_S = 0.005     # stub "model" time per call
+GENAI_BODY = json.dumps({
+    "candidates": [{"content": {"role": "model", "parts": [{"text": "{\"measurements\": []}"}]}, "finishReason": 1}],
+    "usageMetadata": {"promptTokenCount": 300, "candidatesTokenCount": 8, "totalTokenCount": 308},
+}).encode()
+OPENAI_BODY = json.dumps({
+    "id": "x", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{\"measurements\": []}"}}],
+    "usage": {"prompt_tokens": 300, "completion_tokens": 8, "total_tokens": 308},
+}).encode()
+
+# ---------- stub server ----------
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with Stub.lock:
+            Stub.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(SERVER_DELAY_S)
+        body = OPENAI_BODY if "chat/completions" in self.path else GENAI_BODY
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256     # default backlog of 5 resets bursts of new connections
+
+def start_stub() -> ThreadingHTTPServer:
+    srv = StubServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+# ---------- scenarios ----------
+def run(name: str, call, calls: int, concurrency: int):
+    Stub.connections = 0
+    lat = []
+    def one(_):
+        t = time.perf_counter()
+        call()
+        lat.append(time.perf_counter() - t)
+    call()      # warm-up (imports, first connection)
+    Stub.connections = 0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(one, range(calls)))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    return {
+        "name": name, "calls_per_s": calls / wall, "mean_ms": statistics.mean(lat) * 1000,
+        "p95_ms": lat[int(len(lat) * 0.95) - 1] * 1000, "connections": Stub.connections,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--concurrency", type=int, default=24)
+    ap.add_argument("--calls", type=int, default=480)
+    args = ap.parse_args()
+
+    srv = start_stub()
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    parts = [{"text": "ocr this page"}]
+    results = []
+
+    # Gemini, REST transport
+    configure_genai("bench-placeholder-key", "rest", endpoint=base)
+
+    def genai_new_client():
+        m = genai.GenerativeModel("gemma-3-27b-it")
+        m._client = genai_client._client_manager.make_client("generative")   # what an unshared client costs
+        m.generate_content(parts)
+
+    results.append(run("gemini: client per call", genai_new_client, args.calls, args.concurrency))
+
+    models = ModelRegistry()
+    results.append(run("gemini: shared client", lambda: models.get("gemma-3-27b-it").generate_content(parts),
+                       args.calls, args.concurrency))
+
+    # OpenAI (failover OCR, summaries)
+    messages = [{"role": "user", "content": "ocr this page"}]
+
+    def openai_new_client():
+        with OpenAI(api_key="sk-bench", base_url=base + "/v1", max_retries=0) as c:
+            c.chat.completions.create(model="gpt-4o-mini", messages=messages)
+
+    results.append(run("openai: client per call", openai_new_client, args.calls, args.concurrency))
+    shared_oa = OpenAI(api_key="sk-bench", base_url=base + "/v1", max_retries=0)
+    results.append(run("openai: shared client", lambda: shared_oa.chat.completions.create(model="gpt-4o-mini", messages=messages),
+                       args.calls, args.concurrency))
+
+    print(f"{args.calls} calls, {args.concurrency} concurrent, stub delay {SERVER_DELAY_S * 1000:.0f} ms")
+    print(f"{'scenario':<32}{'calls/s':>9}{'mean ms':>9}{'p95 ms':>9}{'new conns':>11}")
+    for r in results:
+        print(f"{r['name']:<32}{r['calls_per_s']:>9.0f}{r['mean_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['connections']:>11}")
+    srv.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Row (__slots__) vs Pydantic Measurement on the pipeline hot path, 100k rows:
+construction cost, memory per record, and enrich_with_db + dedup time.
+
+    cd backend && python bench/bench_records.py
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "bench-placeholder-key")
+
+from main import Measurement, enrich_with_db, dedup_measurements, canon_name_soft  # noqa: E402
+from records import Row  # noqa: E402
+
+N = 100_000
+NAMES = ["Hemoglobin", "Neutrophils %", "Glucose", "Platelets", "Creatinine", "ALT", "Potassium", "Lymphocytes"]
+
+def rows_args(n: int):
+    return [
+        dict(
+            name=NAMES[i % len(NAMES)], value=f"{i % 300}.{i % 10}", unit="g/L" if i % 3 else None,
+            reference_text=None, ref_low=None if i % 2 else 1.0, ref_high=None if i % 2 else 9.0,
+            flag="unknown", source_file=f"report{i // 400}.pdf#1", page=1 + (i // 40) % 10, group=None,
+        )
+        for i in range(n)
+    ]
+
+def measure(cls, args):
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    objs = [cls(**a) for a in args]
+    construct_s = time.perf_counter() - t0
+    mem, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    canon = {n: canon_name_soft(n)[0] for n in NAMES}
+    t0 = time.perf_counter()
+    for m in objs:
+        enrich_with_db(m, canon[m.name])
+    dedup_measurements(objs)
+    pipeline_s = time.perf_counter() - t0
+    return construct_s, mem / len(objs), pipeline_s
+
+def main():
+    args = rows_args(N)
+    print(f"{N} records")
+    print(f"{'type':<14}{'construct ms':>14}{'bytes/record':>14}{'enrich+dedup ms':>17}")
+    for name, cls in (("Measurement", Measurement), ("Row", Row)):
+        c, b, p = measure(cls, [dict(a) for a in args])
+        print(f"{name:<14}{c * 1000:>14.1f}{b:>14.0f}{p * 1000:>17.1f}")
+
+if __name__ == "__main__":
+    main()
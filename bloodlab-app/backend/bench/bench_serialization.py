@@ -0,0 +1,61 @@
+"""
+Serialization cost per 1,000 measurements: old path vs the orjson fast path.
+
+    cd backend && python bench/bench_serialization.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "bench-placeholder-key")
+
+from main import Measurement, ParseResponse  # noqa: E402
+from serialization import dumps, compact  # noqa: E402
+
+N = 1000
+
+def make_measurements(n: int):
+    return [
+        Measurement(
+            name=f"Hémoglobine {i}", value=f"{130 + i % 40}", unit="g/L",
+            reference_text="120 – 160", ref_low=120.0, ref_high=160.0, flag="normal",
+            source_file="report.pdf#1", page=1 + i // 40, group="Hematologie",
+        )
+        for i in range(n)
+    ]
+
+def main():
+    ms = make_measurements(N)
+    resp = ParseResponse(measurements=ms, notes="Processed 25 pages")
+
+    # /api/process: response_model validation + model_dump + json.dumps (what FastAPI did)
+    def process_before():
+        validated = ParseResponse.model_validate(resp.model_dump())
+        return json.dumps(validated.model_dump(mode="json"), ensure_ascii=False).encode("utf-8")
+
+    def process_after():
+        return dumps(ParseResponse.model_construct(measurements=ms, notes=resp.notes))
+
+    # SSE delta/page payloads
+    def sse_before():
+        return json.dumps({"items": [m.model_dump() for m in ms]}, ensure_ascii=False).encode("utf-8")
+
+    def sse_after():
+        return dumps({"items": [compact(m) for m in ms]})
+
+    assert json.loads(process_before()) == json.loads(process_after())
+
+    rows = [
+        ("/api/process response", process_before, process_after),
+        ("SSE items payload", sse_before, sse_after),
+    ]
+    print(f"{'path':<24}{'before ms/1k':>14}{'after ms/1k':>14}{'speedup':>10}")
+    for name, before, after in rows:
+        tb = min(timeit.repeat(before, number=20, repeat=5)) / 20 * 1000
+        ta = min(timeit.repeat(after, number=20, repeat=5)) / 20 * 1000
+        print(f"{name:<24}{tb:>14.3f}{ta:>14.3f}{tb / ta:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+# Per-provider circuit breaker for model calls. While a provider is failing
+# (errors or very slow answers over the recent calls) the breaker opens and
+# callers fail fast or go to a failover provider instead of each waiting out
+# its own timeout. After open_seconds one probe call is let through
+# (half-open); its outcome closes the breaker or opens it again.
+
+class CircuitOpen(Exception):
+    """The provider's breaker is open and there is no failover for the call."""
+    def __init__(self, provider: str):
+        super().__init__(f"{provider} unavailable (circuit open)")
+        self.provider = provider
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_seconds: float = 60.0, open_seconds: float = 30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque(maxlen=window)    # True = good call
+        self.state = "closed"                           # closed | open | half_open
+        self._opened_at = 0.0
+        self._probe_at: Optional[float] = None
+        self.opened = 0                                 # times the breaker tripped
+
+    def allow(self) -> bool:
+        """May a call go to this provider now? In half-open state only one probe at a time."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open":
+                if now - self._opened_at < self.open_seconds:
+                    return False
+                self.state = "half_open"
+                self._probe_at = now
+                return True
+            # half_open: a probe that never reported back (cancelled call) is replaced
+            if self._probe_at is not None and now - self._probe_at < self.open_seconds:
+                return False
+            self._probe_at = now
+            return True
+
+    def record(self, ok: bool, seconds: float = 0.0):
+        """Outcome of a call that was allowed; slow successes count as failures."""
+        good = ok and seconds < self.slow_seconds
+        with self._lock:
+            if self.state == "half_open":
+                if good:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    print(f"Circuit {self.name}: probe succeeded, closed")
+                else:
+                    self._trip()
+                return
+            self._outcomes.append(good)
+            if self.state == "closed" and len(self._outcomes) >= self.min_calls:
+                bad = self._outcomes.count(False) / len(self._outcomes)
+                if bad >= self.failure_rate:
+                    self._trip()
+
+    def _trip(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probe_at = None
+        self.opened += 1
+        print(f"Circuit {self.name}: open for {self.open_seconds:g}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            n = len(self._outcomes)
+            return {
+                "state": self.state,
+                "recent_calls": n,
+                "recent_failure_rate": round(self._outcomes.count(False) / n, 3) if n else 0.0,
+                "times_opened": self.opened,
+            }
@@ -0,0 +1,204 @@
+"""
+Offline bulk ingestion of archived lab reports, without the HTTP API.
+
+    python bulk_ingest.py /archive/reports -o results.jsonl
+    python bulk_ingest.py manifest.txt -o results.jsonl --render-workers 4 --concurrency 8
+
+INPUT is a directory (walked recursively) or a manifest: a text file with one
+path per line, or JSONL with {"path": ...} objects. Every finished file appends
+one JSONL record with the deduplicated ParseResponse. A file with pages whose OCR
+failed is recorded as "partial" (with the pages that did succeed). The output
+doubles as the checkpoint: re-running skips paths that already have an "ok"
+record, so partial and error files are retried.
+
+Rasterization (PDF -> PNG pages, pre-filter) runs in a process pool; OCR runs in
+a bounded thread pool through the same process_single_page/enrich_with_db path
+as the server.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Callable
+
+from main import (
+    MODEL_NAME, OcrFailed, models, prepare_pages, process_single_page, parse_response,
+    failed_skip, unavailable_skip,
+)
+from breaker import CircuitOpen
+from llm_usage import RequestUsage
+from serialization import dumps
+
+SUPPORTED_EXT = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp", ".bmp"}
+
+# ---------- inputs ----------
+def iter_input_paths(source: str) -> List[str]:
+    if os.path.isdir(source):
+        out = []
+        for root, _, names in os.walk(source):
+            for n in sorted(names):
+                if os.path.splitext(n)[1].lower() in SUPPORTED_EXT:
+                    out.append(os.path.join(root, n))
+        return sorted(out)
+    base = os.path.dirname(os.path.abspath(source))
+    out = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            out.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return out
+
+def load_checkpoint(out_path: str) -> set:
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # torn last line after a crash
+            if rec.get("status") == "ok":
+                done.add(rec["path"])
+    return done
+
+# ---------- pipeline ----------
+def render_file(path: str) -> Tuple[List[Tuple[str, int, bytes]], List[Dict[str, Any]]]:
+    """Process-pool side: read + rasterize + pre-filter one file."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    ctype = mimetypes.guess_type(path)[0]
+    return prepare_pages([(os.path.basename(path), ctype, raw, 1)])
+
+def ingest_file(model, path: str, render_fut: Future, ocr_pool: ThreadPoolExecutor) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        pages, skipped = render_fut.result()
+        if not pages and not skipped:
+            raise ValueError("no pages could be rendered")
+        usage = RequestUsage(client="bulk")
+        futs = [(fn, pn, ocr_pool.submit(process_single_page, model, img, fn, pn, usage)) for fn, pn, img in pages]
+        rows = []
+        failed = 0
+        for fn, pn, fut in futs:
+            try:
+                rows.extend(fut.result())
+            except (OcrFailed, CircuitOpen) as e:
+                failed += 1
+                skipped.append(failed_skip(fn, pn, e) if isinstance(e, OcrFailed) else unavailable_skip(fn, pn, e))
+        return {
+            "path": path,
+            "status": "partial" if failed else "ok",
+            "pages": len(pages),
+            "failed_pages": failed,
+            "skipped": skipped,
+            "seconds": round(time.perf_counter() - t0, 3),
+            "tokens": usage.total_tokens,
+            "result": parse_response(rows, len(pages) - failed, skipped, usage),
+        }
+    except Exception as e:
+        return {"path": path, "status": "error", "error": str(e), "seconds": round(time.perf_counter() - t0, 3)}
+
+def ingest(
+    paths: Iterable[str],
+    out_path: str,
+    render_workers: int = 2,
+    concurrency: int = 4,
+    resume: bool = True,
+    model=None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Importable entry point. Returns totals:
+    {"files", "ok", "partial", "errors", "pages", "failed_pages", "tokens", "seconds", "pages_per_min"}.
+    """
+    paths = list(paths)
+    if resume:
+        done = load_checkpoint(out_path)
+        paths = [p for p in paths if p not in done]
+    model = model or models.get(MODEL_NAME)
+
+    totals = {"files": 0, "ok": 0, "partial": 0, "errors": 0, "pages": 0, "failed_pages": 0, "tokens": 0}
+    t0 = time.perf_counter()
+
+    # files in flight = concurrency: keeps the OCR pool busy without rendering the whole archive ahead
+    with ProcessPoolExecutor(max_workers=render_workers) as render_pool, \
+            ThreadPoolExecutor(max_workers=concurrency) as ocr_pool, \
+            ThreadPoolExecutor(max_workers=concurrency) as file_pool, \
+            open(out_path, "ab") as out:
+        pending = iter(paths)
+        in_flight: set = set()
+
+        def submit_next() -> bool:
+            path = next(pending, None)
+            if path is None:
+                return False
+            in_flight.add(file_pool.submit(ingest_file, model, path, render_pool.submit(render_file, path), ocr_pool))
+            return True
+
+        for _ in range(concurrency):
+            if not submit_next():
+                break
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                rec = fut.result()
+                out.write(dumps(rec) + b"\n")
+                out.flush()
+                totals["files"] += 1
+                totals[{"ok": "ok", "partial": "partial"}.get(rec["status"], "errors")] += 1
+                totals["pages"] += rec.get("pages", 0)
+                totals["failed_pages"] += rec.get("failed_pages", 0)
+                totals["tokens"] += rec.get("tokens", 0)
+                if on_record:
+                    on_record(rec)
+                submit_next()
+
+    totals["seconds"] = round(time.perf_counter() - t0, 3)
+    totals["pages_per_min"] = round(totals["pages"] * 60 / max(totals["seconds"], 1e-9), 1)
+    return totals
+
+# ---------- CLI ----------
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Bulk OCR of lab reports into JSONL")
+    ap.add_argument("input", help="directory to walk, or manifest (.txt paths / .jsonl with 'path')")
+    ap.add_argument("-o", "--output", required=True, help="JSONL output (also the resume checkpoint)")
+    ap.add_argument("--render-workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    ap.add_argument("--concurrency", type=int, default=4, help="max concurrent OCR calls")
+    ap.add_argument("--no-resume", action="store_true", help="reprocess files already in the output")
+    args = ap.parse_args(argv)
+
+    paths = iter_input_paths(args.input)
+    t0 = time.perf_counter()
+    pages_seen = [0]
+
+    def report(rec: Dict[str, Any]):
+        pages_seen[0] += rec.get("pages", 0)
+        rate = pages_seen[0] * 60 / max(time.perf_counter() - t0, 1e-9)
+        status = {
+            "ok": "ok",
+            "partial": f"partial: {rec.get('failed_pages', 0)} pages failed",
+        }.get(rec["status"]) or f"error: {rec['error']}"
+        print(f"{rec['path']}: {rec.get('pages', 0)} pages, {rec.get('tokens', 0)} tokens, {rec['seconds']}s ({status}) "
+              f"| {rate:.1f} pages/min")
+
+    totals = ingest(
+        paths, args.output,
+        render_workers=args.render_workers,
+        concurrency=args.concurrency,
+        resume=not args.no_resume,
+        on_record=report,
+    )
+    print(f"Done: {totals['ok']} ok, {totals['partial']} partial, {totals['errors']} errors, {totals['pages']} pages "
+          f"({totals['failed_pages']} failed), {totals['tokens']} tokens "
+          f"in {totals['seconds']}s ({totals['pages_per_min']} pages/min)")
+    return 0 if totals["errors"] == 0 and totals["partial"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import math
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Derived indices (eGFR, FIB-4, De Ritis, AIP, lipid ratios, NLR, HbA1c -> eAG),
+# evaluated column-wise over many reports at once. Inputs are already resolved to
+# one number per report in the unit listed in INPUTS (NaN = missing); name
+# resolution and unit conversion (units.py registry) live next to the DB in main.py.
+# Formulas and grading follow frontend/src/ui/components/CompositePanels.jsx.
+
+# input key -> (analyte, unit the formulas use it in, as spelled by units.norm_unit)
+INPUTS: Dict[str, Tuple[str, str]] = {
+    "creatinine_mgdl": ("creatinine", "mg/dl"),
+    "ast": ("ast", "u/l"),
+    "alt": ("alt", "u/l"),
+    "platelets": ("platelets", "10^9/l"),
+    "tg_mmol": ("tg", "mmol/l"),
+    "tg_mgdl": ("tg", "mg/dl"),
+    "hdl_mmol": ("hdl", "mmol/l"),
+    "hdl_mgdl": ("hdl", "mg/dl"),
+    "tc_mmol": ("tc", "mmol/l"),
+    "hba1c": ("hba1c", "%"),
+}
+# NLR is a ratio: neut and lymph only need to share a variant (both % or both absolute)
+INPUT_KEYS = tuple(INPUTS) + ("neut", "lymph")
+
+# ---------- demographics ----------
+SEX_ALIASES = {"female": "female", "f": "female", "woman": "female",
+               "male": "male", "m": "male", "man": "male"}
+MAX_AGE = 120
+
+def normalize_sex(s: Optional[str]) -> Optional[str]:
+    """'female' / 'male', or None when the value does not say which."""
+    return SEX_ALIASES.get((s or "").strip().lower())
+
+def valid_age(a: Optional[float]) -> bool:
+    return a is not None and math.isfinite(a) and 0 < a <= MAX_AGE
+
+# ---------- batch evaluation ----------
+def evaluate(inputs: Dict[str, np.ndarray], age: np.ndarray, sex: List[Optional[str]]) -> Dict[str, np.ndarray]:
+    """
+    All arrays have one slot per report (sex from normalize_sex); results are NaN
+    where an index cannot be computed. eGFR needs a known sex: there is no neutral
+    form of CKD-EPI, and guessing one grade for everyone else is wrong for half of them.
+    """
+    g = {k: inputs.get(k, np.full(len(age), np.nan)) for k in INPUT_KEYS}
+    age = np.where((age > 0) & (age <= MAX_AGE), age, np.nan)
+    female = np.array([x == "female" for x in sex], dtype=bool)
+    known = np.array([x is not None for x in sex], dtype=bool)
+    out: Dict[str, np.ndarray] = {}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # eGFR CKD-EPI 2021 (race-free)
+        kappa = np.where(female, 0.7, 0.9)
+        alpha = np.where(female, -0.241, -0.302)
+        scr_k = g["creatinine_mgdl"] / kappa
+        sex_f = np.where(female, 1.012, 1.0)
+        egfr = (142 * np.minimum(scr_k, 1) ** alpha * np.maximum(scr_k, 1) ** -1.2
+                * 0.9938 ** age * sex_f)
+        out["egfr"] = np.where(known, egfr, np.nan)
+
+        # FIB-4 = age * AST / (PLT * sqrt(ALT))
+        plt = np.where(g["platelets"] > 0, g["platelets"], np.nan)
+        out["fib4"] = age * g["ast"] / (plt * np.sqrt(g["alt"]))
+
+        alt = np.where(g["alt"] != 0, g["alt"], np.nan)
+        out["de_ritis"] = g["ast"] / alt
+
+        hdl = np.where(g["hdl_mmol"] > 0, g["hdl_mmol"], np.nan)
+        out["aip"] = np.log10(g["tg_mmol"] / hdl)
+        out["tg_hdl"] = g["tg_mgdl"] / np.where(g["hdl_mgdl"] > 0, g["hdl_mgdl"], np.nan)
+        out["tc_hdl"] = g["tc_mmol"] / hdl
+
+        lymph = np.where(g["lymph"] != 0, g["lymph"], np.nan)
+        out["nlr"] = g["neut"] / lymph
+
+        out["hba1c"] = g["hba1c"]
+        out["eag_mgdl"] = 28.7 * g["hba1c"] - 46.7
+
+    for k, v in out.items():
+        out[k] = np.where(np.isfinite(v), v, np.nan)
+    return out
+
+# ---------- presentation ----------
+def _pct(x: float, top: float, bottom: float = 0.0) -> int:
+    return int(max(0, min(100, round((min(max(x, bottom), top) - bottom) / (top - bottom) * 100))))
+
+def _egfr_grade(e: float) -> str:
+    return ("G1 (normal)" if e >= 90 else "G2 (mild ↓)" if e >= 60 else "G3a (mild–mod ↓)" if e >= 45
+            else "G3b (mod–severe ↓)" if e >= 30 else "G4 (severe ↓)" if e >= 15 else "G5 (failure)")
+
+def cards_for(res: Dict[str, np.ndarray], i: int, has_creatinine: bool, has_demographics: bool,
+              age: float) -> List[Dict[str, Any]]:
+    """Cards for report i, in the order the UI shows them."""
+    def val(k: str) -> Optional[float]:
+        v = float(res[k][i])
+        return None if math.isnan(v) else v
+
+    cards: List[Dict[str, Any]] = []
+
+    e = val("egfr")
+    if e is not None:
+        cards.append({"key": "egfr", "name": "Kidney function", "label": "eGFR (CKD-EPI 2021)",
+                      "value": round(e), "display": f"{e:.0f}", "unit": "mL/min/1.73m²",
+                      "grade": _egfr_grade(e), "pct": _pct(e, 120)})
+    elif has_creatinine and not has_demographics:
+        cards.append({"key": "egfr", "name": "Kidney function", "label": "eGFR (CKD-EPI 2021)",
+                      "value": None, "display": "—", "unit": "mL/min/1.73m²",
+                      "grade": "Age and sex required", "pct": 0})
+
+    f = val("fib4")
+    if f is not None:
+        low = 2.0 if age >= 65 else 1.3
+        grade = "low fibrosis risk" if f < low else "average risk" if f <= 2.67 else "high fibrosis risk"
+        cards.append({"key": "fib4", "name": "Liver fibrosis risk", "label": "FIB-4",
+                      "value": round(f, 2), "display": f"{f:.2f}", "unit": "", "grade": grade, "pct": _pct(f, 3)})
+
+    r = val("de_ritis")
+    if r is not None:
+        grade = ("↑ Possible fibrosis / alcoholic liver damage" if r > 1.5
+                 else "↓ Suggests hepatocellular injury (ALT > AST)" if r < 0.8 else "Normal/nonspecific")
+        cards.append({"key": "de_ritis", "name": "Liver function", "label": "De Ritis (AST/ALT)",
+                      "value": round(r, 2), "display": f"{r:.2f}", "unit": "", "grade": grade, "pct": _pct(r, 2)})
+
+    a = val("aip")
+    if a is not None:
+        grade = "Low risk" if a < 0.11 else "Average risk" if a <= 0.21 else "High risk"
+        cards.append({"key": "aip", "name": "Atherogenic risk", "label": "AIP = log10(TG/HDL)",
+                      "value": round(a, 2), "display": f"{a:.2f}", "unit": "", "grade": grade, "pct": _pct(a, 0.5)})
+
+    t = val("tg_hdl")
+    if t is not None:
+        grade = "Excellent" if t < 2 else "Acceptable" if t <= 3 else "Unfavorable"
+        cards.append({"key": "tg_hdl", "name": "Lipid risk", "label": "TG/HDL (mg/dL)",
+                      "value": round(t, 2), "display": f"{t:.2f}", "unit": "", "grade": grade, "pct": _pct(t, 5)})
+
+    c = val("tc_hdl")
+    if c is not None:
+        grade = "Target" if c < 3.5 else "Border" if c <= 5 else "High"
+        cards.append({"key": "tc_hdl", "name": "Lipid risk", "label": "TC/HDL (mg/dL)",
+                      "value": round(c, 2), "display": f"{c:.2f}", "unit": "", "grade": grade, "pct": _pct(c, 6)})
+
+    n = val("nlr")
+    if n is not None:
+        grade = ("↑ Possible systemic inflammation / infection" if n > 3
+                 else "↓ Lymphocytosis / variant of normal" if n < 1 else "Normal")
+        cards.append({"key": "nlr", "name": "Inflammation", "label": "NLR",
+                      "value": round(n, 2), "display": f"{n:.2f}", "unit": "", "grade": grade, "pct": _pct(n, 5)})
+
+    h = val("hba1c")
+    if h is not None:
+        eag = float(res["eag_mgdl"][i])
+        grade = "Diabetic risk" if h >= 6.5 else "Prediabetes risk" if h >= 5.7 else "Optimal"
+        cards.append({"key": "eag", "name": "Glycemic control",
+                      "label": f"eAG ≈ {eag:.0f} mg/dL ({eag / 18:.1f} mmol/L)",
+                      "value": round(eag, 1), "display": f"{h:.1f} %", "unit": "mg/dL", "grade": grade,
+                      "pct": _pct(h, 9, 4)})
+
+    return cards
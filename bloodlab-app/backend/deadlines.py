@@ -0,0 +1,63 @@
+import threading
+import time
+from typing import Optional
+
+# Per-request cancellation and time limit. One Deadline is shared by every page
+# call of a request: the HTTP side cancels it when the client goes away, model
+# calls read the remaining time as their timeout and stop between streamed
+# chunks once it is done.
+
+class Cancelled(Exception):
+    """The request was cancelled or ran out of time; reason is "cancelled" or "deadline"."""
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Deadline:
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires_at = time.monotonic() + seconds if seconds and seconds > 0 else None
+        self._cancelled = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def done(self) -> bool:
+        return self.cancelled or self.expired
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (None = no time limit)."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def why(self) -> Optional[str]:
+        if self.cancelled:
+            return "cancelled"
+        if self.expired:
+            return "deadline"
+        return None
+
+    def check(self):
+        """Raise Cancelled if the request should not start any more work."""
+        if self.done:
+            raise Cancelled(self.why())
+
+def parse_seconds(value: Optional[str]) -> float:
+    """Header value in seconds ("30", "12.5"); anything else means no limit."""
+    try:
+        v = float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+    return v if v > 0 else 0.0
@@ -0,0 +1,89 @@
+import time
+import uuid
+from typing import List, Dict, Any, Tuple, Optional
+
+from sqlite_store import SQLiteStore
+
+# Optional per-patient result history: deduplicated measurements are stored once,
+# so trends and "latest value" queries never need the original report re-OCR'd.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    report_id TEXT NOT NULL,
+    report_date TEXT NOT NULL,         -- ISO YYYY-MM-DD
+    canonical TEXT NOT NULL,
+    value TEXT,                        -- as printed
+    value_num REAL,
+    unit TEXT,
+    flag TEXT,
+    grp TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_patient_metric_date ON results(patient_id, canonical, report_date);
+CREATE INDEX IF NOT EXISTS results_patient_report ON results(patient_id, report_id);
+"""
+
+# (canonical, value, value_num, unit, flag, group)
+HistoryRow = Tuple[str, Optional[str], Optional[float], Optional[str], Optional[str], Optional[str]]
+
+class HistoryStore(SQLiteStore):
+    def __init__(self, path: str):
+        super().__init__(path, SCHEMA)
+
+    def store_report(self, patient_id: str, rows: List[HistoryRow], report_date: str,
+                     report_id: Optional[str] = None) -> str:
+        """Idempotent per (patient_id, report_id): storing the same report again replaces it."""
+        report_id = report_id or uuid.uuid4().hex
+        now = time.time()
+        with self._tx() as c:
+            c.execute("DELETE FROM results WHERE patient_id = ? AND report_id = ?", (patient_id, report_id))
+            c.executemany(
+                "INSERT INTO results (patient_id, report_id, report_date, canonical, value, value_num, unit, flag, grp, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(patient_id, report_id, report_date, *r, now) for r in rows],
+            )
+        return report_id
+
+    def series(self, patient_id: str, names: List[str],
+               since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql = (
+            "SELECT report_date, value, value_num, unit, flag, report_id, canonical FROM results "
+            f"WHERE patient_id = ? AND canonical IN ({','.join('?' * len(names))})"
+        )
+        args: List[Any] = [patient_id, *names]
+        if since:
+            sql += " AND report_date >= ?"
+            args.append(since)
+        if until:
+            sql += " AND report_date <= ?"
+            args.append(until)
+        sql += " ORDER BY report_date, id"
+        with self._tx() as c:
+            rows = c.execute(sql, args).fetchall()
+        return [
+            {"date": r[0], "value": r[1], "value_num": r[2], "unit": r[3], "flag": r[4], "report_id": r[5], "name": r[6]}
+            for r in rows
+        ]
+
+    def latest(self, patient_id: str) -> List[Dict[str, Any]]:
+        with self._tx() as c:
+            rows = c.execute(
+                "SELECT canonical, report_date, value, value_num, unit, flag, grp, report_id FROM ("
+                "  SELECT *, ROW_NUMBER() OVER (PARTITION BY canonical ORDER BY report_date DESC, id DESC) AS rn"
+                "  FROM results WHERE patient_id = ?"
+                ") WHERE rn = 1 ORDER BY canonical",
+                (patient_id,),
+            ).fetchall()
+        return [
+            {"name": r[0], "date": r[1], "value": r[2], "value_num": r[3], "unit": r[4],
+             "flag": r[5], "group": r[6], "report_id": r[7]}
+            for r in rows
+        ]
+
+    def delete_report(self, patient_id: str, report_id: str) -> int:
+        with self._tx() as c:
+            return c.execute(
+                "DELETE FROM results WHERE patient_id = ? AND report_id = ?", (patient_id, report_id)
+            ).rowcount
@@ -0,0 +1,283 @@
+import json
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Tuple, Optional, Callable
+
+from sqlite_store import SQLiteStore
+
+# Persistent job queue for /api/jobs: uploads are stored in SQLite, workers claim
+# queued jobs and write per-page results back, so a restart resumes where it stopped.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,              -- queued | running | done | failed
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    total_pages INTEGER,
+    result TEXT,                       -- final ParseResponse JSON
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0   -- times claimed by a worker
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs(status, created_at);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    status TEXT NOT NULL,              -- done | skipped | failed (OCR error; retried on rerun)
+    items TEXT,                        -- measurements JSON, or skip info
+    PRIMARY KEY (job_id, filename, page)
+);
+"""
+
+class JobStore(SQLiteStore):
+    def __init__(self, path: str):
+        super().__init__(path, SCHEMA)
+
+    def _migrate(self, c):
+        self._add_column(c, "jobs", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+    # ----- ingestion -----
+    def create(self, files: List[Tuple[str, Optional[str], bytes, int]]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._tx() as c:
+            c.execute(
+                "INSERT INTO jobs (id, status, created_at, updated_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, now, now),
+            )
+            c.executemany(
+                "INSERT INTO job_files (job_id, idx, filename, content_type, data) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, idx, name, ctype, raw) for name, ctype, raw, idx in files],
+            )
+        return job_id
+
+    # ----- worker side -----
+    def claim(self) -> Optional[str]:
+        with self._tx() as c:
+            row = c.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row:
+                c.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (time.time(), row[0]),
+                )
+        return row[0] if row else None
+
+    def requeue_stale(self, stale_s: float, max_attempts: int = 0) -> Tuple[int, int]:
+        """
+        Jobs left 'running' by a crashed/stopped worker go back to the queue.
+        A worker heartbeats its job (touch) while it runs, however long a page
+        takes, so a quiet job is an orphaned one. A job that has already had
+        max_attempts workers die on it (0 = no limit) is failed instead: it is
+        likely what kills them. Returns (requeued, failed).
+        """
+        now = time.time()
+        with self._tx() as c:
+            failed: List[str] = []
+            if max_attempts > 0:
+                failed = [r[0] for r in c.execute(
+                    "SELECT id FROM jobs WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                    (now - stale_s, max_attempts),
+                )]
+                for job_id in failed:
+                    c.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                        (f"Gave up after {max_attempts} attempts: the worker stopped each time", now, job_id),
+                    )
+                    c.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            cur = c.execute(
+                "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running' AND updated_at < ?",
+                (now, now - stale_s),
+            )
+            return cur.rowcount, len(failed)
+
+    def touch(self, job_id: str):
+        with self._tx() as c:
+            c.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def load_files(self, job_id: str) -> List[Tuple[str, Optional[str], bytes, int]]:
+        with self._tx() as c:
+            rows = c.execute(
+                "SELECT filename, content_type, data, idx FROM job_files WHERE job_id = ? ORDER BY idx",
+                (job_id,),
+            ).fetchall()
+        return [(r[0], r[1], bytes(r[2]), r[3]) for r in rows]
+
+    def set_total(self, job_id: str, total_pages: int):
+        with self._tx() as c:
+            c.execute(
+                "UPDATE jobs SET total_pages = ?, updated_at = ? WHERE id = ?",
+                (total_pages, time.time(), job_id),
+            )
+
+    def page_results(self, job_id: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        with self._tx() as c:
+            rows = c.execute(
+                "SELECT filename, page, status, items FROM job_pages WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {(r[0], r[1]): {"status": r[2], "items": json.loads(r[3] or "null")} for r in rows}
+
+    def save_page(self, job_id: str, filename: str, page: int, status: str, items: Any):
+        with self._tx() as c:
+            c.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, filename, page, status, items) VALUES (?, ?, ?, ?, ?)",
+                (job_id, filename, page, status, json.dumps(items, ensure_ascii=False)),
+            )
+            c.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        status = "failed" if error else "done"
+        with self._tx() as c:
+            c.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+            # uploads are only needed while the job can still be (re)run
+            c.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+
+    # ----- reading -----
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._tx() as c:
+            row = c.execute(
+                "SELECT id, status, created_at, updated_at, total_pages, result, error, attempts FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if not row:
+                return None
+            pages = c.execute(
+                "SELECT filename, page, status, items FROM job_pages WHERE job_id = ? ORDER BY rowid",
+                (job_id,),
+            ).fetchall()
+        return {
+            "id": row[0],
+            "status": row[1],
+            "created_at": row[2],
+            "updated_at": row[3],
+            "total_pages": row[4],
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+            "attempts": row[7],
+            "pages": [
+                {
+                    "filename": p[0],
+                    "page": p[1],
+                    "status": p[2],
+                    "count": len(json.loads(p[3] or "[]")) if p[2] == "done" else 0,
+                }
+                for p in pages
+            ],
+        }
+
+    def purge(self, older_than_s: float) -> int:
+        cutoff = time.time() - older_than_s
+        with self._tx() as c:
+            ids = [r[0] for r in c.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+            )]
+            for job_id in ids:
+                c.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+                c.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+                c.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+class WorkerPool:
+    """
+    N daemon threads polling the store. `runner(store, job_id)` does the actual work
+    and must call store.finish(); exceptions it lets through mark the job failed.
+    Several pools (API process + standalone workers) can share one store.
+    """
+    def __init__(self, store: JobStore, runner: Callable[[JobStore, str], None],
+                 workers: int = 2, poll_interval: float = 1.0,
+                 stale_s: float = 300.0, retention_s: float = 24 * 3600, max_attempts: int = 3):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_s = stale_s
+        self.max_attempts = max_attempts
+        self.retention_s = retention_s
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._maint_lock = threading.Lock()
+        self._last_maint = 0.0
+
+    def start(self):
+        self._maintain()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads.clear()
+
+    def _maintain(self):
+        if not self._maint_lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self._last_maint < 60:
+                return
+            self._last_maint = time.time()
+            n, failed = self.store.requeue_stale(self.stale_s, self.max_attempts)
+            if n:
+                print(f"Requeued {n} interrupted jobs")
+            if failed:
+                print(f"Failed {failed} jobs interrupted {self.max_attempts} times")
+            self.store.purge(self.retention_s)
+        except Exception as e:
+            print(f"Job store maintenance error: {e}")
+        finally:
+            self._maint_lock.release()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._maintain()
+            try:
+                job_id = self.store.claim()
+            except Exception as e:
+                print(f"Job claim error: {e}")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            done = threading.Event()
+            beat = threading.Thread(target=self._heartbeat, args=(job_id, done), name=f"job-heartbeat-{job_id[:8]}", daemon=True)
+            beat.start()
+            try:
+                self.runner(self.store, job_id)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.store.finish(job_id, error=str(e))
+            finally:
+                done.set()
+                beat.join()
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        # a slow page (long generation, rate-limit waits) must not look like an orphaned job
+        interval = max(1.0, self.stale_s / 4)
+        while not done.wait(interval):
+            try:
+                self.store.touch(job_id)
+            except Exception as e:
+                print(f"Job {job_id} heartbeat error: {e}")
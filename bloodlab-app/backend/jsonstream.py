@@ -0,0 +1,69 @@
+import json
+from typing import List, Dict, Any, Optional
+
+# Incremental scanner for streamed OCR output. The model writes
+# {"measurements": [{...}, {...}, ...]} a few tokens at a time; every object of
+# that array is handed out as soon as its closing brace arrives, long before the
+# whole page is generated. Text around the JSON (markdown fences, prose) is
+# ignored. A bare top-level array is accepted too.
+
+class MeasurementParser:
+    def __init__(self, key: str = "measurements"):
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._stack: List[str] = []       # "{", "[" or "M" (the target array)
+        self._in_str = False
+        self._esc = False
+        self._str_start = 0
+        self._last_str: Optional[str] = None
+        self._colon_key: Optional[str] = None
+        self._prev = ""                   # previous significant char outside strings
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Add model output; returns the measurement objects completed by it."""
+        out: List[Dict[str, Any]] = []
+        self.text += chunk
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    self._last_str = text[self._str_start + 1:i]
+                    self._prev = c
+                continue
+            if c == '"':
+                self._in_str = True
+                self._str_start = i
+            elif c == ":":
+                self._colon_key = self._last_str
+            elif c == "[":
+                target = (not self._stack) or (
+                    self._stack[-1] == "{" and self._prev == ":" and self._colon_key == self.key
+                )
+                self._stack.append("M" if target and "M" not in self._stack else "[")
+            elif c == "{":
+                if self._stack and self._stack[-1] == "M":
+                    self._item_start = i
+                self._stack.append("{")
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if c == "}" and self._stack and self._stack[-1] == "M" and self._item_start is not None:
+                    try:
+                        obj = json.loads(text[self._item_start:i + 1])
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        out.append(obj)
+                    self._item_start = None
+            if not c.isspace():
+                self._prev = c
+        self._pos = len(text)
+        return out
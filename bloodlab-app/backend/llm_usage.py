@@ -0,0 +1,166 @@
+import threading
+from typing import Any, Dict, Optional
+
+# Token accounting for model calls. Prompt-cache hits show up in the response
+# usage as prompt_tokens_details.cached_tokens; totals per call kind let us check
+# the hit rate and what a hit saves in latency.
+
+# USD per 1M tokens: (input, cached input, output). Unlisted models (Gemma via the
+# Gemini API) are counted in tokens only.
+PRICES_PER_MTOK: Dict[str, tuple] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gemini-1.5-flash": (0.075, 0.01875, 0.30),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+}
+
+def cost_usd(model: str, counts: Dict[str, int]) -> float:
+    price = PRICES_PER_MTOK.get(model.split("/")[-1])
+    if not price:
+        return 0.0
+    fresh = counts["prompt_tokens"] - counts["cached_tokens"]
+    return (fresh * price[0] + counts["cached_tokens"] * price[1] + counts["completion_tokens"] * price[2]) / 1e6
+
+def genai_usage_counts(resp: Any) -> Dict[str, int]:
+    """Same shape as usage_counts, from a google.generativeai response's usage_metadata."""
+    u = getattr(resp, "usage_metadata", None)
+    return {
+        "prompt_tokens": getattr(u, "prompt_token_count", None) or 0,
+        "cached_tokens": getattr(u, "cached_content_token_count", None) or 0,
+        "completion_tokens": getattr(u, "candidates_token_count", None) or 0,
+    }
+
+def usage_counts(resp: Any) -> Dict[str, int]:
+    u = getattr(resp, "usage", None)
+    details = getattr(u, "prompt_tokens_details", None)
+    if isinstance(details, dict):       # older SDKs keep unknown fields as plain dicts
+        cached = details.get("cached_tokens") or 0
+    else:
+        cached = getattr(details, "cached_tokens", None) or 0
+    return {
+        "prompt_tokens": getattr(u, "prompt_tokens", None) or 0,
+        "cached_tokens": cached,
+        "completion_tokens": getattr(u, "completion_tokens", None) or 0,
+    }
+
+class UsageStats:
+    """
+    Thread-safe per-kind totals (calls, tokens, latency split by cache hit/miss).
+    With max_kinds > 0, kinds beyond the first max_kinds are booked to "other",
+    so keys taken from requests (client ids) cannot grow it without bound.
+    """
+    OTHER = "other"
+
+    def __init__(self, max_kinds: int = 0):
+        self.max_kinds = max_kinds
+        self._lock = threading.Lock()
+        self._by_kind: Dict[str, Dict[str, float]] = {}
+
+    def record(self, kind: str, counts: Dict[str, int], seconds: float):
+        hit = counts["cached_tokens"] > 0
+        with self._lock:
+            if self.max_kinds and kind not in self._by_kind and len(self._by_kind) >= self.max_kinds:
+                kind = self.OTHER
+            k = self._by_kind.setdefault(kind, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                "hits": 0, "seconds_hit": 0.0, "seconds_miss": 0.0, "cost_usd": 0.0,
+            })
+            k["calls"] += 1
+            k["prompt_tokens"] += counts["prompt_tokens"]
+            k["cached_tokens"] += counts["cached_tokens"]
+            k["completion_tokens"] += counts["completion_tokens"]
+            k["cost_usd"] += counts.get("cost_usd", 0.0)
+            k["hits"] += 1 if hit else 0
+            k["seconds_hit" if hit else "seconds_miss"] += seconds
+
+    @staticmethod
+    def _view(k: Dict[str, float]) -> Dict[str, Any]:
+        misses = k["calls"] - k["hits"]
+        return {
+            "calls": k["calls"],
+            "prompt_tokens": k["prompt_tokens"],
+            "cached_tokens": k["cached_tokens"],
+            "completion_tokens": k["completion_tokens"],
+            "cost_usd": round(k["cost_usd"], 6),
+            "cached_share": round(k["cached_tokens"] / k["prompt_tokens"], 4) if k["prompt_tokens"] else 0.0,
+            "hit_rate": round(k["hits"] / k["calls"], 4) if k["calls"] else 0.0,
+            "avg_seconds_hit": round(k["seconds_hit"] / k["hits"], 3) if k["hits"] else None,
+            "avg_seconds_miss": round(k["seconds_miss"] / misses, 3) if misses else None,
+        }
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {kind: self._view(k) for kind, k in self._by_kind.items()}
+
+    def total(self) -> Dict[str, Any]:
+        """All kinds added up (no per-kind keys)."""
+        with self._lock:
+            t: Dict[str, float] = {}
+            for k in self._by_kind.values():
+                for name, v in k.items():
+                    t[name] = t.get(name, 0) + v
+        return self._view(t) if t else {}
+
+class RequestUsage:
+    """
+    Token totals of one request (an upload, a job, a summary). Calls are also
+    booked to `ledger` under the client id. budget_tokens > 0 caps the request:
+    callers check `exhausted` before issuing the next page call.
+    """
+    def __init__(self, budget_tokens: int = 0, client: str = "anonymous", ledger: Optional[UsageStats] = None):
+        self.budget_tokens = budget_tokens
+        self.client = client
+        self.ledger = ledger
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def add(self, model: str, counts: Dict[str, int], seconds: float = 0.0):
+        c = dict(counts, cost_usd=cost_usd(model, counts))
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += c["prompt_tokens"]
+            self.cached_tokens += c["cached_tokens"]
+            self.completion_tokens += c["completion_tokens"]
+            self.cost += c["cost_usd"]
+        if self.ledger is not None:
+            self.ledger.record(self.client, c, seconds)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def exhausted(self) -> bool:
+        return self.budget_tokens > 0 and self.total_tokens >= self.budget_tokens
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost, 6),
+            "budget_tokens": self.budget_tokens or None,
+        }
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Usage-Tokens": str(self.total_tokens),
+            "X-Usage-Prompt-Tokens": str(self.prompt_tokens),
+            "X-Usage-Cached-Tokens": str(self.cached_tokens),
+            "X-Usage-Completion-Tokens": str(self.completion_tokens),
+            "X-Usage-Cost-USD": f"{self.cost:.6f}",
+        }
+
+    def note(self) -> str:
+        s = f"; tokens: {self.total_tokens} ({self.cached_tokens} cached)"
+        if self.cost:
+            s += f", ${self.cost:.4f}"
+        if self.budget_tokens:
+            s += f", budget {self.budget_tokens}"
+        return s
@@ -0,0 +1,197 @@
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+# Deterministic rendering of the SUMMARY_SYSTEM markdown skeleton. Every
+# ✅/⚠️/❌ in that template follows from the value and its reference bounds, so
+# the per-parameter sections are built locally in milliseconds; a model is only
+# needed (optionally) for the free-text "Final Summary".
+
+LOCALES = ("ru", "en", "ua")
+DB_LANG = {"ru": "ru", "en": "en", "ua": "uk"}   # locale -> key in the DB "names" map
+
+# template order
+SECTIONS = ("cbc", "biochem", "electrolytes", "coag", "other")
+
+T: Dict[str, Dict[str, str]] = {
+    "en": {
+        "title": "# 🧪 Blood Test Summary",
+        "cbc": "## 🔹 Complete Blood Count (CBC)",
+        "biochem": "## 🔹 Biochemistry",
+        "electrolytes": "## 🔹 Electrolytes",
+        "coag": "## 🔹 Coagulation Panel",
+        "other": "## 🔹 Other parameters",
+        "final": "## 📊 Final Summary",
+        "ref": "reference",
+        "ok": "within the reference range",
+        "near_low": "near the lower limit",
+        "near_high": "near the upper limit",
+        "low": "below the reference range",
+        "high": "above the reference range",
+        "no_ref": "no reference range",
+        "n_ok": "{ok} of {total} parameters are within their reference ranges.",
+        "out": "Outside the range: {items}.",
+        "border": "Borderline: {items}.",
+        "all_ok": "No deviations from the reference ranges were found.",
+        "advice": "This is an automated overview, not a diagnosis. Discuss any deviations with a doctor, "
+                  "especially if they persist on repeat tests or come with symptoms.",
+    },
+    "ru": {
+        "title": "# 🧪 Сводка анализа крови",
+        "cbc": "## 🔹 Общий анализ крови (ОАК)",
+        "biochem": "## 🔹 Биохимия",
+        "electrolytes": "## 🔹 Электролиты",
+        "coag": "## 🔹 Коагулограмма",
+        "other": "## 🔹 Другие показатели",
+        "final": "## 📊 Итоговое заключение",
+        "ref": "референс",
+        "ok": "в пределах нормы",
+        "near_low": "у нижней границы нормы",
+        "near_high": "у верхней границы нормы",
+        "low": "ниже нормы",
+        "high": "выше нормы",
+        "no_ref": "референс не указан",
+        "n_ok": "{ok} из {total} показателей в пределах референсных значений.",
+        "out": "Вне нормы: {items}.",
+        "border": "Пограничные значения: {items}.",
+        "all_ok": "Отклонений от референсных значений не выявлено.",
+        "advice": "Это автоматический обзор, а не диагноз. Обсудите отклонения с врачом, "
+                  "особенно если они сохраняются при повторном анализе или сопровождаются симптомами.",
+    },
+    "ua": {
+        "title": "# 🧪 Підсумок аналізу крові",
+        "cbc": "## 🔹 Загальний аналіз крові (ЗАК)",
+        "biochem": "## 🔹 Біохімія",
+        "electrolytes": "## 🔹 Електроліти",
+        "coag": "## 🔹 Коагулограма",
+        "other": "## 🔹 Інші показники",
+        "final": "## 📊 Підсумковий висновок",
+        "ref": "референс",
+        "ok": "в межах норми",
+        "near_low": "біля нижньої межі норми",
+        "near_high": "біля верхньої межі норми",
+        "low": "нижче норми",
+        "high": "вище норми",
+        "no_ref": "референс не вказано",
+        "n_ok": "{ok} з {total} показників у межах референсних значень.",
+        "out": "Поза нормою: {items}.",
+        "border": "Пограничні значення: {items}.",
+        "all_ok": "Відхилень від референсних значень не виявлено.",
+        "advice": "Це автоматичний огляд, а не діагноз. Обговоріть відхилення з лікарем, "
+                  "особливо якщо вони зберігаються при повторному аналізі або супроводжуються симптомами.",
+    },
+}
+
+EMOJI = {"ok": "✅", "near_low": "⚠️", "near_high": "⚠️", "low": "❌", "high": "❌"}
+
+# ---------- section assignment ----------
+CBC = {
+    "Erythrocytes", "Hemoglobin", "Hematocrit", "MCV", "MCH", "MCHC", "RDW-SD", "RDW-CV",
+    "Platelets", "PDW", "MPV", "P-LCR", "PCT", "ESR", "Leukocytes", "Erythroblastes",
+}
+ELECTROLYTES = {"Sodium (Na)", "Potassium", "Potassium (K)", "Calcium"}
+_WBC_RE = re.compile(r"neutrophil|lymphocyt|monocyt|eosinophil|basophil", re.I)
+_COAG_RE = re.compile(r"\b(inr|fibrinogen|prothromb\w*|a?ptt|d-?dimer|thrombin time)\b", re.I)
+_GROUP_SECTION = {"hematologie": "cbc", "biochimie": "biochem", "electrolytes": "electrolytes"}
+
+def section_of(name: str, group: Optional[str]) -> str:
+    if name in CBC or _WBC_RE.search(name):
+        return "cbc"
+    if name in ELECTROLYTES:
+        return "electrolytes"
+    if _COAG_RE.search(name) or "coag" in (group or "").lower():
+        return "coag"
+    return _GROUP_SECTION.get((group or "").strip().lower(), "other")
+
+# ---------- grading ----------
+_FLAG_DIRECTION = {
+    "low": "low", "l": "low", "below": "low", "decreased": "low",
+    "high": "high", "h": "high", "above": "high", "increased": "high",
+    "abnormal": "abnormal", "a": "abnormal",
+}
+
+def grade(value: Optional[float], low: Optional[float], high: Optional[float],
+          flag: Optional[str], margin: float) -> Optional[str]:
+    """
+    ok | near_low | near_high | low | high, or None when unknown. Values outside
+    the range are low/high; values inside it within `margin` (share of the range
+    width, or of the bound if one-sided) of an edge are borderline. An abnormal
+    flag from the report is never softened to borderline or ok.
+    """
+    flag = (flag or "").strip().lower()
+    direction = _FLAG_DIRECTION.get(flag)
+    if value is None or (low is None and high is None):
+        # no numbers to grade: only a directional flag says anything
+        return "ok" if flag == "normal" else direction if direction in ("low", "high") else None
+
+    if low is not None and value < low:
+        g = "low"
+    elif high is not None and value > high:
+        g = "high"
+    else:
+        if low is not None and high is not None:
+            eps = margin * abs(high - low)
+        else:
+            eps = margin * abs(high if high is not None else low)
+        if low is not None and value < low + eps:
+            g = "near_low"
+        elif high is not None and value > high - eps:
+            g = "near_high"
+        else:
+            g = "ok"
+
+    if direction in ("low", "high") and g not in ("low", "high"):
+        return direction
+    if direction == "abnormal" and g not in ("low", "high"):
+        if g in ("near_low", "near_high"):
+            return g[5:]
+        if low is not None and high is not None:
+            return "low" if value < (low + high) / 2 else "high"
+        return "low" if low is not None else "high"
+    return g
+
+# ---------- rendering ----------
+def display_name(m: Any, locale: str, names: Dict[str, Dict[str, str]]) -> str:
+    return (names.get(m.name) or {}).get(DB_LANG[locale]) or m.name
+
+def partition(measurements: List[Any]) -> Dict[str, List[Any]]:
+    """Measurements per template section (keys in SECTIONS order, empty sections left out)."""
+    parts: Dict[str, List[Any]] = {}
+    for m in measurements:
+        parts.setdefault(section_of(m.name, m.group), []).append(m)
+    return {s: parts[s] for s in SECTIONS if s in parts}
+
+def render_line(m: Any, g: Optional[str], locale: str, names: Dict[str, Dict[str, str]]) -> str:
+    t = T[locale]
+    value = f"{m.value} {m.unit}".strip() if m.unit else m.value
+    ref = f", {t['ref']}: {m.reference_text}" if m.reference_text else ""
+    tail = f"{t[g]} {EMOJI[g]}" if g else t["no_ref"]
+    return f"- **{display_name(m, locale, names)}:** {value}{ref} → {tail}"
+
+def heading(key: str, locale: str) -> str:
+    return T[locale][key]
+
+def render_section(key: str, items: List[Tuple[Any, Optional[str]]], locale: str,
+                   names: Dict[str, Dict[str, str]]) -> str:
+    lines = [heading(key, locale)] + [render_line(m, g, locale, names) for m, g in items]
+    return "\n".join(lines)
+
+def final_summary(graded: List[Tuple[Any, Optional[str]]], locale: str, names: Dict[str, Dict[str, str]]) -> str:
+    t = T[locale]
+    known = [(m, g) for m, g in graded if g]
+    out = [f"{display_name(m, locale, names)} {'↑' if g == 'high' else '↓'}" for m, g in known if g in ("low", "high")]
+    border = [display_name(m, locale, names) for m, g in known if g in ("near_low", "near_high")]
+    lines = [t["n_ok"].format(ok=sum(1 for _, g in known if g == "ok"), total=len(graded))]
+    if out:
+        lines.append(t["out"].format(items=", ".join(out)))
+    if border:
+        lines.append(t["border"].format(items=", ".join(border)))
+    if not out and not border:
+        lines.append(t["all_ok"])
+    lines.append("")
+    lines.append(t["advice"])
+    return "\n".join(lines)
+
+def assemble(sections: List[str], final_md: str, locale: str) -> str:
+    t = T[locale]
+    parts = [t["title"]] + sections + [f"{t['final']}\n{final_md.strip()}"]
+    return "\n\n---\n\n".join(parts) + "\n"
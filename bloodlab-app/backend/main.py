@@ -1,14 +1,23 @@
 import os
 import io
+import asyncio
 import json
 import base64
+import hashlib
 import re
 import unicodedata
-from typing import List, Dict, Any, Tuple, Optional
-from fastapi import FastAPI, UploadFile, File
+import time
+import tracemalloc
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import List, Dict, Any, Tuple, Optional, Callable
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Header, Request
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import google.generativeai as genai
+import numpy as np
 
 from PIL import Image
 import pypdfium2 as pdfium
@@ -16,10 +25,39 @@ from starlette.responses import StreamingResponse
 
 from openai import OpenAI
 from settings import settings
+from model_clients import configure_genai, ModelRegistry
+from prefilter import filter_pages, skipped_note
+from memstats import RequestMemory, RssSampler, MemoryStats, stage, page_bytes, payload_bytes
+from preprocess import preprocess_pages, PreprocessStats, summarize as preprocess_note
+from jobs import JobStore, WorkerPool
+from streams import StreamRegistry, StreamSession
+from serialization import dumps, compact, FastJSONResponse
+from records import Row
+from singleflight import SingleFlight
+from deadlines import Deadline, Cancelled, parse_seconds
+from breaker import CircuitBreaker, CircuitOpen
+from shared_state import SharedState
+from profiling import ProfileMiddleware, ProfileStore, profiled, admin_ok
+from tracing import Tracer, TraceMiddleware, span, annotate, traced, install_log_prefix
+from jsonstream import MeasurementParser
+from routing import score_page, RouteStats
+from history import HistoryStore
+from units import compile_registry, normalize_rows, unit_factor
+from llm_usage import UsageStats, RequestUsage, usage_counts, genai_usage_counts
+from local_summary import (
+    LOCALES as SUMMARY_LOCALES, partition, grade, heading, render_section, assemble,
+    final_summary as local_final_summary,
+)
+from composites import (
+    INPUTS as COMPOSITE_INPUTS, INPUT_KEYS as COMPOSITE_INPUT_KEYS, evaluate as evaluate_composites,
+    cards_for as composite_cards, normalize_sex, valid_age,
+)
 
-# Config SDK from .env
-genai.configure(api_key=settings.GOOGLE_API_KEY)
+# Config SDK from .env; clients are built once here and shared by all requests.
+configure_genai(settings.GOOGLE_API_KEY, settings.GENAI_TRANSPORT, settings.GENAI_ENDPOINT)
+models = ModelRegistry()
 MODEL_NAME = settings.GENAI_MODEL
+FAST_MODEL_NAME = settings.OCR_FAST_MODEL    # easy pages go here when set
 
 DB_PATHS = [
     settings.METRICS_DB or os.path.join(os.path.dirname(__file__), "data", "bloodlab_metrics_db_with_groups.json"),
@@ -40,18 +78,103 @@ class Measurement(BaseModel):
     source_file: str | None = None
     page: int | None = None
     group: str | None = None
+    norm_value: float | None = None   # value in the DB's canonical unit (value/unit stay as printed)
+    norm_unit: str | None = None
+
+class CompositeMetric(BaseModel):
+    key: str                 # egfr | fib4 | de_ritis | aip | tg_hdl | tc_hdl | nlr | eag
+    name: str
+    label: str
+    value: float | None = None
+    display: str
+    unit: str | None = None
+    grade: str
+    pct: int = 0
 
 class ParseResponse(BaseModel):
     measurements: List[Measurement]
     notes: str | None = None
+    composites: List[CompositeMetric] | None = None
+    status: str | None = None                 # complete | partial (token budget ran out)
+    usage: Dict[str, Any] | None = None       # model tokens/cost spent on this report
+    debug: Dict[str, Any] | None = None       # ?debug=true: per-stage memory of this request
+
+class JobPage(BaseModel):
+    filename: str
+    page: int
+    status: str              # done | skipped | failed
+    count: int = 0
+
+class JobStatus(BaseModel):
+    id: str
+    status: str              # queued | running | done | failed
+    created_at: float
+    updated_at: float
+    total_pages: int | None = None
+    done_pages: int = 0
+    pages: List[JobPage] = []
+    result: ParseResponse | None = None
+    error: str | None = None
+    attempts: int = 0        # times a worker claimed it
+
+class CompositeReport(BaseModel):
+    measurements: List[Measurement]
+    sex: Optional[str] = None        # male | female
+    age: Optional[float] = None
+
+class CompositeBatchRequest(BaseModel):
+    reports: List[CompositeReport]
+
+class CompositeBatchResponse(BaseModel):
+    results: List[List[CompositeMetric]]
 
 class SummaryRequest(BaseModel):
     report: ParseResponse
     locale: Optional[str] = "ru"
+    mode: Optional[str] = None       # local | hybrid | llm | parallel (default: SUMMARY_MODE)
 
 class SummaryResponse(BaseModel):
     summary_md: str
     model: str = "gpt-4o-mini"
+    usage: Dict[str, Any] | None = None
+
+class HistoryStoreRequest(BaseModel):
+    report: ParseResponse
+    report_date: Optional[str] = None        # YYYY-MM-DD or DD.MM.YYYY; default today
+    report_id: Optional[str] = None          # same id again replaces the stored report
+
+class HistoryStoreResponse(BaseModel):
+    patient_id: str
+    report_id: str
+    stored: int
+
+class HistoryPoint(BaseModel):
+    date: str
+    name: str
+    value: str | None = None
+    value_num: float | None = None
+    unit: str | None = None
+    flag: str | None = None
+    report_id: str
+
+class HistorySeries(BaseModel):
+    patient_id: str
+    metric: str
+    points: List[HistoryPoint]
+
+class HistoryLatestItem(BaseModel):
+    name: str
+    date: str
+    value: str | None = None
+    value_num: float | None = None
+    unit: str | None = None
+    flag: str | None = None
+    group: str | None = None
+    report_id: str
+
+class HistoryLatest(BaseModel):
+    patient_id: str
+    metrics: List[HistoryLatestItem]
 
 
 SUMMARY_SYSTEM = """
@@ -119,6 +242,23 @@ YOUR PATIENT:
 # ---------- CONFIG ----------
 app = FastAPI(title="BloodLab Interpreter API", version="1.4")
 
+profile_store = ProfileStore(
+    settings.PROFILE_DIR or os.path.join(os.path.dirname(__file__), "state", "profiles"), keep=settings.PROFILE_KEEP,
+)
+if settings.ADMIN_TOKEN or settings.PROFILE_SAMPLE_RATE > 0:
+    # not installed at all unless profiling can happen (inside CORS, which is added last)
+    app.add_middleware(
+        ProfileMiddleware,
+        store=profile_store,
+        admin_token=settings.ADMIN_TOKEN,
+        sample_rate=settings.PROFILE_SAMPLE_RATE,
+        interval_s=settings.PROFILE_INTERVAL_MS / 1000,
+    )
+
+# request ids + timed spans; print() lines made for a request get its id as prefix
+tracer = Tracer(settings.TRACE_SERVICE_NAME, log=settings.TRACE_LOG, otlp=settings.TRACE_OTLP, out=install_log_prefix())
+app.add_middleware(TraceMiddleware, tracer=tracer)
+
 allow_origins = ["*"] if settings.CORS_ORIGINS.strip() == "*" else [
     o.strip() for o in settings.CORS_ORIGINS.split(",") if o.strip()
 ]
@@ -128,6 +268,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Stream-Id", "X-Report-Id", "X-Result-Status",
+        "X-Usage-Tokens", "X-Usage-Prompt-Tokens", "X-Usage-Cached-Tokens",
+        "X-Usage-Completion-Tokens", "X-Usage-Cost-USD", "X-Profile-Id", "X-Request-Id",
+    ],
 )
 
 # ---------- helpers: numbers/refs ----------
@@ -230,9 +375,12 @@ DB: Dict[str, Any] = {}
 CANON_BY_ALIAS: Dict[str, str] = {}
 ALL_ALIASES_NORM: Dict[str, str] = {}  # normalized alias -> canonical
 REF_BY_CANON: Dict[str, Dict[str, Any]] = {}
+UNIT_REGISTRY: Dict[str, Tuple[str, Dict[str, float]]] = {}  # canonical -> (DB unit, spelling -> factor)
+NAMES_BY_CANON: Dict[str, Dict[str, str]] = {}               # canonical -> {lang: display name}
+SUMMARY_DB_BLOCK = ""                                        # DB part of the summary prompt, built once per load
 
 def load_db():
-    global DB, CANON_BY_ALIAS, ALL_ALIASES_NORM, REF_BY_CANON
+    global DB, CANON_BY_ALIAS, ALL_ALIASES_NORM, REF_BY_CANON, SUMMARY_DB_BLOCK
     for p in DB_PATHS:
         try:
             if os.path.exists(p):
@@ -247,6 +395,7 @@ def load_db():
     CANON_BY_ALIAS.clear()
     ALL_ALIASES_NORM.clear()
     REF_BY_CANON.clear()
+    NAMES_BY_CANON.clear()
 
     for m in DB.get("metrics", []):
         canon = m.get("canonical_name") or ""
@@ -254,6 +403,7 @@ def load_db():
             continue
         aliases = set()
         names = m.get("names", {})
+        NAMES_BY_CANON[canon] = {k: str(v).strip() for k, v in names.items() if v}
         for v in names.values():
             if v:
                 aliases.add(str(v).strip())
@@ -273,6 +423,12 @@ def load_db():
             "group": m.get("group") or "Other",
         }
 
+    UNIT_REGISTRY.clear()
+    UNIT_REGISTRY.update(compile_registry(DB.get("metrics", [])))
+
+    # serialized once: the summary prompt prefix must stay byte-identical between requests
+    SUMMARY_DB_BLOCK = "Given:\n1) Full parameter database (JSON):\n" + dumps(DB).decode("utf-8") + "\n\n"
+
 load_db()
 
 def canon_name_soft(raw: str) -> Tuple[Optional[str], str]:
@@ -346,7 +502,7 @@ def get_db_entry(canon: str) -> Dict[str, Any]:
     base = canon.replace(" %", "").replace(" absolute", "").strip()
     return REF_BY_CANON.get(base, {})
 
-def leukocyte_dedup_key(m: "Measurement") -> str:
+def leukocyte_dedup_key(m: "Row") -> str:
     name_norm = normalize_name(m.name)
     base = name_norm.replace(" percent", "").replace("%", "").replace(" absolute", "").strip()
     if base.split()[-1] in WBC_BASE:
@@ -355,6 +511,102 @@ def leukocyte_dedup_key(m: "Measurement") -> str:
         return f"{base}|{var}"
     return name_norm
 
+# ---------- composite indices ----------
+# input key -> names as they may appear (resolved against the DB at import)
+COMPOSITE_ALIASES: Dict[str, List[str]] = {
+    "creatinine": ["creatinine", "креатинин", "creatinine plasmatique", "creatinine serum"],
+    "ast": ["ast", "асат", "got", "aspartate aminotransferase", "asat"],
+    "alt": ["alt", "алат", "gpt", "alanine aminotransferase", "alat"],
+    "platelets": ["platelets", "plt", "тромбоциты", "plaquettes"],
+    "tg": ["triglycerides", "tg", "триглицериды", "triglycérides"],
+    "hdl": ["hdl", "hdl cholesterol", "лпвп", "hdl-c"],
+    "tc": ["cholesterol total", "total cholesterol", "общий холестерин", "cholesterol"],
+    "hba1c": ["hba1c", "hb a1c", "гликированный гемоглобин", "глікозильований гемоглобін"],
+}
+COMPOSITE_KEY_BY_NAME: Dict[str, str] = {}  # normalized name -> analyte key
+COMPOSITE_CANON: Dict[str, str] = {}        # analyte key -> DB canonical (its unit is what inputs convert from)
+
+def build_composite_index():
+    # exact lookups only: fuzzy matching would happily turn "alt" into "ast"
+    COMPOSITE_KEY_BY_NAME.clear()
+    COMPOSITE_CANON.clear()
+    for key, aliases in COMPOSITE_ALIASES.items():
+        for a in aliases:
+            COMPOSITE_KEY_BY_NAME.setdefault(normalize_name(a), key)
+            canon = CANON_BY_ALIAS.get(a.lower()) or ALL_ALIASES_NORM.get(normalize_name(a))
+            if canon:
+                COMPOSITE_KEY_BY_NAME.setdefault(normalize_name(canon), key)
+                if canon in UNIT_REGISTRY:
+                    COMPOSITE_CANON.setdefault(key, canon)
+    # every DB alias of a matched canonical resolves too
+    for alias_norm, canon in ALL_ALIASES_NORM.items():
+        key = COMPOSITE_KEY_BY_NAME.get(normalize_name(canon))
+        if key:
+            COMPOSITE_KEY_BY_NAME.setdefault(alias_norm, key)
+
+build_composite_index()
+
+def composite_value(m: "Row", canon: Optional[str], v: float) -> Optional[float]:
+    """A row's value in the DB unit of canon: its norm_value when the pipeline set one, else via the registry."""
+    if m.norm_value is not None and m.name == canon:
+        return m.norm_value
+    f = unit_factor(UNIT_REGISTRY, canon, m.unit) if canon else None
+    return v * f if f is not None else None
+
+def composite_inputs(measurements: List[Any]) -> Dict[str, float]:
+    """One report -> composite engine inputs, in the units composites.INPUTS lists."""
+    vals: Dict[str, float] = {}
+    wbc: Dict[Tuple[str, str], float] = {}
+    for m in measurements:
+        v = value_to_number(m.value)
+        if v is None:
+            continue
+        norm = normalize_name(m.name)
+        cell = "Neutrophils" if "neutrophil" in norm else "Lymphocytes" if "lymphocyt" in norm else None
+        if cell:
+            variant = adjust_wbc_canonical(cell, m.unit, m.reference_text, m.name)
+            var = "pct" if variant.endswith("%") else "abs" if variant.endswith("absolute") else "base"
+            canon = variant if variant in UNIT_REGISTRY else None
+            # percentages compare as printed; absolute counts in one unit (/µl vs 10^9/l)
+            c = composite_value(m, canon, v) if canon else v
+            if c is not None:
+                wbc.setdefault((cell, var), c)
+            continue
+        key = COMPOSITE_KEY_BY_NAME.get(norm)
+        canon = COMPOSITE_CANON.get(key or "")
+        c = composite_value(m, canon, v)
+        if c is None:
+            continue       # unit not convertible for this analyte: leave the index out rather than guess
+        for input_key, (analyte, unit) in COMPOSITE_INPUTS.items():
+            if analyte == key:
+                f = UNIT_REGISTRY[canon][1].get(unit)
+                if f:
+                    vals.setdefault(input_key, c / f)
+    # NLR from a matching pair, absolute counts preferred
+    for var in ("abs", "pct", "base"):
+        if ("Neutrophils", var) in wbc and ("Lymphocytes", var) in wbc:
+            vals["neut"], vals["lymph"] = wbc[("Neutrophils", var)], wbc[("Lymphocytes", var)]
+            break
+    return vals
+
+def compute_composites(reports: List[Tuple[List[Any], Optional[str], Optional[float]]]) -> List[List["CompositeMetric"]]:
+    """(measurements, sex, age) per report -> composite cards per report, evaluated in one vectorized pass."""
+    n = len(reports)
+    if n == 0:
+        return []
+    per_report = [composite_inputs(ms) for ms, _, _ in reports]
+    cols = {k: np.array([r.get(k, np.nan) for r in per_report], dtype=float) for k in COMPOSITE_INPUT_KEYS}
+    age = np.array([a if valid_age(a) else np.nan for _, _, a in reports], dtype=float)
+    sex = [normalize_sex(s) for _, s, _ in reports]
+    res = evaluate_composites(cols, age, sex)
+    out: List[List[CompositeMetric]] = []
+    for i, (_, _, a) in enumerate(reports):
+        demographics = sex[i] is not None and valid_age(a)
+        cards = composite_cards(res, i, "creatinine_mgdl" in per_report[i], demographics,
+                                float(a) if valid_age(a) else 0.0)
+        out.append([CompositeMetric.model_construct(**c) for c in cards])
+    return out
+
 # ---------- OCR prompt ----------
 SINGLE_PAGE_PROMPT = r"""
 You are a medical assistant specialized in extracting laboratory data from reports.  
@@ -396,6 +648,10 @@ Double-check that the JSON is syntactically valid and contains no extra characte
 def image_bytes_to_part(img_bytes: bytes, mime: str = "image/png") -> Dict[str, Any]:
     return {"mime_type": mime, "data": base64.b64encode(img_bytes).decode("utf-8")}
 
+def image_mime(img_bytes: bytes) -> str:
+    # pages are PNG, except photos re-encoded as JPEG by the preprocess stage
+    return "image/jpeg" if img_bytes[:3] == b"\xff\xd8\xff" else "image/png"
+
 def pdf_to_images(pdf_bytes: bytes) -> list[bytes]:
     images = []
     pdf = pdfium.PdfDocument(io.BytesIO(pdf_bytes))
@@ -430,9 +686,9 @@ def _clean_json_text(text: str) -> str:
     return t
 
 # ---------- post-OCR pipeline ----------
-def enrich_with_db(m: "Measurement", canonical: Optional[str]) -> "Measurement":
+def enrich_with_db(m: "Row", canonical: Optional[str]) -> "Row":
     """
-    Enrich Measurement using DB (units, refs) without затирания уже найденных границ.
+    Enrich a row using DB (units, refs) without затирания уже найденных границ.
     """
     if canonical:
         canonical = adjust_wbc_canonical(canonical, m.unit, m.reference_text, m.name)
@@ -469,7 +725,7 @@ def enrich_with_db(m: "Measurement", canonical: Optional[str]) -> "Measurement":
 
     return m
 
-def score_entry(m: "Measurement") -> int:
+def score_entry(m: "Row") -> int:
     s = 0
     if value_to_number(m.value) is not None:
         s += 4
@@ -483,7 +739,77 @@ def score_entry(m: "Measurement") -> int:
         s += 1
     return s
 
+class DedupState:
+    """
+    Incremental leukocyte_dedup_key / score_entry best-map. add() reports the keys
+    whose best entry changed: ("upsert", key, m) for new keys, ("replace", key, m)
+    when a better-scored entry wins. Insertion order matches the batch dedup.
+    """
+    def __init__(self):
+        self.best: Dict[str, Row] = {}
+        self._scores: Dict[str, int] = {}
+
+    def add(self, items: List["Row"]) -> List[Tuple[str, str, "Row"]]:
+        changes: Dict[str, Tuple[str, "Row"]] = {}
+        for m in items:
+            key = leukocyte_dedup_key(m)
+            sc = score_entry(m)
+            if key in self.best and sc <= self._scores[key]:
+                continue
+            if key in changes:
+                op = changes[key][0]       # several hits in one batch: keep the first op
+            else:
+                op = "replace" if key in self.best else "upsert"
+            self.best[key] = m
+            self._scores[key] = sc
+            changes[key] = (op, m)
+        return [(op, key, m) for key, (op, m) in changes.items()]
+
+    def results(self) -> List["Row"]:
+        return list(self.best.values())
+
+    def checksum(self) -> str:
+        """Short digest of the final table, so stream clients can verify their replayed state."""
+        h = hashlib.sha256()
+        for key, m in self.best.items():
+            h.update(f"{key}|{m.value}|{m.unit or ''}|{m.flag or ''}\n".encode("utf-8"))
+        return h.hexdigest()[:16]
+
+def dedup_measurements(items: List["Row"]) -> List["Row"]:
+    state = DedupState()
+    state.add(items)
+    return state.results()
+
+def to_measurements(rows: List["Row"]) -> List[Measurement]:
+    """API boundary: rows come out of our own pipeline, so no re-validation."""
+    return [Measurement.model_construct(**r.as_dict()) for r in rows]
+
+PARTIAL_REASONS = {"token_budget", "deadline", "cancelled", "provider_unavailable", "ocr_failed", "error"}
+
+def result_status(skipped: List[Dict[str, Any]]) -> str:
+    return "partial" if any(s["reason"] in PARTIAL_REASONS for s in skipped) else "complete"
+
+@profiled
+@traced("response")
+def parse_response(rows: List["Row"], n_pages: int, skipped: List[Dict[str, Any]],
+                   usage: Optional[RequestUsage] = None) -> ParseResponse:
+    """Final deduplicated report for a set of processed pages."""
+    best = dedup_measurements(rows)
+    return ParseResponse.model_construct(
+        measurements=to_measurements(best),
+        notes=f"Processed {n_pages} pages" + skipped_note(skipped) + (usage.note() if usage else ""),
+        composites=compute_composites([(best, None, None)])[0],
+        status=result_status(skipped),
+        usage=usage.as_dict() if usage else None,
+    )
+
 # ---------- page processing ----------
+class OcrFailed(Exception):
+    """The model call for a page failed or returned nothing parseable (not the same as a page with no rows)."""
+    def __init__(self, filename: str, page_num: int, why: str):
+        super().__init__(f"OCR failed for {filename}, page {page_num}: {why}")
+        self.reason = "ocr_failed"
+
 def _compose_reference_text(ref_low: Optional[float], ref_high: Optional[float]) -> Optional[str]:
     if ref_low is None and ref_high is None:
         return None
@@ -493,14 +819,192 @@ def _compose_reference_text(ref_low: Optional[float], ref_high: Optional[float])
         return f"≤ {ref_high:g}"
     return f"≥ {ref_low:g}"
 
-def process_single_page(model, image_bytes: bytes, filename: str, page_num: int) -> List["Measurement"]:
-    parts = [{"text": SINGLE_PAGE_PROMPT}, image_bytes_to_part(image_bytes, "image/png")]
+def call_timeout(deadline: Optional[Deadline]) -> Optional[float]:
+    """Seconds a page model call may take: OCR_CALL_TIMEOUT, or less if the request deadline is closer."""
+    limits = [t for t in (settings.OCR_CALL_TIMEOUT, deadline.remaining() if deadline is not None else None) if t]
+    return max(1.0, min(limits)) if limits else None
+
+def model_call_options(deadline: Optional[Deadline]) -> Dict[str, Any]:
+    """generate_content kwargs that bound the call by OCR_CALL_TIMEOUT and the request deadline."""
+    timeout = call_timeout(deadline)
+    return {"request_options": {"timeout": timeout}} if timeout is not None else {}
+
+# ---------- state shared by all worker processes ----------
+shared_state = SharedState(
+    settings.SHARED_STATE_DB or os.path.join(os.path.dirname(__file__), "state", "shared.sqlite3"),
+    cache_ttl_s=settings.RESULT_CACHE_HOURS * 3600,
+)
+PROVIDER_LIMITS = {     # provider -> (calls per minute, calls in flight), all processes together
+    "google": (settings.GOOGLE_RPM, settings.GOOGLE_MAX_CONCURRENCY),
+    "openai": (settings.OPENAI_RPM, settings.OPENAI_MAX_CONCURRENCY),
+}
+# cached pages are only valid for the prompt that produced them
+OCR_CACHE_VERSION = hashlib.sha256(SINGLE_PAGE_PROMPT.encode("utf-8")).hexdigest()[:8]
+
+def rate_limit_pause(e: Exception) -> Optional[float]:
+    """Seconds to pause the provider for if e is a 429 (Retry-After when given), else None."""
+    code = getattr(e, "status_code", None) or getattr(e, "code", None)
+    if code != 429:
+        return None
+    response = getattr(e, "response", None)
+    try:
+        return max(1.0, float(response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return settings.RATE_LIMIT_BACKOFF_SECONDS
+
+@contextmanager
+def provider_slot(provider: str, deadline: Optional[Deadline] = None, hold_s: Optional[float] = None):
+    """
+    Wraps one model call: waits for the provider's shared rate/concurrency limits
+    (raising Cancelled if the deadline passes meanwhile) and pauses the provider
+    for every worker when the call comes back 429.
+    """
+    rpm, concurrency = PROVIDER_LIMITS[provider]
+    hold_s = hold_s or (call_timeout(deadline) or 600.0) + 30.0
+    slot = shared_state.acquire(provider, rpm, concurrency, hold_s, deadline.check if deadline is not None else None)
+    try:
+        yield
+    except Exception as e:
+        pause = rate_limit_pause(e)
+        if pause:
+            shared_state.backoff(provider, pause)
+        raise
+    finally:
+        shared_state.release(slot)
+
+# ---------- provider health & failover ----------
+def _breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name,
+        window=settings.BREAKER_WINDOW,
+        min_calls=settings.BREAKER_MIN_CALLS,
+        failure_rate=settings.BREAKER_FAILURE_RATE,
+        slow_seconds=settings.BREAKER_SLOW_SECONDS,
+        open_seconds=settings.BREAKER_OPEN_SECONDS,
+    )
+
+provider_breakers = {"google": _breaker("google"), "openai": _breaker("openai")}
+FAILOVER_MODEL = settings.OCR_FAILOVER_MODEL if openai_client else None   # OpenAI vision model for OCR
+
+def ocr_failover(image_bytes: bytes, filename: str, page_num: int,
+                 usage: Optional[RequestUsage] = None, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Page OCR on the OpenAI vision model, used while the Gemini breaker is open (and
+    for a page whose Gemini call just failed). Raises CircuitOpen when there is no
+    usable failover either.
+    """
+    breaker = provider_breakers["openai"]
+    if not FAILOVER_MODEL or not breaker.allow():
+        raise CircuitOpen("openai" if FAILOVER_MODEL else "google")
+    if deadline is not None:
+        deadline.check()
+    mime = image_mime(image_bytes)
+    data_url = f"data:{mime};base64," + base64.b64encode(image_bytes).decode("utf-8")
+    client = openai_client.with_options(timeout=call_timeout(deadline), max_retries=0)
+    t0 = time.perf_counter()
     try:
-        resp = model.generate_content(parts)
-        text = resp.text or ""
+        with provider_slot("openai", deadline), span("model_call", provider="openai", model=FAILOVER_MODEL, failover=True):
+            resp = client.chat.completions.create(
+                model=FAILOVER_MODEL,
+                messages=[{"role": "user", "content": [
+                    {"type": "text", "text": SINGLE_PAGE_PROMPT},
+                    {"type": "image_url", "image_url": {"url": data_url}},
+                ]}],
+                response_format={"type": "json_object"},
+                temperature=0,
+            )
+    except Cancelled:
+        raise
     except Exception as e:
+        if deadline is not None and deadline.done:
+            raise Cancelled(deadline.why()) from e
+        breaker.record(False)
+        print(f"Failover OCR error for {filename}, page {page_num}: {e}")
+        raise OcrFailed(filename, page_num, f"{FAILOVER_MODEL}: {e}") from e
+    seconds = time.perf_counter() - t0
+    breaker.record(True, seconds)
+    if usage is not None:
+        usage.add(FAILOVER_MODEL, usage_counts(resp), seconds)
+    print(f"OCR {filename}, page {page_num}: served by {FAILOVER_MODEL} in {seconds:.2f}s")
+    try:
+        data_json = json.loads(_clean_json_text(resp.choices[0].message.content or ""))
+    except Exception as e:
+        print(f"JSON parsing error (failover) for {filename}, page {page_num}")
+        raise OcrFailed(filename, page_num, "unparseable JSON from the failover model") from e
+    if not isinstance(data_json, dict):
+        raise OcrFailed(filename, page_num, "failover model returned no JSON object")
+    return data_json
+
+def generate_streaming(model, parts: List[Any], on_item: Callable[[Dict[str, Any]], None],
+                       filename: str, page_num: int, deadline: Optional[Deadline] = None) -> Tuple[Any, str]:
+    """
+    Streamed generation; each measurements[] object goes to on_item as soon as it is complete.
+    Stops between chunks (raising Cancelled) once the deadline is done.
+    """
+    parser = MeasurementParser()
+    chunks: List[str] = []
+    t0 = time.perf_counter()
+    first: Optional[float] = None
+    resp = model.generate_content(parts, stream=True, **model_call_options(deadline))
+    for chunk in resp:
+        if deadline is not None:
+            deadline.check()
+        try:
+            piece = chunk.text or ""
+        except ValueError:      # chunk without text parts (e.g. the final one)
+            continue
+        chunks.append(piece)
+        for item in parser.feed(piece):
+            if first is None:
+                first = time.perf_counter() - t0
+            on_item(item)
+    if first is not None:
+        print(f"OCR {filename}, page {page_num}: first row after {first:.2f}s, done after {time.perf_counter() - t0:.2f}s")
+    return resp, "".join(chunks)
+
+def ocr_page(model, image_bytes: bytes, filename: str, page_num: int,
+             usage: Optional[RequestUsage] = None,
+             on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+             repair: bool = True, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Model call + JSON repair for one page image; raises OcrFailed if nothing usable came back.
+    With on_item the call is streamed and rows are handed out while the page is
+    still being generated; the returned dict is still the full, authoritative page.
+    repair=False skips the JSON-fix call (the router escalates instead).
+    With a deadline the call is always streamed, so cancelling it stops generation
+    mid-page; raises Cancelled instead of returning a page that was cut short.
+    While the Gemini breaker is open the page goes to ocr_failover instead.
+    """
+    if deadline is not None:
+        deadline.check()
+    google = provider_breakers["google"]
+    if not google.allow():
+        return ocr_failover(image_bytes, filename, page_num, usage, deadline)
+    parts = [{"text": SINGLE_PAGE_PROMPT}, image_bytes_to_part(image_bytes, image_mime(image_bytes))]
+    model_name = getattr(model, "model_name", MODEL_NAME)
+    try:
+        with provider_slot("google", deadline), span("model_call", provider="google", model=model_name) as sp:
+            t0 = time.perf_counter()
+            if on_item is not None or deadline is not None:
+                resp, text = generate_streaming(model, parts, on_item or (lambda item: None), filename, page_num, deadline)
+            else:
+                resp = model.generate_content(parts, **model_call_options(None))
+                text = resp.text or ""
+            counts = genai_usage_counts(resp)
+            sp["tokens"] = counts["prompt_tokens"] + counts["completion_tokens"]
+        google.record(True, time.perf_counter() - t0)
+        if usage is not None:
+            usage.add(model_name, genai_usage_counts(resp), time.perf_counter() - t0)
+    except Cancelled:
+        raise       # our own cancellation says nothing about the provider
+    except Exception as e:
+        if deadline is not None and deadline.done:      # timed out by request_options
+            raise Cancelled(deadline.why()) from e
+        google.record(False)
         print(f"OCR error for {filename}, page {page_num}: {e}")
-        return []
+        if FAILOVER_MODEL:
+            return ocr_failover(image_bytes, filename, page_num, usage, deadline)
+        raise OcrFailed(filename, page_num, str(e)) from e
     
 
     # 🔹 Logging raw text after OCR
@@ -522,58 +1026,184 @@ def process_single_page(model, image_bytes: bytes, filename: str, page_num: int)
         data_json = json.loads(text_clean)
     except Exception as e:
         print(f"JSON parsing error for {filename}, page {page_num}: {e}")
+        if not repair:
+            raise OcrFailed(filename, page_num, "unparseable JSON") from e
+        if deadline is not None:
+            deadline.check()
+        if not google.allow():
+            print(f"Not fixing JSON for {filename}, page {page_num}: {google.name} circuit open")
+            raise OcrFailed(filename, page_num, "unparseable JSON, repair skipped") from e
         try:
-            fixer = genai.GenerativeModel(MODEL_NAME)
+            fixer = models.get(MODEL_NAME)
             fix_prompt = "Convert the following text into strictly valid JSON. Return ONLY JSON:\n" + text_clean
-            fix_resp = fixer.generate_content([{"text": fix_prompt}])
+            try:
+                with provider_slot("google", deadline), span("json_repair", provider="google", model=MODEL_NAME):
+                    t0 = time.perf_counter()
+                    fix_resp = fixer.generate_content([{"text": fix_prompt}], **model_call_options(deadline))
+            except Cancelled:
+                raise
+            except Exception:
+                google.record(False)
+                raise
+            google.record(True, time.perf_counter() - t0)
+            if usage is not None:
+                usage.add(MODEL_NAME, genai_usage_counts(fix_resp))
             data_json = json.loads(_clean_json_text(fix_resp.text or ""))
-        except Exception:
+        except Cancelled:
+            raise       # gave up waiting for a shared provider slot
+        except Exception as e2:
             print(f"Failed to fix JSON for {filename}, page {page_num}")
-            return []
-
-    out: List[Measurement] = []
+            raise OcrFailed(filename, page_num, "unparseable JSON") from e2
+    if not isinstance(data_json, dict):
+        raise OcrFailed(filename, page_num, "model returned no JSON object")
+    return data_json
+
+ocr_flights = SingleFlight()
+route_stats = RouteStats()
+
+def ocr_routed(model, image_bytes: bytes, filename: str, page_num: int,
+               usage: Optional[RequestUsage] = None,
+               on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+               deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    Easy pages (clean renders, readable print) go to the fast model; hard ones and
+    fast answers that fail to parse or look too thin are (re)done by `model`.
+    Without OCR_FAST_MODEL (or while Gemini is failing) this is just ocr_page on `model`.
+    """
+    if not FAST_MODEL_NAME or provider_breakers["google"].state != "closed":
+        # both tiers are Gemini: during an incident there is nothing to route between
+        return ocr_page(model, image_bytes, filename, page_num, usage, on_item, deadline=deadline)
+    with span("route") as sp:
+        route = score_page(image_bytes, settings.OCR_ROUTING_THRESHOLD)
+        sp.update(tier=route["tier"], score=route["score"])
+    t0 = time.perf_counter()
+    if route["tier"] == "fast":
+        # not streamed: rows of an answer that gets escalated must not reach the client
+        try:
+            data = ocr_page(models.get(FAST_MODEL_NAME), image_bytes, filename, page_num, usage,
+                            repair=False, deadline=deadline)
+        except OcrFailed:
+            data = {}
+        found = len(data.get("measurements") or [])
+        if found >= route["min_rows"]:
+            route_stats.record("fast", time.perf_counter() - t0)
+            return data
+        print(f"Escalating {filename}, page {page_num}: fast model found {found} rows (expected >= {route['min_rows']})")
+        data = ocr_page(model, image_bytes, filename, page_num, usage, on_item, deadline=deadline)
+        route_stats.record("escalated", time.perf_counter() - t0)
+        return data
+    print(f"Routing {filename}, page {page_num} to the strong model (score {route['score']}: {', '.join(route['reasons'])})")
+    data = ocr_page(model, image_bytes, filename, page_num, usage, on_item, deadline=deadline)
+    route_stats.record("strong", time.perf_counter() - t0)
+    return data
+
+def ocr_cached(key: str, model, image_bytes: bytes, filename: str, page_num: int,
+               usage: Optional[RequestUsage] = None,
+               on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+               deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """
+    ocr_routed behind the shared result cache: a page any worker process already
+    read (same image, model and prompt) is served without a model call. A hit is
+    not streamed row by row; callers get the whole page at once.
+    """
+    cache_key = f"{key}:{OCR_CACHE_VERSION}"
+    data = shared_state.get("ocr", cache_key)
+    if data is not None:
+        print(f"OCR {filename}, page {page_num}: served from the shared cache")
+        annotate(cache="hit")
+        return data
+    data = ocr_routed(model, image_bytes, filename, page_num, usage, on_item, deadline)
+    if data.get("measurements"):       # failed/empty reads are retried next time
+        shared_state.put("ocr", cache_key, data)
+    return data
+
+@profiled
+def process_single_page(model, image_bytes: bytes, filename: str, page_num: int,
+                        usage: Optional[RequestUsage] = None,
+                        on_row: Optional[Callable[["Row"], None]] = None,
+                        deadline: Optional[Deadline] = None) -> List["Row"]:
+    # identical page images in flight (double submit, two tabs) share one model call;
+    # rows are built per caller so source_file/page stay correct
+    key = f"{getattr(model, 'model_name', MODEL_NAME)}:{hashlib.sha256(image_bytes).hexdigest()}"
+    if ocr_flights.in_flight(key):
+        print(f"Coalescing OCR for {filename}, page {page_num} with an in-flight call")
+    # (a coalesced follower is not charged: only the caller that made the call is)
+    on_item = None
+    if on_row is not None:
+        def on_item(item: Dict[str, Any]):
+            m = row_from_item(item, filename, page_num)
+            if m is not None:
+                normalize_rows([m], UNIT_REGISTRY, value_to_number)
+                on_row(m)
+    with span("page", file=filename, page=page_num) as sp:
+        while True:
+            try:
+                data_json = ocr_flights.do(
+                    key, lambda: ocr_cached(key, model, image_bytes, filename, page_num, usage, on_item, deadline),
+                    deadline)
+                break
+            except Cancelled:
+                if deadline is not None and deadline.done:
+                    raise
+                # the caller we were coalesced with gave up; we are still waiting, so make the call ourselves
+                print(f"Coalesced OCR for {filename}, page {page_num} was cancelled by its leader; retrying")
+        rows = rows_from_ocr(data_json, filename, page_num)
+        sp["rows"] = len(rows)
+        return rows
+
+def rows_from_ocr(data_json: Dict[str, Any], filename: str, page_num: int) -> List["Row"]:
+    out: List[Row] = []
     for item in data_json.get("measurements", []):
-        raw_name = str(item.get("name", "")).strip()
-        if not raw_name:
-            continue
-        if is_section_header(raw_name):
-            continue
+        m = row_from_item(item, filename, page_num)
+        if m is not None:
+            out.append(m)
 
-        raw_value = str(item.get("value", "")).strip()
-        if is_empty_value(raw_value):
-            continue
+    # canonical-unit values for the whole page in one pass
+    normalize_rows(out, UNIT_REGISTRY, value_to_number)
+    return out
 
-        # Границы могут прийти прямо из OCR
-        item_ref_low = _to_float(item.get("ref_low"))
-        item_ref_high = _to_float(item.get("ref_high"))
-
-        # Собираем reference_text, если OCR не дал строку
-        reference_text = item.get("reference_text")
-        if not ref_string_looks_plausible(reference_text):
-            reference_text = _compose_reference_text(item_ref_low, item_ref_high)
-
-        canonical, _ = canon_name_soft(raw_name)
-
-        grp = item.get("group")
-        if isinstance(grp, str):
-            grp = grp.strip()
-
-        m = Measurement(
-            name=canonical or raw_name,
-            value=raw_value,
-            unit=(item.get("unit") or None),
-            reference_text=reference_text,
-            ref_low=item_ref_low,
-            ref_high=item_ref_high,
-            flag=normalize_flag(item.get("flag")),
-            source_file=filename,
-            page=page_num,
-            group=grp,
-        )
-        m = enrich_with_db(m, canonical)
-        out.append(m)
+def row_from_item(item: Dict[str, Any], filename: str, page_num: int) -> Optional["Row"]:
+    """One OCR measurement object -> enriched Row (None for headers / empty values)."""
+    if not isinstance(item, dict):
+        return None
+    raw_name = str(item.get("name", "")).strip()
+    if not raw_name:
+        return None
+    if is_section_header(raw_name):
+        return None
 
-    return out
+    raw_value = str(item.get("value", "")).strip()
+    if is_empty_value(raw_value):
+        return None
+
+    # Границы могут прийти прямо из OCR
+    item_ref_low = _to_float(item.get("ref_low"))
+    item_ref_high = _to_float(item.get("ref_high"))
+
+    # Собираем reference_text, если OCR не дал строку
+    reference_text = item.get("reference_text")
+    if not ref_string_looks_plausible(reference_text):
+        reference_text = _compose_reference_text(item_ref_low, item_ref_high)
+
+    canonical, _ = canon_name_soft(raw_name)
+
+    grp = item.get("group")
+    if isinstance(grp, str):
+        grp = grp.strip()
+
+    m = Row(
+        name=canonical or raw_name,
+        value=raw_value,
+        unit=(item.get("unit") or None),
+        reference_text=reference_text,
+        ref_low=item_ref_low,
+        ref_high=item_ref_high,
+        flag=normalize_flag(item.get("flag")),
+        source_file=filename,
+        page=page_num,
+        group=grp,
+    )
+    return enrich_with_db(m, canonical)
 
 # ---------- expand files to pages ----------
 def expand_files_to_pages(files_payload: List[Tuple[str, Optional[str], bytes, int]]) -> List[Tuple[str, int, bytes]]:
@@ -590,7 +1220,12 @@ def expand_files_to_pages(files_payload: List[Tuple[str, Optional[str], bytes, i
                 continue
         else:
             try:
-                img = Image.open(io.BytesIO(raw)).convert("RGB")
+                img = Image.open(io.BytesIO(raw))
+                if settings.PREPROCESS_ENABLED and img.format in ("JPEG", "PNG"):
+                    # the preprocess stage re-encodes anyway; skip a full-size PNG round trip
+                    pages.append((sf, 1, raw))
+                    continue
+                img = img.convert("RGB")
                 buf = io.BytesIO()
                 img.save(buf, format="PNG")
                 pages.append((sf, 1, buf.getvalue()))
@@ -599,133 +1234,829 @@ def expand_files_to_pages(files_payload: List[Tuple[str, Optional[str], bytes, i
                 continue
     return pages
 
-# ---------- API: non-stream ----------
-
-@app.get("/api/health")
-def health():
-    return {"ok": True, "model": MODEL_NAME, "openai": bool(openai_client)}
-
-@app.post("/api/process", response_model=ParseResponse)
-async def process(files: List[UploadFile] = File(...)):
-    model = genai.GenerativeModel(MODEL_NAME)
+def collapse_duplicate_files(files_payload: List[Tuple[str, Optional[str], bytes, int]]) -> Tuple[List[Tuple[str, Optional[str], bytes, int]], List[Dict[str, Any]]]:
+    """Byte-identical files within one request are rendered and OCR'd once."""
+    seen: Dict[str, str] = {}
+    unique: List[Tuple[str, Optional[str], bytes, int]] = []
+    dropped: List[Dict[str, Any]] = []
+    for filename, content_type, raw, file_idx in files_payload:
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest in seen:
+            dropped.append({
+                "filename": f"{filename}#{file_idx}", "page": None, "reason": "duplicate_file",
+                "duplicate_of": {"filename": seen[digest]},
+            })
+            continue
+        seen[digest] = f"{filename}#{file_idx}"
+        unique.append((filename, content_type, raw, file_idx))
+    return unique, dropped
+
+def prefilter_pages(pages: List[Tuple[str, int, bytes]]) -> Tuple[List[Tuple[str, int, bytes]], List[Dict[str, Any]]]:
+    """Drop blank / duplicate (/ table-less) pages so they never cost a model call."""
+    if not settings.PREFILTER_ENABLED:
+        return pages, []
+    kept, skipped = filter_pages(
+        pages,
+        blank_ink=settings.PREFILTER_BLANK_INK,
+        dup_distance=settings.PREFILTER_DUP_DISTANCE,
+        table_check=settings.PREFILTER_TABLE_CHECK,
+    )
+    for s in skipped:
+        print(f"Skipped file {s['filename']}, page {s['page']}: {s['reason']}")
+    return kept, skipped
+
+@profiled
+def prepare_pages(files_payload: List[Tuple[str, Optional[str], bytes, int]],
+                  mem: Optional[RequestMemory] = None) -> Tuple[List[Tuple[str, int, bytes]], List[Dict[str, Any]]]:
+    """Uploads -> pages worth sending to the model, plus what was skipped and why."""
+    files_payload, dropped = collapse_duplicate_files(files_payload)
+    for d in dropped:
+        print(f"Skipped file {d['filename']}: same content as {d['duplicate_of']['filename']}")
+    with stage(mem, "render") as st, span("render", files=len(files_payload)) as sp:
+        pages = expand_files_to_pages(files_payload)
+        st["held_bytes"] = page_bytes(pages)
+        sp["pages"] = len(pages)
+    with stage(mem, "prefilter") as st, span("prefilter") as sp:
+        pages, skipped = prefilter_pages(pages)
+        st["held_bytes"] = page_bytes(pages)
+        sp["kept"], sp["skipped"] = len(pages), len(skipped)
+    with stage(mem, "preprocess") as st, span("preprocess", pages=len(pages)) as sp:
+        pages = preprocess(pages)
+        st["held_bytes"] = sp["bytes"] = page_bytes(pages)
+    return pages, dropped + skipped
+
+preprocess_stats = PreprocessStats()
+
+def preprocess(pages: List[Tuple[str, int, bytes]]) -> List[Tuple[str, int, bytes]]:
+    """Crop / deskew / trim kept pages before OCR; CPU time and bytes saved go to preprocess_stats."""
+    if not settings.PREPROCESS_ENABLED or not pages:
+        return pages
+    pages, infos = preprocess_pages(
+        pages,
+        max_side=settings.PREPROCESS_MAX_SIDE,
+        deskew=settings.PREPROCESS_DESKEW,
+        flatten=settings.PREPROCESS_FLATTEN,
+    )
+    preprocess_stats.record(infos)
+    print(preprocess_note(infos))
+    return pages
 
+async def read_uploads(files: List[UploadFile], mem: Optional[RequestMemory] = None) -> List[Tuple[str, Optional[str], bytes, int]]:
     mem_files: list[tuple[str, Optional[str], bytes, int]] = []
-    for idx, f in enumerate(files, start=1):
-        raw = await f.read()
-        mem_files.append((f.filename or "file", f.content_type, raw, idx))
+    with stage(mem, "upload") as st, span("upload", files=len(files)) as sp:
+        for idx, f in enumerate(files, start=1):
+            raw = await f.read()
+            mem_files.append((f.filename or "file", f.content_type, raw, idx))
+        st["held_bytes"] = sp["bytes"] = sum(len(f[2]) for f in mem_files)
+    return mem_files
+
+# ---------- memory accounting ----------
+if settings.MEMORY_TRACEMALLOC:
+    tracemalloc.start()
+memory_sampler = RssSampler(settings.MEMORY_SAMPLE_MS / 1000)
+memory_stats = MemoryStats()
+
+def request_memory() -> RequestMemory:
+    """Per-stage memory of one upload; its summary goes to /api/usage and, with ?debug=true, the response."""
+    return RequestMemory(memory_sampler, memory_stats)
+
+# ---------- usage & budgets ----------
+client_usage = UsageStats(max_kinds=settings.USAGE_MAX_CLIENTS)   # every model call, per client id
+CLIENT_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+KNOWN_CLIENT_IDS = {c.strip() for c in settings.USAGE_CLIENT_IDS.split(",") if c.strip()}
+
+def usage_client(request: Request) -> str:
+    """X-Client-Id if well-formed (and listed in USAGE_CLIENT_IDS, when set), else the client address."""
+    cid = (request.headers.get("x-client-id") or "").strip()
+    if CLIENT_ID_RE.match(cid) and (not KNOWN_CLIENT_IDS or cid in KNOWN_CLIENT_IDS):
+        return cid
+    return request.client.host if request.client else "anonymous"
+
+def request_usage(request: Request, token_budget: Optional[int] = None) -> RequestUsage:
+    """Usage tracker for one request; the budget is the lower of REQUEST_TOKEN_BUDGET and the client's own."""
+    budgets = [b for b in (settings.REQUEST_TOKEN_BUDGET, token_budget or 0) if b > 0]
+    return RequestUsage(min(budgets) if budgets else 0, usage_client(request), client_usage)
+
+def budget_skip(filename: str, page_num: int) -> Dict[str, Any]:
+    print(f"Token budget exhausted: not processing {filename}, page {page_num}")
+    return {"filename": filename, "page": page_num, "reason": "token_budget"}
+
+# ---------- deadlines & disconnects ----------
+DISCONNECT_POLL_S = 1.0
+
+def request_deadline(request: Request) -> Deadline:
+    """Deadline for one request: the lower of REQUEST_DEADLINE_SECONDS and the client's X-Request-Deadline (seconds)."""
+    limits = [v for v in (settings.REQUEST_DEADLINE_SECONDS, parse_seconds(request.headers.get("x-request-deadline"))) if v > 0]
+    return Deadline(min(limits) if limits else None)
+
+def deadline_skip(filename: str, page_num: int, reason: str) -> Dict[str, Any]:
+    print(f"Request {reason}: not processing {filename}, page {page_num}")
+    return {"filename": filename, "page": page_num, "reason": reason}
+
+def unavailable_skip(filename: str, page_num: int, e: CircuitOpen) -> Dict[str, Any]:
+    print(f"{e}: not processing {filename}, page {page_num}")
+    return {"filename": filename, "page": page_num, "reason": "provider_unavailable"}
+
+def failed_skip(filename: str, page_num: int, e: OcrFailed) -> Dict[str, Any]:
+    print(f"{e}: page left out of the report")
+    return {"filename": filename, "page": page_num, "reason": "ocr_failed"}
+
+def error_skip(filename: str, page_num: int, e: Exception) -> Dict[str, Any]:
+    print(f"Processing error {filename}, page {page_num}: {e!r}: page left out of the report")
+    return {"filename": filename, "page": page_num, "reason": "error"}
+
+async def cancel_on_disconnect(request: Request, deadline: Deadline):
+    """Cancel the request's outstanding OCR as soon as the client hangs up."""
+    while not deadline.done:
+        if await request.is_disconnected():
+            print("Client disconnected: cancelling outstanding OCR")
+            deadline.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+async def cancel_when_abandoned(session: StreamSession, deadline: Deadline):
+    """
+    Streams outlive their connection (clients resume by Last-Event-ID), so a stream
+    is only cancelled once nobody has followed it for STREAM_ABANDON_SECONDS.
+    """
+    while not deadline.done and not session.done:
+        if session.abandoned(settings.STREAM_ABANDON_SECONDS):
+            print(f"Stream {session.id} abandoned: cancelling outstanding OCR")
+            deadline.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+@app.get("/api/usage")
+def usage_counters(x_admin_token: Optional[str] = Header(None)):
+    """
+    Model usage since start, OCR routing outcomes, page-preprocessing cost/savings,
+    the shared cache / provider limits and memory per pipeline stage. Usage per
+    client (X-Client-Id, else client address) is only included for X-Admin-Token.
+    The per-client and memory counters are per worker process.
+    """
+    out: Dict[str, Any] = {}
+    if admin_ok(x_admin_token, settings.ADMIN_TOKEN):
+        out["clients"] = client_usage.snapshot()
+    return {
+        **out,
+        "total": client_usage.total(),
+        "summary": summary_usage.snapshot(),
+        "ocr_routing": route_stats.snapshot(),
+        "preprocess": preprocess_stats.snapshot(),
+        "shared_state": shared_state.snapshot(),
+        "memory": memory_stats.snapshot(),
+    }
 
-    pages = expand_files_to_pages(mem_files)
-    if not pages:
-        return ParseResponse(measurements=[], notes="Failed to process any files")
+# ---------- API: admin ----------
+def require_admin(token: Optional[str]):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_ok(token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
-    all_measurements: List[Measurement] = []
-    for filename, page_num, image_bytes in pages:
-        items = process_single_page(model, image_bytes, filename, page_num)
-        all_measurements.extend(items)
-        print(f"Processed file {filename}, page {page_num}: found {len(items)} measurements")
+@app.get("/api/admin/profiles")
+def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    """
+    Stored request profiles, newest first. A request is profiled when sent with
+    X-Profile: 1 and X-Admin-Token (its id comes back in X-Profile-Id), or when
+    picked by PROFILE_SAMPLE_RATE.
+    """
+    require_admin(x_admin_token)
+    return {"profiles": profile_store.list()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Folded stacks weighted by CPU µs: flamegraph.pl / speedscope / inferno input."""
+    require_admin(x_admin_token)
+    path = profile_store.folded_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain", filename=f"profile-{profile_id}.folded")
 
-    best: Dict[str, Measurement] = {}
-    for m in all_measurements:
-        key = leukocyte_dedup_key(m)
-        if key not in best or score_entry(m) > score_entry(best[key]):
-            best[key] = m
+# ---------- API: non-stream ----------
 
-    results = list(best.values())
-    return ParseResponse(measurements=results, notes=f"Processed {len(pages)} pages")
+@app.get("/api/health")
+def health():
+    return {
+        "ok": True, "model": MODEL_NAME, "fast_model": FAST_MODEL_NAME, "openai": bool(openai_client),
+        "failover_model": FAILOVER_MODEL,
+        "providers": {name: b.snapshot() for name, b in provider_breakers.items()},
+    }
+
+@app.post("/api/process", response_model=ParseResponse)
+async def process(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    patient_id: Optional[str] = Form(None),
+    report_date: Optional[str] = Form(None),
+    token_budget: Optional[int] = Form(None),
+    debug: bool = False,
+    x_admin_token: Optional[str] = Header(None),
+):
+    patient_id = history_patient(patient_id, x_admin_token)
+    deadline = request_deadline(request)
+    model = models.get(MODEL_NAME)
+    report_date = parse_report_date(report_date)
+    usage = request_usage(request, token_budget)
+    mem = request_memory()
+
+    mem_files = await read_uploads(files, mem)
+
+    # render, prefilter and preprocess are CPU-bound: keep the event loop serving other requests
+    pages, skipped = await asyncio.to_thread(prepare_pages, mem_files, mem)
+    if not pages and not skipped:
+        mem.finish()
+        return FastJSONResponse(ParseResponse(measurements=[], notes="Failed to process any files"))
+
+    all_measurements: List[Row] = []
+    processed = 0
+    watcher = asyncio.create_task(cancel_on_disconnect(request, deadline))
+    try:
+        for filename, page_num, image_bytes in pages:
+            if usage.exhausted:
+                skipped.append(budget_skip(filename, page_num))
+                continue
+            if deadline.done:
+                skipped.append(deadline_skip(filename, page_num, deadline.why()))
+                continue
+            try:
+                with mem.stage("ocr") as st:
+                    st["held_bytes"] = payload_bytes(image_bytes)
+                    items = await asyncio.to_thread(process_single_page, model, image_bytes, filename, page_num,
+                                                    usage, None, deadline)
+            except Cancelled as e:
+                skipped.append(deadline_skip(filename, page_num, e.reason))
+                continue
+            except CircuitOpen as e:
+                skipped.append(unavailable_skip(filename, page_num, e))
+                continue
+            except OcrFailed as e:
+                skipped.append(failed_skip(filename, page_num, e))
+                continue
+            processed += 1
+            all_measurements.extend(items)
+            print(f"Processed file {filename}, page {page_num}: found {len(items)} measurements")
+    finally:
+        watcher.cancel()
+
+    # built from our own rows: no need to validate/serialize through response_model again
+    with mem.stage("response"):
+        resp = parse_response(all_measurements, processed, skipped, usage)
+    memory = mem.finish()
+    if debug:
+        resp.debug = {"memory": memory}
+    report_id = None
+    if not deadline.cancelled:      # nobody is waiting for a cancelled report; it will be resubmitted
+        report_id = await asyncio.to_thread(record_history, patient_id, resp.measurements, report_date)
+    headers = {**usage.headers(), "X-Result-Status": resp.status}
+    if report_id:
+        headers["X-Report-Id"] = report_id
+    return FastJSONResponse(resp, headers=headers)
 
 # ---------- API: stream with progress ----------
-def _sse(event: str, data: Dict[str, Any]) -> bytes:
-    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+def _sse(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: ".encode("utf-8") + dumps(data) + b"\n\n"
 
-@app.post("/api/process/stream")
-async def process_stream(files: List[UploadFile] = File(...)):
-    model = genai.GenerativeModel(MODEL_NAME)
+stream_sessions = StreamRegistry(_sse, retention_s=settings.STREAM_RETENTION_SECONDS)
 
-    mem_files: list[tuple[str, Optional[str], bytes, int]] = []
-    for idx, f in enumerate(files, start=1):
-        raw = await f.read()
-        mem_files.append((f.filename or "file", f.content_type, raw, idx))
-
-    pages = expand_files_to_pages(mem_files)
+async def run_stream(session: StreamSession, model, pages: List[Tuple[str, int, bytes]], skipped: List[Dict[str, Any]],
+                     usage: RequestUsage, patient_id: Optional[str] = None, report_date: Optional[str] = None,
+                     deadline: Optional[Deadline] = None, mem: Optional[RequestMemory] = None,
+                     debug: bool = False):
+    """
+    Pipeline behind /api/process/stream. Runs detached from the HTTP connection,
+    so a client that drops can resume from the session without new model calls.
+    Events: meta, skip, row (as read, while the page is still generating), page (counts),
+    upsert/replace (dedup deltas), retract, usage, progress, done (with ?debug=true: per-stage memory).
+    Rows are provisional until their page succeeds: only then do they enter the
+    dedup state (upsert/replace). Streamed rows that did not survive (the call
+    failed, failed over or was cancelled) are withdrawn with a retract event.
+    Pages left when the deadline passes, or once the stream is abandoned, are
+    skipped ("deadline" / "cancelled") and done reports what was found so far.
+    """
+    loop = asyncio.get_running_loop()
     total_pages = len(pages)
+    processed = 0
+    deadline = deadline or Deadline()
+    watcher = asyncio.create_task(cancel_when_abandoned(session, deadline))
+    try:
+        session.emit("meta", {
+            "total_steps": total_pages, "skipped_pages": len(skipped), "stream_id": session.id,
+            "budget_tokens": usage.budget_tokens or None,
+        })
+        for s in skipped:
+            session.emit("skip", s)
+        session.emit("progress", {"step": 0, "total": total_pages, "percent": 0})
+
+        state = DedupState()
+
+        def emit_changes(changes: List[Tuple[str, str, "Row"]]):
+            for op in ("upsert", "replace"):
+                delta = [{"key": k, "m": compact(m)} for o, k, m in changes if o == op]
+                if delta:
+                    session.emit(op, {"items": delta})
+
+        provisional: Dict[Tuple[str, int], List[str]] = {}     # page -> keys of rows streamed so far
+
+        def streamed_row(filename: str, page_num: int, m: "Row"):
+            # on the loop thread: session and dedup state are not thread-safe
+            key = leukocyte_dedup_key(m)
+            provisional.setdefault((filename, page_num), []).append(key)
+            session.emit("row", {"filename": filename, "page": page_num, "key": key, "m": compact(m)})
 
-    async def event_gen():
-        yield _sse("meta", {"total_steps": total_pages})
-        yield _sse("progress", {"step": 0, "total": total_pages, "percent": 0})
-
-        all_measurements: List[Measurement] = []
+        def retract(filename: str, page_num: int, survivors: Optional[set] = None):
+            keys = [k for k in dict.fromkeys(provisional.pop((filename, page_num), [])) if k not in (survivors or ())]
+            if keys:
+                session.emit("retract", {"filename": filename, "page": page_num, "keys": keys})
 
         for idx, (filename, page_num, image_bytes) in enumerate(pages, start=1):
+            if usage.exhausted or deadline.done:
+                s = budget_skip(filename, page_num) if usage.exhausted else deadline_skip(filename, page_num, deadline.why())
+                skipped.append(s)
+                session.emit("skip", s)
+                session.emit("progress", {"step": idx, "total": total_pages, "percent": int(idx * 100 / max(1, total_pages))})
+                continue
+            on_row = None
+            if settings.OCR_STREAMING:
+                def on_row(m: "Row", filename=filename, page_num=page_num):
+                    loop.call_soon_threadsafe(streamed_row, filename, page_num, m)
             try:
-                items = process_single_page(model, image_bytes, filename, page_num)
-                all_measurements.extend(items)
-
-                yield _sse("page", {
-                    "filename": filename,
-                    "page": page_num,
-                    "items": [m.model_dump() for m in items],
-                })
+                with stage(mem, "ocr") as st:
+                    st["held_bytes"] = payload_bytes(image_bytes)
+                    items = await asyncio.to_thread(process_single_page, model, image_bytes, filename, page_num,
+                                                    usage, on_row, deadline)
+                processed += 1
+                # the full page is authoritative: streamed rows it does not contain are withdrawn
+                retract(filename, page_num, {leukocyte_dedup_key(m) for m in items})
+                changes = state.add(items)
+
+                session.emit("page", {"filename": filename, "page": page_num, "count": len(items)})
+                emit_changes(changes)
+                session.emit("usage", usage.as_dict())
 
                 percent = int(idx * 100 / max(1, total_pages))
-                yield _sse("progress", {"step": idx, "total": total_pages, "percent": percent})
-                yield b": keep-alive\n\n"
+                session.emit("progress", {"step": idx, "total": total_pages, "percent": percent})
             except Exception as e:
-                yield _sse("progress", {"error": f"Processing error {filename}, page {page_num}: {e}"})
-
-        best: Dict[str, Measurement] = {}
-        for m in all_measurements:
-            key = leukocyte_dedup_key(m)
-            if key not in best or score_entry(m) > score_entry(best[key]):
-                best[key] = m
-
-        final_measurements = list(best.values())
-        yield _sse("done", ParseResponse(
-            measurements=final_measurements,
-            notes=f"Processed {total_pages} pages"
-        ).model_dump())
-
+                # a page that fails for any reason is reported as skipped: done must not claim "complete"
+                retract(filename, page_num)
+                if isinstance(e, Cancelled):
+                    s = deadline_skip(filename, page_num, e.reason)
+                elif isinstance(e, CircuitOpen):
+                    s = unavailable_skip(filename, page_num, e)
+                elif isinstance(e, OcrFailed):
+                    s = failed_skip(filename, page_num, e)
+                else:
+                    s = error_skip(filename, page_num, e)
+                skipped.append(s)
+                session.emit("skip", s)
+                session.emit("progress", {"step": idx, "total": total_pages, "percent": int(idx * 100 / max(1, total_pages))})
+
+        report_id = None
+        if not deadline.cancelled:
+            report_id = await asyncio.to_thread(record_history, patient_id, state.results(), report_date)
+
+        memory = mem.finish() if mem is not None else None
+        # the client already holds the final table from the deltas
+        session.emit("done", {
+            "count": len(state.best),
+            "checksum": state.checksum(),
+            "notes": f"Processed {processed} pages" + skipped_note(skipped) + usage.note(),
+            "status": result_status(skipped),
+            "usage": usage.as_dict(),
+            "report_id": report_id,
+            "composites": compute_composites([(state.results(), None, None)])[0],
+            **({"debug": {"memory": memory}} if debug and memory else {}),
+        })
+    finally:
+        watcher.cancel()
+        session.close()
+
+def _stream_response(session: StreamSession, after: int = 0) -> StreamingResponse:
     return StreamingResponse(
-        event_gen(),
+        session.follow(after),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
+            "X-Stream-Id": session.id,
         },
     )
 
-@app.post("/api/summary", response_model=SummaryResponse)
-def api_summary(req: SummaryRequest):
-    if openai_client is None:
-        return SummaryResponse(summary_md="OpenAI API key is not configured on the server (.env OPENAI_API_KEY).", model="gpt-4o-mini")
-    try:
-        db_json = json.dumps(DB, ensure_ascii=False)
-        report_json = json.dumps(req.report.model_dump(), ensure_ascii=False)
-
-        locale = (req.locale or "ru").strip().lower()
-        if locale not in ("ru", "en", "ua"):
-            locale = "ru"
-
-        user_prompt = (
-            f"Response language: {locale}.\n"
-            "Given:\n"
-            "1) Full parameter database (JSON):\n"
-            f"{db_json}\n\n"
-            "2) Final extracted report (JSON):\n"
-            f"{report_json}\n\n"
-            "GENERATE REPORT ACCORDING TO THE SYSTEM INSTRUCTIONS ABOVE AND USING CHOSEN LANGUAGE ONLY.\n"
-        )
+@app.post("/api/process/stream")
+async def process_stream(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    patient_id: Optional[str] = Form(None),
+    report_date: Optional[str] = Form(None),
+    token_budget: Optional[int] = Form(None),
+    debug: bool = False,
+    x_admin_token: Optional[str] = Header(None),
+):
+    patient_id = history_patient(patient_id, x_admin_token)
+    deadline = request_deadline(request)
+    model = models.get(MODEL_NAME)
+    report_date = parse_report_date(report_date)
+    mem = request_memory()
+
+    mem_files = await read_uploads(files, mem)
+
+    # render, prefilter and preprocess are CPU-bound: keep the event loop serving other requests
+    pages, skipped = await asyncio.to_thread(prepare_pages, mem_files, mem)
+
+    session = stream_sessions.create()
+    usage = request_usage(request, token_budget)
+    session.task = asyncio.create_task(run_stream(session, model, pages, skipped, usage, patient_id, report_date,
+                                                  deadline, mem, debug))
+    return _stream_response(session)
+
+@app.get("/api/process/stream/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[int] = None,
+):
+    """Reconnect to a running/finished stream; replays events after Last-Event-ID (or ?after=)."""
+    session = stream_sessions.get(stream_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    if after is None:
+        try:
+            after = int(last_event_id or 0)
+        except ValueError:
+            after = 0
+    return _stream_response(session, after)
+
+# ---------- API: composite indices ----------
+@app.post("/api/composites", response_model=CompositeBatchResponse)
+@profiled
+def api_composites(req: CompositeBatchRequest):
+    """Derived indices for many reports at once (cohorts, bulk jobs); sex/age enable eGFR and FIB-4."""
+    results = compute_composites([(r.measurements, r.sex, r.age) for r in req.reports])
+    return FastJSONResponse(CompositeBatchResponse.model_construct(results=results))
+
+# ---------- API: async jobs ----------
+job_store = JobStore(settings.JOBS_DB or os.path.join(os.path.dirname(__file__), "state", "jobs.sqlite3"))
+
+def run_job(store: JobStore, job_id: str):
+    """
+    Worker-side pipeline for one job. Page results are persisted as they complete,
+    so a job resumed after a restart only OCRs the pages it had not finished.
+    """
+    pages, skipped = prepare_pages(store.load_files(job_id))
+    if not pages and not skipped:
+        store.finish(job_id, ParseResponse(measurements=[], notes="Failed to process any files").model_dump())
+        return
+    store.set_total(job_id, len(pages))
+    done = store.page_results(job_id)
+    for s in skipped:
+        if (s["filename"], s["page"] or 0) not in done:
+            store.save_page(job_id, s["filename"], s["page"] or 0, "skipped", s)
+
+    model = models.get(MODEL_NAME)
+    # budget counts the calls of this run; pages finished by an earlier attempt are free
+    usage = RequestUsage(settings.REQUEST_TOKEN_BUDGET, "jobs", client_usage)
+    all_measurements: List[Row] = []
+    processed = 0
+    for filename, page_num, image_bytes in pages:
+        prev = done.get((filename, page_num))
+        if prev and prev["status"] == "done":
+            items = [Row.from_dict(d) for d in prev["items"]]
+        elif usage.exhausted:
+            skipped.append(budget_skip(filename, page_num))
+            continue
+        else:
+            try:
+                items = process_single_page(model, image_bytes, filename, page_num, usage)
+            except CircuitOpen as e:
+                # not saved: a retried/resumed job OCRs the page again
+                skipped.append(unavailable_skip(filename, page_num, e))
+                continue
+            except OcrFailed as e:
+                # saved for the status view; only "done" pages are reused, so a rerun retries it
+                s = failed_skip(filename, page_num, e)
+                skipped.append(s)
+                store.save_page(job_id, filename, page_num, "failed", s)
+                continue
+            store.save_page(job_id, filename, page_num, "done", [m.as_dict() for m in items])
+            print(f"Job {job_id}: processed file {filename}, page {page_num}: found {len(items)} measurements")
+        processed += 1
+        all_measurements.extend(items)
+
+    store.finish(job_id, parse_response(all_measurements, processed, skipped, usage).model_dump())
+
+def run_traced_job(store: JobStore, job_id: str):
+    """run_job as its own trace; the job id is the request id of its spans and log lines."""
+    with tracer.request(job_id, "job", kind=1):
+        run_job(store, job_id)
+
+job_pool = WorkerPool(
+    job_store, run_traced_job,
+    workers=settings.JOB_WORKERS,
+    stale_s=settings.JOB_STALE_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retention_s=settings.JOB_RETENTION_HOURS * 3600,
+)
+
+@app.on_event("startup")
+def _start_job_workers():
+    if settings.JOB_WORKERS > 0:
+        job_pool.start()
+
+@app.on_event("shutdown")
+def _stop_job_workers():
+    job_pool.stop()
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(files: List[UploadFile] = File(...)):
+    job_id = job_store.create(await read_uploads(files))
+    job_pool.notify()
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job["done_pages"] = sum(1 for p in job["pages"] if p["status"] == "done")
+    return job
+
+# ---------- API: patient history ----------
+history_store = HistoryStore(settings.HISTORY_DB or os.path.join(os.path.dirname(__file__), "state", "history.sqlite3"))
+
+def parse_report_date(s: Optional[str]) -> str:
+    """ISO date for the history store; accepts YYYY-MM-DD or DD.MM.YYYY / DD/MM/YYYY, defaults to today."""
+    if not s or not s.strip():
+        return date.today().isoformat()
+    t = s.strip()
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(t, fmt).date().isoformat()
+        except ValueError:
+            continue
+    raise HTTPException(status_code=422, detail=f"Unrecognized report_date: {s}")
 
-        resp = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+def record_history(patient_id: Optional[str], measurements: List[Any], report_date: str,
+                   report_id: Optional[str] = None) -> Optional[str]:
+    """Store a deduplicated report for a patient; no-op unless history is enabled and a patient id is given."""
+    if not (settings.HISTORY_ENABLED and patient_id):
+        return None
+    # value stays as printed; value_num/unit are canonical when the unit was recognized,
+    # so a series mixes labs without string handling (client-posted reports may lack them)
+    normalize_rows([m for m in measurements if m.norm_value is None], UNIT_REGISTRY, value_to_number)
+    rows = [
+        (m.name, m.value, m.norm_value, m.norm_unit, m.flag, m.group) if m.norm_value is not None
+        else (m.name, m.value, value_to_number(m.value), m.unit, m.flag, m.group)
+        for m in measurements
+    ]
+    return history_store.store_report(patient_id, rows, report_date, report_id)
+
+def _require_history(token: Optional[str]):
+    # patient data: reads, writes and deletes all need X-Admin-Token (no ADMIN_TOKEN = no history API)
+    if not settings.HISTORY_ENABLED:
+        raise HTTPException(status_code=404, detail="History store is disabled (HISTORY_ENABLED)")
+    require_admin(token)
+
+def history_patient(patient_id: Optional[str], token: Optional[str]) -> Optional[str]:
+    """patient_id on an upload writes history: same token as the history API, checked before any OCR."""
+    if not (settings.HISTORY_ENABLED and patient_id):
+        return None
+    require_admin(token)
+    return patient_id
+
+def _history_names(metric: str) -> List[str]:
+    # exact stored name, plus its canonical form (keeps WBC %/absolute variants apart)
+    canon, _ = canon_name_soft(metric)
+    names = [metric]
+    if canon:
+        canon = adjust_wbc_canonical(canon, None, None, metric)
+        if canon != metric:
+            names.append(canon)
+    return names
+
+@app.post("/api/history/{patient_id}", response_model=HistoryStoreResponse)
+def store_history(patient_id: str, req: HistoryStoreRequest, x_admin_token: Optional[str] = Header(None)):
+    _require_history(x_admin_token)
+    report_id = record_history(patient_id, req.report.measurements, parse_report_date(req.report_date), req.report_id)
+    return HistoryStoreResponse(patient_id=patient_id, report_id=report_id, stored=len(req.report.measurements))
+
+@app.get("/api/history/{patient_id}/series", response_model=HistorySeries)
+def history_series(patient_id: str, metric: str, since: Optional[str] = None, until: Optional[str] = None,
+                   x_admin_token: Optional[str] = Header(None)):
+    _require_history(x_admin_token)
+    points = history_store.series(
+        patient_id, _history_names(metric),
+        since=parse_report_date(since) if since else None,
+        until=parse_report_date(until) if until else None,
+    )
+    return FastJSONResponse(HistorySeries.model_construct(patient_id=patient_id, metric=metric, points=points))
+
+@app.get("/api/history/{patient_id}/latest", response_model=HistoryLatest)
+def history_latest(patient_id: str, x_admin_token: Optional[str] = Header(None)):
+    _require_history(x_admin_token)
+    return FastJSONResponse(HistoryLatest.model_construct(patient_id=patient_id, metrics=history_store.latest(patient_id)))
+
+@app.delete("/api/history/{patient_id}/{report_id}")
+def history_delete(patient_id: str, report_id: str, x_admin_token: Optional[str] = Header(None)):
+    _require_history(x_admin_token)
+    return {"deleted": history_store.delete_report(patient_id, report_id)}
+
+# ---------- API: summary ----------
+SUMMARY_MODEL = "gpt-4o-mini"
+
+SECTION_SYSTEM = """
+You are a clinical assistant for interpreting laboratory test results.
+You receive ONE section of a blood test report and the database entries (names, units, reference ranges, notes)
+for its parameters.
+Output ONLY the Markdown bullet list for this section, no heading, one line per parameter:
+- **Name:** [value, reference] → shortly describe and CHOOSE ONE OF THESE EMOJIS: ✅ (normal), ⚠️ (borderline), ❌ (abnormal)
+Do not provide a final diagnosis.
+USE ONLY THE PROVIDED LANGUAGE FOR YOUR OUTPUT (ALL NAMES AND TERMS HAVE TO BE TRANSLATED).
+"""
+
+FINAL_SUMMARY_SYSTEM = """
+You are a clinical assistant for interpreting laboratory test results.
+You receive the already graded sections of a blood test report (✅ normal, ⚠️ borderline, ❌ abnormal).
+Write ONLY the body of the "Final Summary" section: a general outline of the patient's situation, the most
+critical indicators and their potential explanation, and basic recommendations for stabilizing them and
+contacting a doctor, if necessary.
+Do not repeat the per-parameter lists and do not add headings.
+Do not provide a final diagnosis. Risks and recommendations should only be expressed as probabilistic assumptions.
+Focus on different explanations of deviations (like normal absolute values but a high percentage).
+USE ONLY THE PROVIDED LANGUAGE FOR YOUR OUTPUT.
+"""
+
+def summary_locale(locale: Optional[str]) -> str:
+    locale = (locale or "ru").strip().lower()
+    return locale if locale in SUMMARY_LOCALES else "ru"
+
+def grade_sections(measurements: List[Any]) -> Dict[str, List[Tuple[Any, Optional[str]]]]:
+    """Template section -> its measurements with their grade, in template order."""
+    return {
+        key: [
+            (m, grade(value_to_number(m.value), m.ref_low, m.ref_high, m.flag, settings.SUMMARY_BORDERLINE_MARGIN))
+            for m in items
+        ]
+        for key, items in partition(measurements).items()
+    }
+
+def summary_completion(kind: str, system: str, user: str, usage: Optional[RequestUsage] = None) -> str:
+    """One summary model call; usage (incl. prompt-cache hits) is recorded per call kind and per request."""
+    client = openai_client.with_options(timeout=settings.SUMMARY_LLM_TIMEOUT, max_retries=0)
+    # waiting for a shared slot counts against the same timeout (then the local render is used)
+    with provider_slot("openai", Deadline(settings.SUMMARY_LLM_TIMEOUT), settings.SUMMARY_LLM_TIMEOUT + 30), \
+            span("model_call", provider="openai", model=SUMMARY_MODEL, kind=kind):
+        t0 = time.perf_counter()
+        resp = client.chat.completions.create(
+            model=SUMMARY_MODEL,
             messages=[
-                {"role": "system", "content": SUMMARY_SYSTEM},
-                {"role": "user", "content": user_prompt},
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
             ],
             temperature=0.2,
         )
+    counts = usage_counts(resp)
+    summary_usage.record(kind, counts, time.perf_counter() - t0)
+    if usage is not None:
+        usage.add(SUMMARY_MODEL, counts, time.perf_counter() - t0)
+    print(f"Summary {kind}: {counts['prompt_tokens']} prompt tokens ({counts['cached_tokens']} cached), "
+          f"{counts['completion_tokens']} completion, {time.perf_counter() - t0:.2f}s")
+    text = resp.choices[0].message.content if resp.choices else ""
+    if not text:
+        raise ValueError("empty response")
+    return text
+
+def llm_section(key: str, items: List[Any], locale: str, usage: Optional[RequestUsage] = None) -> str:
+    """One template section written by the model, given only that section's measurements and DB entries."""
+    names = {m.name for m in items}
+    fragment = [x for x in DB.get("metrics", []) if x.get("canonical_name") in names]
+    user_prompt = (
+        f"Section: {heading(key, 'en').split(' ', 2)[-1]}\n"
+        "1) Parameter database fragment (JSON):\n"
+        f"{dumps(fragment).decode('utf-8')}\n\n"
+        "2) Measurements of this section (JSON):\n"
+        f"{dumps(items).decode('utf-8')}\n\n"
+        f"Response language: {locale}.\n"
+    )
+    text = summary_completion("section", SECTION_SYSTEM, user_prompt, usage)
+    return f"{heading(key, locale)}\n{text.strip()}"
+
+summary_usage = UsageStats()
+summary_pool = ThreadPoolExecutor(max_workers=settings.SUMMARY_PARALLELISM, thread_name_prefix="summary")
 
-        text = resp.choices[0].message.content if resp.choices else ""
-        return SummaryResponse(summary_md=text or "", model="gpt-4o-mini")
+def parallel_summary(graded: Dict[str, List[Tuple[Any, Optional[str]]]], locale: str,
+                     usage: Optional[RequestUsage] = None) -> Tuple[str, str]:
+    """
+    mode=parallel: one model call per section, all in flight at once, then a short
+    final-summary call over the section outputs. Latency ~ slowest section + final.
+    A failed section is rendered locally instead. Returns (markdown, model label).
+    """
+    t0 = time.perf_counter()
+    # each section runs in a copy of this context, so its spans/log lines keep the request id
+    futs = {
+        key: summary_pool.submit(contextvars.copy_context().run, llm_section, key, [m for m, _ in items], locale, usage)
+        for key, items in graded.items()
+    }
+    sections: List[str] = []
+    failed = 0
+    for key, fut in futs.items():     # graded is in template order
+        try:
+            sections.append(fut.result())
+        except Exception as e:
+            print(f"Summary: section {key} failed ({e}), rendering it locally")
+            sections.append(render_section(key, graded[key], locale, NAMES_BY_CANON))
+            failed += 1
+    t_sections = time.perf_counter() - t0
+    try:
+        final_md = llm_final_summary(sections, locale, usage)
     except Exception as e:
-        return SummaryResponse(summary_md=f"Summary generation error: {e}", model="gpt-4o-mini")
\ No newline at end of file
+        print(f"Summary: LLM final summary failed ({e}), using the local one")
+        final_md = local_final_summary([x for g in graded.values() for x in g], locale, NAMES_BY_CANON)
+        failed += 1
+    print(f"Summary: {len(sections)} sections in {t_sections:.2f}s, total {time.perf_counter() - t0:.2f}s")
+    model = SUMMARY_MODEL if failed == 0 else f"local+{SUMMARY_MODEL}"
+    return assemble(sections, final_md, locale), model
+
+def llm_final_summary(sections: List[str], locale: str, usage: Optional[RequestUsage] = None) -> str:
+    user_prompt = "\n\n".join(sections) + f"\n\nResponse language: {locale}.\n"
+    return summary_completion("final", FINAL_SUMMARY_SYSTEM, user_prompt, usage)
+
+def llm_full_summary(report: ParseResponse, locale: str, usage: Optional[RequestUsage] = None) -> str:
+    """
+    Whole report written by the model from SUMMARY_SYSTEM (mode=llm). Stable content
+    first (system prompt, then the byte-identical DB block), volatile content last,
+    so the long prefix is reusable by the provider's automatic prompt caching.
+    """
+    report_json = dumps(report).decode("utf-8")
+    user_prompt = (
+        SUMMARY_DB_BLOCK +
+        "2) Final extracted report (JSON):\n"
+        f"{report_json}\n\n"
+        f"Response language: {locale}.\n"
+        "GENERATE REPORT ACCORDING TO THE SYSTEM INSTRUCTIONS ABOVE AND USING CHOSEN LANGUAGE ONLY.\n"
+    )
+    return summary_completion("full", SUMMARY_SYSTEM, user_prompt, usage)
+
+@app.post("/api/summary", response_model=SummaryResponse)
+@profiled
+@traced("summary")
+def api_summary(req: SummaryRequest, request: Request):
+    """
+    mode=local: deterministic sections + rule-based final summary (milliseconds, no API key needed).
+    mode=hybrid (default): local sections, the model writes only the final summary.
+    mode=llm: the model writes the whole report.
+    mode=parallel: the model writes each section concurrently, then the final summary.
+    Model modes fall back to the local render when OpenAI is not configured, slow or failing.
+    """
+    locale = summary_locale(req.locale)
+    mode = (req.mode or settings.SUMMARY_MODE).strip().lower()
+    measurements = req.report.measurements
+    usage = request_usage(request)
+    annotate(mode=mode, locale=locale, measurements=len(measurements))
+
+    def respond(md: str, model: str, cache: bool = False) -> FastJSONResponse:
+        if cache:       # only complete model answers, not local fallbacks
+            shared_state.put("summary", cache_key, [md, model])
+        return FastJSONResponse(SummaryResponse(summary_md=md, model=model, usage=usage.as_dict()), headers=usage.headers())
+
+    # model-written summaries of an identical report are reused by every worker process
+    cache_key = ""
+    if mode != "local" and openai_client is not None:
+        h = hashlib.sha256(f"{mode}|{locale}|{SUMMARY_MODEL}|".encode("utf-8"))
+        h.update(dumps(req.report if mode == "llm" else measurements))
+        cache_key = h.hexdigest()
+        cached = shared_state.get("summary", cache_key)
+        if cached is not None:
+            annotate(cache="hit")
+            return respond(*cached)
+
+    if mode == "llm" and openai_client is not None:
+        try:
+            return respond(llm_full_summary(req.report, locale, usage), SUMMARY_MODEL, cache=True)
+        except Exception as e:
+            print(f"Summary: full LLM report failed ({e}), using the local render")
+            mode = "local"   # don't wait on the model a second time
+
+    graded = grade_sections(measurements)
+    if mode == "parallel" and openai_client is not None and graded:
+        md, model = parallel_summary(graded, locale, usage)
+        return respond(md, model, cache=model == SUMMARY_MODEL)
+
+    sections = [render_section(key, items, locale, NAMES_BY_CANON) for key, items in graded.items()]
+    model = "local"
+    final_md = None
+    if mode == "hybrid" and openai_client is not None and sections:
+        try:
+            final_md = llm_final_summary(sections, locale, usage)
+            model = f"local+{SUMMARY_MODEL}"
+        except Exception as e:
+            print(f"Summary: LLM final summary failed ({e}), using the local one")
+    if final_md is None:
+        final_md = local_final_summary([x for g in graded.values() for x in g], locale, NAMES_BY_CANON)
+    return respond(assemble(sections, final_md, locale), model, cache=model != "local")
+
+@app.get("/api/summary/usage")
+def summary_usage_stats():
+    """Token totals per summary call kind (full | section | final), incl. prompt-cache hit rate."""
+    return summary_usage.snapshot()
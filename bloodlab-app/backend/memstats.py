@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, List, Optional
+
+# Memory accounting per request and pipeline stage (upload, render, prefilter,
+# preprocess, ocr, response). Each stage records the bytes its output holds
+# (uploads, page images, image + base64 payload), how RSS moved while it ran
+# (peak from a background sampler) and, with tracemalloc on, the Python
+# allocations it made. RSS and the tracemalloc peak are per process: with several
+# requests in flight a request's deltas include the others' memory, so they are
+# exact for a lone request and an upper bound otherwise. held_bytes is exact.
+
+_PAGE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def rss_bytes() -> int:
+    """Current resident set size (0 where /proc is missing)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def peak_rss_bytes() -> int:
+    """Highest RSS of the process so far (VmHWM)."""
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024     # KiB on Linux
+    except (ImportError, OSError):
+        return 0
+
+def page_bytes(pages: List[Any]) -> int:
+    """Image bytes held by a [(filename, page, bytes)] list."""
+    return sum(len(p[-1]) for p in pages)
+
+def payload_bytes(image_bytes: bytes) -> int:
+    """A page while its model call is built: the image plus its base64 copy."""
+    return len(image_bytes) + 4 * ((len(image_bytes) + 2) // 3)
+
+class RssSampler:
+    """One thread sampling RSS for every tracked request; runs only while there are any."""
+    def __init__(self, interval_s: float = 0.02):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._active: "weakref.WeakSet[RequestMemory]" = weakref.WeakSet()   # a failed request drops out on its own
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, mem: "RequestMemory"):
+        if self.interval_s <= 0:
+            return
+        with self._lock:
+            self._active.add(mem)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, mem: "RequestMemory"):
+        with self._lock:
+            self._active.discard(mem)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._thread = None
+                    return
+            rss = rss_bytes()
+            for mem in active:
+                mem.observe(rss)
+            del active
+            time.sleep(self.interval_s)
+
+class RequestMemory:
+    def __init__(self, sampler: Optional[RssSampler] = None, stats: Optional["MemoryStats"] = None):
+        self.start_rss = rss_bytes()
+        self.peak_rss = self.start_rss
+        self.stages: Dict[str, Dict[str, int]] = {}
+        self._open: List[List[int]] = []        # [peak rss] of each running stage
+        self._lock = threading.Lock()
+        self._sampler = sampler
+        self._stats = stats
+        if sampler is not None:
+            sampler.add(self)
+
+    def observe(self, rss: int):
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for peak in self._open:
+                peak[0] = max(peak[0], rss)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Yields the stage record; the caller sets record["held_bytes"]. Repeated stages (ocr) keep maxima."""
+        rec = {"held_bytes": 0}
+        before = rss_bytes()
+        peak = [before]
+        with self._lock:
+            self._open.append(peak)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            traced0 = tracemalloc.get_traced_memory()[0]
+        try:
+            yield rec
+        finally:
+            after = rss_bytes()
+            if tracing:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                rec["traced_delta"] = traced - traced0
+                rec["traced_peak_delta"] = traced_peak - traced0
+            with self._lock:
+                self._open.remove(peak)
+                top = max(peak[0], after)
+                self.peak_rss = max(self.peak_rss, top)
+                rec["rss_delta"] = after - before
+                rec["rss_peak_delta"] = top - before
+                prev = self.stages.get(name)
+                if prev is None:
+                    self.stages[name] = {**rec, "calls": 1}
+                else:
+                    for k, v in rec.items():
+                        prev[k] = max(prev.get(k, v), v)
+                    prev["calls"] += 1
+
+    def finish(self) -> Dict[str, Any]:
+        """Stops sampling; returns the request's summary (also added to the process stats)."""
+        if self._sampler is not None:
+            self._sampler.remove(self)
+        with self._lock:
+            summary = {
+                "start_rss": self.start_rss,
+                "peak_rss": self.peak_rss,
+                "peak_rss_delta": self.peak_rss - self.start_rss,
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+            }
+        if self._stats is not None:
+            self._stats.record(summary)
+        return summary
+
+def stage(mem: Optional[RequestMemory], name: str):
+    """mem.stage(name), or a throwaway record for callers that do not track memory."""
+    return mem.stage(name) if mem is not None else nullcontext({})
+
+class MemoryStats:
+    """Per-stage and per-request maxima/averages since start, plus the process's RSS."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._peak_sum = 0
+        self._peak_max = 0
+        self._stages: Dict[str, List[int]] = {}     # name -> [requests, held sum, held max, rss peak delta max]
+
+    def record(self, summary: Dict[str, Any]):
+        with self._lock:
+            self._requests += 1
+            self._peak_sum += summary["peak_rss_delta"]
+            self._peak_max = max(self._peak_max, summary["peak_rss_delta"])
+            for name, rec in summary["stages"].items():
+                s = self._stages.setdefault(name, [0, 0, 0, 0])
+                s[0] += 1
+                s[1] += rec["held_bytes"]
+                s[2] = max(s[2], rec["held_bytes"])
+                s[3] = max(s[3], rec["rss_peak_delta"])
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self._requests
+            out: Dict[str, Any] = {
+                "rss": rss_bytes(),
+                "peak_rss": peak_rss_bytes(),
+                "requests": n,
+                "request_peak_rss_delta": {"avg": self._peak_sum // n if n else 0, "max": self._peak_max},
+                "stages": {
+                    name: {"avg_held_bytes": held // k, "max_held_bytes": held_max, "max_rss_peak_delta": peak}
+                    for name, (k, held, held_max, peak) in self._stages.items()
+                },
+            }
+        if tracemalloc.is_tracing():
+            cur, peak = tracemalloc.get_traced_memory()
+            out["tracemalloc"] = {"current": cur, "peak": peak}
+        return out
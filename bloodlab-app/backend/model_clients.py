@@ -0,0 +1,33 @@
+import threading
+from typing import Dict, Optional
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+
+# Long-lived model clients, built once per process. GenerativeModel objects are
+# cached per model name and share the library's default generative client, so
+# calls reuse its warm connections instead of opening (and TLS-handshaking) new
+# ones. The libraries' own connection pools are left as they are: sizing them to
+# our concurrency measured no better (bench/bench_model_clients.py).
+
+def configure_genai(api_key: str, transport: Optional[str] = None, endpoint: Optional[str] = None):
+    """genai.configure + eager creation of the shared generative client."""
+    genai.configure(
+        api_key=api_key,
+        transport=transport or None,
+        client_options={"api_endpoint": endpoint} if endpoint else None,
+    )
+    return genai_client.get_default_generative_client()
+
+class ModelRegistry:
+    """One GenerativeModel per model name; safe to share across threads (no per-call state)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, genai.GenerativeModel] = {}
+
+    def get(self, name: str) -> genai.GenerativeModel:
+        with self._lock:
+            m = self._models.get(name)
+            if m is None:
+                m = self._models[name] = genai.GenerativeModel(name)
+            return m
@@ -0,0 +1,178 @@
+import io
+from typing import List, Dict, Any, Tuple, Optional
+
+from PIL import Image, ImageChops, ImageOps
+
+# Cheap local checks that run between expand_files_to_pages and OCR,
+# so that blank backsides and re-photographed pages never reach the model.
+
+# ---------- config ----------
+ANALYSIS_SIZE = 512        # longest side of the downscaled copy used for hashing / table checks
+BLANK_SIZE = 1600          # longest side of the copy used for the blank check (thin text survives)
+INK_DELTA = 60             # how much darker than the paper a pixel must be to count as ink
+BLANK_INK = 0.00005        # ink share below which a page is blank (one short result row is ~0.0002)
+FINE_SIZE = (192, 256)     # signature used to confirm dHash duplicate candidates
+FINE_TILES = (12, 16)      # duplicates must match in every tile, not just on average
+DUP_TILE_DIFF = 0.01       # max share of changed pixels in any tile
+
+# ---------- image helpers ----------
+def _load_gray(image_bytes: bytes, size: int = ANALYSIS_SIZE) -> Image.Image:
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("L", (size, size))  # JPEG: decode at reduced scale
+    img = img.convert("L")
+    img.thumbnail((size, size))
+    return img
+
+def is_blank(gray: Image.Image, blank_ink: float = BLANK_INK) -> bool:
+    """
+    Blank when (almost) no pixel binarises as ink. The fixed INK_DELTA below the
+    paper ignores sensor noise, JPEG ringing, uneven lighting and show-through,
+    which never get that dark; a single result line covers well under 0.1% of an
+    A4 page, so gray must be a BLANK_SIZE copy to keep thin text.
+    """
+    return ink_density(gray) < blank_ink
+
+def _median_from_hist(hist: List[int]) -> int:
+    half = sum(hist) / 2
+    acc = 0
+    for level, count in enumerate(hist):
+        acc += count
+        if acc >= half:
+            return level
+    return 255
+
+def ink_density(gray: Image.Image) -> float:
+    """Share of pixels noticeably darker than the paper (median brightness)."""
+    hist = gray.histogram()
+    total = sum(hist) or 1
+    paper = _median_from_hist(hist)
+    thr = max(0, paper - INK_DELTA)
+    return sum(hist[:thr]) / total
+
+def dhash(gray: Image.Image, size: int = 16) -> int:
+    """
+    Difference hash (size*size bits); robust to rescaling and mild exposure changes.
+    16x16 rather than the usual 8x8: pages of the same lab template share a layout,
+    so the coarse hash would merge them.
+    """
+    small = gray.resize((size + 1, size), Image.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (1 if px[base + col] > px[base + col + 1] else 0)
+    return bits
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def fine_signature(gray: Image.Image) -> Image.Image:
+    return ImageOps.autocontrast(gray).resize(FINE_SIZE, Image.BOX)
+
+def max_tile_diff(a: Image.Image, b: Image.Image) -> float:
+    """
+    Largest share of changed pixels over a grid of tiles. Two pages of one lab
+    template differ only in a few value cells, which vanishes in a global average
+    (and in the dHash) but stands out in the tile where it happens.
+    """
+    changed = ImageChops.difference(a, b).point(lambda p: 255 if p > 48 else 0)
+    return max(changed.resize(FINE_TILES, Image.BOX).getdata()) / 255
+
+def looks_like_table(gray: Image.Image, min_lines: int = 6) -> bool:
+    """
+    Rough "is there a results table" heuristic: enough text lines and at least
+    one vertical gutter inside the text block (name | value | unit | reference).
+    """
+    w, h = gray.size
+    paper = _median_from_hist(gray.histogram())
+    thr = max(0, paper - INK_DELTA)
+    mask = gray.point(lambda p: 255 if p < thr else 0)
+
+    # BOX-resizing to a single column/row gives the mean ink per row/column
+    rows = list(mask.resize((1, h), Image.BOX).getdata())
+    lines, in_line = 0, False
+    for r in rows:
+        if r > 2.55 and not in_line:
+            lines, in_line = lines + 1, True
+        elif r <= 2.55:
+            in_line = False
+    if lines < min_lines:
+        return False
+
+    cols = list(mask.resize((w, 1), Image.BOX).getdata())
+    inked = [x for x, c in enumerate(cols) if c > 0]
+    if not inked:
+        return False
+    left, right = inked[0], inked[-1]
+    gutter_min = max(3, (right - left) // 50)
+    run = 0
+    for x in range(left, right + 1):
+        if cols[x] == 0:
+            run += 1
+            if run >= gutter_min:
+                return True
+        else:
+            run = 0
+    return False
+
+# ---------- main entry ----------
+def filter_pages(
+    pages: List[Tuple[str, int, bytes]],
+    blank_ink: float = BLANK_INK,
+    dup_distance: int = 8,
+    table_check: bool = False,
+) -> Tuple[List[Tuple[str, int, bytes]], List[Dict[str, Any]]]:
+    """
+    Split pages into (kept, skipped). Skipped entries look like
+    {"filename", "page", "reason": "blank|duplicate|no_table", "duplicate_of"?}.
+    Pages that fail to decode are kept: the model gets the final word on them.
+    """
+    kept: List[Tuple[str, int, bytes]] = []
+    skipped: List[Dict[str, Any]] = []
+    seen: List[Tuple[int, Image.Image, str, int]] = []  # (hash, signature, filename, page)
+
+    for filename, page_num, image_bytes in pages:
+        try:
+            full = _load_gray(image_bytes, BLANK_SIZE)
+        except Exception as e:
+            print(f"Prefilter decode error {filename}, page {page_num}: {e}")
+            kept.append((filename, page_num, image_bytes))
+            continue
+
+        if is_blank(full, blank_ink):
+            skipped.append({"filename": filename, "page": page_num, "reason": "blank"})
+            continue
+        gray = full.copy()
+        gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+
+        h = dhash(gray)
+        sig = fine_signature(gray)
+        dup: Optional[Tuple[int, Image.Image, str, int]] = next(
+            (s for s in seen if hamming(s[0], h) <= dup_distance and max_tile_diff(s[1], sig) <= DUP_TILE_DIFF),
+            None,
+        )
+        if dup is not None:
+            skipped.append({
+                "filename": filename, "page": page_num, "reason": "duplicate",
+                "duplicate_of": {"filename": dup[2], "page": dup[3]},
+            })
+            continue
+
+        if table_check and not looks_like_table(gray):
+            skipped.append({"filename": filename, "page": page_num, "reason": "no_table"})
+            continue
+
+        seen.append((h, sig, filename, page_num))
+        kept.append((filename, page_num, image_bytes))
+
+    return kept, skipped
+
+def skipped_note(skipped: List[Dict[str, Any]]) -> str:
+    if not skipped:
+        return ""
+    parts = [
+        f"{s['filename']} p{s['page']} ({s['reason']})" if s.get("page") else f"{s['filename']} ({s['reason']})"
+        for s in skipped
+    ]
+    return f"; skipped {len(skipped)} pages: " + ", ".join(parts)
@@ -0,0 +1,253 @@
+import io
+import threading
+import time
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Page preprocessing before OCR: crop phone photos to the sheet, deskew, trim
+# empty margins, optionally flatten uneven lighting, cap the resolution. The
+# model then sees (and we upload) only the part of the page that carries text.
+# Every step is decided on a downscaled grayscale copy and applied once to the
+# full-resolution image.
+
+# ---------- config ----------
+ANALYSIS_SIZE = 1024       # longest side of the copy used for decisions
+INK_DELTA = 60             # darker than the local paper level by this much = ink
+MIN_SHEET_AREA = 0.3       # a detected sheet smaller than this share of the photo is not trusted
+MAX_SKEW = 6.0             # degrees searched when deskewing
+MIN_SKEW = 0.3             # smaller angles are left alone (resampling blurs text)
+SKEW_GAIN = 1.03           # profile peakiness a rotation must add over the unrotated page
+MARGIN_PAD = 0.015         # padding kept around the text block, share of the page side
+ROW_INK = 0.002            # share of ink pixels for a row/column to count as text
+EDGE_BAND = 0.02           # border band ignored when looking for text (sheet edges, shadows)
+JPEG_QUALITY = 90          # photos are re-encoded as JPEG, clean renders stay PNG
+
+# ---------- analysis helpers ----------
+def _gray_small(img: Image.Image) -> Tuple[Image.Image, float]:
+    gray = img.convert("L")
+    scale = min(1.0, ANALYSIS_SIZE / max(gray.size))
+    if scale < 1.0:
+        gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.BOX)
+    return gray, scale
+
+def _otsu(a: np.ndarray) -> float:
+    hist = np.bincount(a.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    w = np.cumsum(hist)
+    mu = np.cumsum(hist * np.arange(256))
+    total, mu_t = w[-1], mu[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu_t * w - mu * total) ** 2 / (w * (total - w))
+    if np.isnan(between).all():          # a single gray level
+        return float(a.ravel()[0])
+    return float(np.nanargmax(between))
+
+def _paper_mask(gray: Image.Image) -> np.ndarray:
+    """
+    Paper area, from an 8x reduced copy where text averages out to light gray and
+    only the desk/background stays dark. Eroded so the sheet edge is not taken for ink.
+    """
+    small = gray.reduce(8) if min(gray.size) >= 64 else gray
+    a = np.asarray(small, dtype=np.float32)
+    bright = a > _otsu(a)
+    if not bright.any() or bright.mean() > 0.97 or float(a[bright].mean() - a[~bright].mean()) < INK_DELTA:
+        return np.ones((gray.height, gray.width), dtype=bool)
+    mask = Image.fromarray((bright * 255).astype(np.uint8)).filter(ImageFilter.MinFilter(3))
+    return np.asarray(mask.resize(gray.size, Image.NEAREST)) > 0
+
+def _ink_mask(gray: Image.Image) -> np.ndarray:
+    """Ink on the paper, judged against a local paper estimate so shadows do not read as text."""
+    a = np.asarray(gray, dtype=np.float32)
+    bg = np.asarray(gray.reduce(max(1, min(gray.size) // 32)).resize(gray.size, Image.BILINEAR), dtype=np.float32)
+    return (a < bg - INK_DELTA / 2) & _paper_mask(gray)
+
+def _span(profile: np.ndarray, thr: float) -> Tuple[int, int]:
+    idx = np.flatnonzero(profile > thr)
+    if not idx.size:
+        return 0, len(profile)
+    return int(idx[0]), int(idx[-1]) + 1
+
+def sheet_box(gray: Image.Image) -> Tuple[int, int, int, int]:
+    """
+    Bounding box of the paper sheet in a photo: rows/columns that are mostly
+    brighter than the Otsu split of the image. A page filling the whole frame
+    (PDF renders, scans) gives the full image.
+    """
+    bright = _paper_mask(gray)
+    if bright.all():
+        return 0, 0, gray.width, gray.height
+    x0, x1 = _span(bright.mean(axis=0), 0.5)
+    y0, y1 = _span(bright.mean(axis=1), 0.5)
+    if (x1 - x0) * (y1 - y0) < MIN_SHEET_AREA * gray.width * gray.height:
+        return 0, 0, gray.width, gray.height
+    return x0, y0, x1, y1
+
+def _profile_score(ys: np.ndarray, xs: np.ndarray, angle: float) -> float:
+    # small-angle rotation as a shear: each ink pixel lands in row y - x*tan(angle)
+    rows = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+    counts = np.bincount(rows - rows.min())
+    return float(np.var(counts)) * len(counts)
+
+def skew_angle(ink: np.ndarray) -> float:
+    """
+    Rotation (degrees, PIL convention) that makes text lines horizontal: the angle
+    whose horizontal ink profile is the most peaked. Coarse 1 degree search, then 0.1.
+    """
+    if ink.mean() < 0.002:
+        return 0.0
+    ys, xs = np.nonzero(ink)
+    ys, xs = ys.astype(np.float64), xs.astype(np.float64)
+    score = lambda d: _profile_score(ys, xs, d)
+    best = max(np.arange(-MAX_SKEW, MAX_SKEW + 0.01, 1.0), key=score)
+    best = max(np.arange(best - 0.9, best + 0.91, 0.1), key=score)
+    # short lines give a flat optimum; only rotate for a clear gain over "as is"
+    if score(best) < SKEW_GAIN * score(0.0):
+        return 0.0
+    return round(float(best), 2)
+
+def text_box(ink: np.ndarray) -> Tuple[int, int, int, int]:
+    h, w = ink.shape
+    band = round(EDGE_BAND * min(w, h))
+    if band:
+        ink = ink.copy()
+        ink[:band, :] = ink[-band:, :] = False
+        ink[:, :band] = ink[:, -band:] = False
+    x0, x1 = _span(ink.mean(axis=0), ROW_INK)
+    y0, y1 = _span(ink.mean(axis=1), ROW_INK)
+    pad = round(MARGIN_PAD * max(w, h))
+    return max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)
+
+def flatten_lighting(gray: Image.Image) -> Image.Image:
+    """Divide by the local paper level (shadows, vignetting), then stretch contrast."""
+    a = np.asarray(gray, dtype=np.float32)
+    bg = np.asarray(gray.reduce(max(1, min(gray.size) // 24)).resize(gray.size, Image.BILINEAR), dtype=np.float32)
+    flat = np.clip(a / np.maximum(bg, 1.0) * 255.0, 0, 255).astype(np.uint8)
+    return ImageOps.autocontrast(Image.fromarray(flat), cutoff=(1, 0))
+
+def _has_color(img: Image.Image) -> bool:
+    """Colored marks (red flags, highlighted rows) are kept; plain black-on-white pages go out as grayscale."""
+    small = np.asarray(img.resize((min(img.width, 256), min(img.height, 256)), Image.BOX), dtype=np.int16)
+    chroma = small.max(axis=2) - small.min(axis=2)
+    return float((chroma > 40).mean()) > 0.001
+
+def _looks_digital(gray: Image.Image) -> bool:
+    a = np.asarray(gray, dtype=np.int16)
+    paper = int(np.median(a))
+    return paper >= 245 and float((np.abs(a - paper) <= 2).mean()) >= 0.8
+
+def _scale_box(box: Tuple[int, int, int, int], scale: float, size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    x0, y0, x1, y1 = box
+    return (max(0, int(x0 / scale)), max(0, int(y0 / scale)),
+            min(size[0], int(round(x1 / scale))), min(size[1], int(round(y1 / scale))))
+
+# ---------- main entry ----------
+def preprocess_page(image_bytes: bytes, max_side: int = 2048, deskew: bool = True,
+                    flatten: bool = False) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    (new image bytes, info). info: {"sheet", "skew", "trim", "flatten", "format",
+    "pixels_in", "pixels_out", "bytes_in", "bytes_out", "cpu_seconds"}.
+    The original bytes come back unchanged when the result would not be smaller.
+    """
+    t0 = time.thread_time()
+    img = Image.open(io.BytesIO(image_bytes))
+    info: Dict[str, Any] = {"pixels_in": img.width * img.height, "bytes_in": len(image_bytes)}
+    img.draft("RGB", (max_side, max_side))      # JPEG: decode at reduced scale when it is far above max_side
+    if img.getexif().get(0x0112, 1) != 1:       # phone photos: honour the EXIF orientation
+        img = ImageOps.exif_transpose(img)
+    img = img.convert("RGB")
+
+    gray, scale = _gray_small(img)
+    box = sheet_box(gray)
+    info["sheet"] = box != (0, 0, gray.width, gray.height)
+    if info["sheet"]:
+        img = img.crop(_scale_box(box, scale, img.size))
+    # resample once at the target size: rotating a 12 Mpx photo costs more than all the analysis
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    gray, scale = _gray_small(img)
+
+    angle = skew_angle(_ink_mask(gray)) if deskew else 0.0
+    info["skew"] = angle if abs(angle) >= MIN_SKEW else 0.0
+    if info["skew"]:
+        paper = tuple(int(c) for c in np.median(np.asarray(img.resize((64, 64), Image.BOX)).reshape(-1, 3), axis=0))
+        img = img.rotate(info["skew"], resample=Image.BILINEAR, expand=True, fillcolor=paper)
+        gray, scale = _gray_small(img)
+        if info["sheet"]:
+            # the sheet is axis-aligned now: cut off the desk wedges the first crop kept
+            box = sheet_box(gray)
+            if box != (0, 0, gray.width, gray.height):
+                img = img.crop(_scale_box(box, scale, img.size))
+                gray, scale = _gray_small(img)
+
+    box = text_box(_ink_mask(gray))
+    info["trim"] = box != (0, 0, gray.width, gray.height)
+    if info["trim"]:
+        img = img.crop(_scale_box(box, scale, img.size))
+
+    info["flatten"] = flatten
+    if flatten:
+        out_img = flatten_lighting(img.convert("L"))
+    else:
+        out_img = img if _has_color(img) else img.convert("L")
+    digital = _looks_digital(_gray_small(out_img)[0])
+    buf = io.BytesIO()
+    if digital:
+        out_img.save(buf, format="PNG", optimize=False)
+    else:
+        out_img.save(buf, format="JPEG", quality=JPEG_QUALITY)
+    out = buf.getvalue()
+    info["format"] = "png" if digital else "jpeg"
+    if len(out) >= len(image_bytes):
+        out, info["format"] = image_bytes, "original"
+        info["pixels_out"] = info["pixels_in"]
+    else:
+        info["pixels_out"] = out_img.width * out_img.height
+    info["bytes_out"] = len(out)
+    info["cpu_seconds"] = round(time.thread_time() - t0, 4)
+    return out, info
+
+def preprocess_pages(pages: List[Tuple[str, int, bytes]], **kwargs) -> Tuple[List[Tuple[str, int, bytes]], List[Dict[str, Any]]]:
+    """Run preprocess_page over (filename, page, bytes) pages; pages that fail to decode pass through."""
+    out: List[Tuple[str, int, bytes]] = []
+    infos: List[Dict[str, Any]] = []
+    for filename, page_num, image_bytes in pages:
+        try:
+            new_bytes, info = preprocess_page(image_bytes, **kwargs)
+        except Exception as e:
+            print(f"Preprocess error {filename}, page {page_num}: {e}")
+            new_bytes, info = image_bytes, {"bytes_in": len(image_bytes), "bytes_out": len(image_bytes), "format": "original"}
+        out.append((filename, page_num, new_bytes))
+        infos.append(dict(info, filename=filename, page=page_num))
+    return out, infos
+
+class PreprocessStats:
+    """Running totals: pages, bytes and pixels before/after, CPU seconds spent."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t = {"pages": 0, "bytes_in": 0, "bytes_out": 0, "pixels_in": 0, "pixels_out": 0, "cpu_seconds": 0.0}
+
+    def record(self, infos: List[Dict[str, Any]]):
+        with self._lock:
+            for i in infos:
+                self._t["pages"] += 1
+                for k in ("bytes_in", "bytes_out", "pixels_in", "pixels_out", "cpu_seconds"):
+                    self._t[k] += i.get(k, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            t = dict(self._t)
+        n = t["pages"]
+        t["cpu_seconds"] = round(t["cpu_seconds"], 3)
+        t["avg_cpu_ms"] = round(t["cpu_seconds"] / n * 1000, 1) if n else 0.0
+        t["bytes_saved_share"] = round(1 - t["bytes_out"] / t["bytes_in"], 4) if t["bytes_in"] else 0.0
+        t["pixels_saved_share"] = round(1 - t["pixels_out"] / t["pixels_in"], 4) if t["pixels_in"] else 0.0
+        return t
+
+def summarize(infos: List[Dict[str, Any]]) -> str:
+    if not infos:
+        return ""
+    b_in = sum(i.get("bytes_in", 0) for i in infos)
+    b_out = sum(i.get("bytes_out", 0) for i in infos)
+    cpu = sum(i.get("cpu_seconds", 0) for i in infos)
+    return f"Preprocessed {len(infos)} pages: {b_in / 1e6:.2f} MB -> {b_out / 1e6:.2f} MB in {cpu * 1000:.0f} ms CPU"
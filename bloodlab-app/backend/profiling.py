@@ -0,0 +1,238 @@
+import contextvars
+import functools
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import List, Dict, Any, Optional
+
+# Opt-in CPU profiling of single requests. A profiled request (admin header, or
+# a random PROFILE_SAMPLE_RATE share of pipeline requests) gets a sampler thread
+# that looks at the stacks of the threads currently working for that request:
+# the event loop while it runs the request's synchronous steps, and the worker
+# threads OCR-ing its pages. Each sample is weighted by the CPU time the thread
+# used since the previous one, so threads waiting on the model count for nothing.
+# Result: a folded-stacks file ("a;b;c <cpu µs>" per line), readable by
+# flamegraph.pl, speedscope or inferno. Pipeline functions are marked with
+# @profiled; without an active profile that costs a context-variable lookup.
+
+_current: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("profile", default=None)
+
+_cpu_clock = getattr(time, "pthread_getcpuclockid", None)    # Unix; elsewhere samples count wall time
+
+class _ThreadSpan:
+    def __init__(self, prof: "RequestProfile"):
+        self.prof = prof
+
+    def __enter__(self):
+        self.prof._enter(threading.get_ident())
+
+    def __exit__(self, *exc):
+        self.prof._exit(threading.get_ident())
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, reason: str, interval_s: float = 0.005):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.reason = reason                    # header | sampled
+        self.interval_s = interval_s
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.cpu_s = 0.0
+        self._lock = threading.Lock()
+        self._threads: Dict[int, List[float]] = {}    # ident -> [depth, cpu at entry, cpu at last sample]
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profile-{self.id}", daemon=True)
+        self._sampler.start()
+
+    # ----- attaching threads -----
+    def _enter(self, ident: int):
+        now = time.thread_time()
+        with self._lock:
+            t = self._threads.get(ident)
+            if t:
+                t[0] += 1
+            else:
+                self._threads[ident] = [1, now, now]
+
+    def _exit(self, ident: int):
+        now = time.thread_time()
+        with self._lock:
+            t = self._threads[ident]
+            t[0] -= 1
+            if t[0] == 0:
+                self.cpu_s += now - t[1]
+                del self._threads[ident]
+
+    # ----- sampling -----
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                idents = [i for i in self._threads if i != own]
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                weight = self._weight(ident)
+                if weight <= 0:
+                    continue        # blocked (socket, lock, sleep) since the last sample
+                self.stacks[fold(frame)] += weight
+                self.samples += 1
+
+    def _weight(self, ident: int) -> int:
+        """CPU µs the thread used since its previous sample (interval µs if per-thread clocks are missing)."""
+        if _cpu_clock is None:
+            return int(self.interval_s * 1e6)
+        try:
+            cpu = time.clock_gettime(_cpu_clock(ident))
+        except (OSError, OverflowError):        # thread just exited
+            return 0
+        with self._lock:
+            t = self._threads.get(ident)
+            if t is None:
+                return 0
+            used, t[2] = cpu - t[2], cpu
+        return int(used * 1e6)
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def meta(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "method": self.method, "path": self.path, "reason": self.reason,
+            "started": self.started, "wall_s": round(time.perf_counter() - self._t0, 3),
+            "cpu_s": round(self.cpu_s, 3), "samples": self.samples,
+            "interval_ms": self.interval_s * 1000, "weight": "cpu_us" if _cpu_clock else "wall_us",
+        }
+
+def fold(frame) -> str:
+    """Stack root-first as 'file:function;...' (flamegraph folded format)."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def profiled(fn):
+    """Decorator: fn's work counts towards the active request profile (a no-op when none is active)."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prof = _current.get()
+        if prof is None:
+            return fn(*args, **kwargs)
+        with _ThreadSpan(prof):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# ---------- storage ----------
+class ProfileStore:
+    """<id>.folded + <id>.json per profiled request; only the newest `keep` are kept."""
+    def __init__(self, path: str, keep: int = 50):
+        self.path = path
+        self.keep = keep
+
+    def save(self, prof: RequestProfile) -> Dict[str, Any]:
+        os.makedirs(self.path, exist_ok=True)
+        meta = prof.meta()
+        with open(os.path.join(self.path, f"{prof.id}.folded"), "w", encoding="utf-8") as f:
+            for stack, weight in prof.stacks.most_common():
+                f.write(f"{stack} {weight}\n")
+        with open(os.path.join(self.path, f"{prof.id}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        self._prune()
+        return meta
+
+    def _prune(self):
+        metas = self.list()
+        for m in metas[self.keep:]:
+            for ext in ("folded", "json"):
+                try:
+                    os.remove(os.path.join(self.path, f"{m['id']}.{ext}"))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Newest first."""
+        if not os.path.isdir(self.path):
+            return []
+        out = []
+        for name in os.listdir(self.path):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.path, name), encoding="utf-8") as f:
+                        out.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(out, key=lambda m: m["started"], reverse=True)
+
+    def folded_path(self, profile_id: str) -> Optional[str]:
+        if not profile_id.isalnum():
+            return None
+        p = os.path.join(self.path, f"{profile_id}.folded")
+        return p if os.path.exists(p) else None
+
+def admin_ok(token: Optional[str], admin_token: Optional[str]) -> bool:
+    return bool(admin_token) and bool(token) and hmac.compare_digest(token, admin_token)
+
+# ---------- ASGI middleware ----------
+class ProfileMiddleware:
+    """
+    Profiles requests sent with X-Profile: 1 and a valid X-Admin-Token, and a
+    sample_rate share of POST /api/... requests. The whole request is covered,
+    streamed bodies included; the profile id is returned in X-Profile-Id.
+    Only installed when profiling is configured at all.
+    """
+    def __init__(self, app, store: ProfileStore, admin_token: Optional[str] = None,
+                 sample_rate: float = 0.0, interval_s: float = 0.005):
+        self.app = app
+        self.store = store
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval_s = interval_s
+
+    def _reason(self, scope) -> Optional[str]:
+        path = scope.get("path", "")
+        if not path.startswith("/api/") or path.startswith("/api/admin/"):
+            return None
+        headers = dict(scope.get("headers") or [])
+        if headers.get(b"x-profile") == b"1" and admin_ok(headers.get(b"x-admin-token", b"").decode("latin-1"), self.admin_token):
+            return "header"
+        if self.sample_rate > 0 and scope.get("method") == "POST" and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        reason = self._reason(scope) if scope["type"] == "http" else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        prof = RequestProfile(scope.get("method", ""), scope.get("path", ""), reason, self.interval_s)
+        token = _current.set(prof)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", prof.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(token)
+            prof.stop()
+            meta = self.store.save(prof)
+            print(f"Profile {prof.id} ({reason}) {prof.method} {prof.path}: "
+                  f"{meta['cpu_s']:.3f}s CPU in {meta['wall_s']:.3f}s, {prof.samples} samples")
@@ -0,0 +1,52 @@
+from typing import Dict, Any, Optional
+
+# Internal measurement record for the pipeline hot path (process_single_page ->
+# enrich_with_db -> dedup). Same attribute names as the API `Measurement`, so the
+# enrichment/dedup helpers work on either, but no validation and no per-instance
+# __dict__. Rows become Pydantic models only at the API boundary.
+
+FIELDS = (
+    "name", "value", "unit", "reference_text", "ref_low", "ref_high",
+    "flag", "source_file", "page", "group", "norm_value", "norm_unit",
+)
+
+class Row:
+    __slots__ = FIELDS
+
+    def __init__(
+        self,
+        name: str,
+        value: str,
+        unit: Optional[str] = None,
+        reference_text: Optional[str] = None,
+        ref_low: Optional[float] = None,
+        ref_high: Optional[float] = None,
+        flag: Optional[str] = None,
+        source_file: Optional[str] = None,
+        page: Optional[int] = None,
+        group: Optional[str] = None,
+        norm_value: Optional[float] = None,
+        norm_unit: Optional[str] = None,
+    ):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.reference_text = reference_text
+        self.ref_low = ref_low
+        self.ref_high = ref_high
+        self.flag = flag
+        self.source_file = source_file
+        self.page = page
+        self.group = group
+        self.norm_value = norm_value
+        self.norm_unit = norm_unit
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in FIELDS}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Row":
+        return cls(**{k: d.get(k) for k in FIELDS})
+
+    def __repr__(self) -> str:
+        return f"Row({self.name!r}, {self.value!r}, unit={self.unit!r}, flag={self.flag!r})"
@@ -0,0 +1,121 @@
+import io
+import threading
+from typing import List, Dict, Any
+
+import numpy as np
+from PIL import Image
+
+# Page difficulty scoring for OCR model routing. Clean digital renders go to the
+# fast model, phone photos / blurry / tiny-print pages to the strong one. Scoring
+# works on a downscaled grayscale copy; the cost is mostly decoding the page image.
+
+ANALYSIS_SIZE = 1024       # longest side of the copy used for scoring
+INK_DELTA = 60             # darker than paper by this much = ink
+MIN_LINE_PX = 14           # native text-line height below which print counts as small
+MIN_CONTRAST = 0.35        # (paper - darkest 1% of ink) / 255
+MIN_SHARPNESS = 0.05       # Laplacian energy on ink edges per unit of contrast^2; below = blurry
+DIGITAL_PAPER = 245        # rendered PDFs have (near) pure white paper ...
+DIGITAL_CLEAN = 0.85       # ... and most background pixels exactly at the paper level
+DENSE_LINES = 45           # text lines per page considered dense
+
+def page_features(image_bytes: bytes) -> Dict[str, float]:
+    img = Image.open(io.BytesIO(image_bytes))
+    native_h = img.size[1]
+    img.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    gray = img.convert("L")
+    gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    a = np.asarray(gray, dtype=np.float32)
+
+    paper = float(np.median(a))
+    # contrast and sharpness are measured on the ink, not the whole page: on a sparse
+    # page (a few result lines) the 1st percentile of all pixels is still paper and
+    # the page-wide Laplacian mean is mostly blank paper
+    ink_mask = a < paper - INK_DELTA
+    if not ink_mask.any():
+        ink_mask = a < paper - INK_DELTA / 4        # faint print: judge it by its faint marks
+    if ink_mask.any():
+        contrast = max(0.0, paper - float(np.percentile(a[ink_mask], 1))) / 255.0
+        # ink pixels plus their 4-neighbours: a stroke's edges are where blur shows
+        edge = ink_mask.copy()
+        edge[1:] |= ink_mask[:-1]
+        edge[:-1] |= ink_mask[1:]
+        edge[:, 1:] |= ink_mask[:, :-1]
+        edge[:, :-1] |= ink_mask[:, 1:]
+        lap = 4 * a[1:-1, 1:-1] - a[:-2, 1:-1] - a[2:, 1:-1] - a[1:-1, :-2] - a[1:-1, 2:]
+        near = edge[1:-1, 1:-1]
+        sharpness = float((lap[near] ** 2).mean()) / max(1.0, (contrast * 255.0) ** 2) if near.any() else 0.0
+    else:
+        contrast, sharpness = 1.0, 1.0             # no marks at all: nothing to be unreadable
+
+    background = a[a > paper - INK_DELTA]
+    clean = float((np.abs(background - paper) <= 2).mean()) if background.size else 0.0
+
+    # text lines from the horizontal ink profile; ink is judged against the local
+    # paper level so uneven lighting in photos does not swallow whole lines
+    bg = np.asarray(gray.reduce(32).resize(gray.size, Image.BILINEAR), dtype=np.float32)
+    ink_rows = (a < bg - INK_DELTA / 2).mean(axis=1) > 0.005
+    edges = np.flatnonzero(np.diff(ink_rows.astype(np.int8)))
+    starts, ends = (edges[::2], edges[1::2]) if not ink_rows[0] else (np.r_[-1, edges[1::2]], edges[::2])
+    n = min(len(starts), len(ends))
+    heights = (ends[:n] - starts[:n]) if n else np.zeros(0)
+    heights = heights[heights > 1]
+    line_px = float(np.median(heights)) * native_h / a.shape[0] if heights.size else 0.0
+
+    return {
+        "native_height": native_h,
+        "contrast": round(contrast, 3),
+        "sharpness": round(sharpness, 3),
+        "paper": paper,
+        "clean_background": round(clean, 3),
+        "text_lines": int(heights.size),
+        "line_px": round(line_px, 1),
+    }
+
+def score_page(image_bytes: bytes, threshold: float = 0.5) -> Dict[str, Any]:
+    """
+    {"score": 0..1 (higher = harder), "tier": "fast"|"strong", "min_rows": int,
+     "reasons": [...], "features": {...}}. min_rows is the fewest measurements a
+    fast-model answer may contain before the page is escalated.
+    """
+    f = page_features(image_bytes)
+    score = 0.0
+    reasons: List[str] = []
+    if f["text_lines"] and f["line_px"] < MIN_LINE_PX:
+        score += 0.35
+        reasons.append("small_print")
+    if f["contrast"] < MIN_CONTRAST:
+        score += 0.25
+        reasons.append("low_contrast")
+    if f["sharpness"] < MIN_SHARPNESS:
+        score += 0.35
+        reasons.append("blurry")
+    if not (f["paper"] >= DIGITAL_PAPER and f["clean_background"] >= DIGITAL_CLEAN):
+        score += 0.3
+        reasons.append("photo")
+    if f["text_lines"] > DENSE_LINES:
+        score += 0.15
+        reasons.append("dense")
+    score = min(1.0, score)
+    return {
+        "score": round(score, 2),
+        "tier": "fast" if score < threshold else "strong",
+        "min_rows": max(1, min(10, f["text_lines"] // 6)),
+        "reasons": reasons,
+        "features": f,
+    }
+
+class RouteStats:
+    """Routing outcomes and OCR seconds per tier (fast | strong | escalated)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._t: Dict[str, List[float]] = {}
+
+    def record(self, tier: str, seconds: float):
+        with self._lock:
+            n_s = self._t.setdefault(tier, [0, 0.0])
+            n_s[0] += 1
+            n_s[1] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {k: {"pages": int(n), "avg_seconds": round(s / n, 3) if n else 0.0} for k, (n, s) in self._t.items()}
@@ -0,0 +1,37 @@
+from typing import Any, Dict, Union
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from records import Row
+
+# Fast JSON path for API responses and SSE frames. Our response models are flat
+# Pydantic models we built ourselves, so they are encoded straight from their
+# field dicts with orjson, skipping model_dump() and response_model re-validation.
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    if isinstance(obj, Row):
+        return obj.as_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(obj: Any) -> bytes:
+    """UTF-8 JSON bytes (non-ASCII kept as is, like ensure_ascii=False)."""
+    return orjson.dumps(obj, default=_default)
+
+def compact(m: Union[BaseModel, Row]) -> Dict[str, Any]:
+    """Field dict without None values (smaller SSE deltas)."""
+    d = m.as_dict() if isinstance(m, Row) else m.__dict__
+    return {k: v for k, v in d.items() if v is not None}
+
+class FastJSONResponse(Response):
+    """
+    Returned directly from endpoints that declare response_model (kept for the
+    OpenAPI schema): FastAPI passes Response objects through untouched.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -6,9 +6,91 @@ class Settings(BaseSettings):
     GOOGLE_API_KEY: str = Field(..., min_length=10)   # Gemma/Gemini key
     OPENAI_API_KEY: str | None = None                 # OpenAI
     GENAI_MODEL: str = "gemma-3-27b-it"               # default model for OCR
+    GENAI_TRANSPORT: str | None = None                # grpc (library default) | rest
+    GENAI_ENDPOINT: str | None = None                 # API endpoint override (proxies, local stubs)
     METRICS_DB: str | None = None                     # DB path
+    OCR_STREAMING: bool = True                        # stream page OCR in /api/process/stream (row events)
+    OCR_FAST_MODEL: str | None = None                 # cheaper model for easy pages (unset = no routing)
+    OCR_ROUTING_THRESHOLD: float = 0.5                # page difficulty score from which GENAI_MODEL is used
+    OCR_CALL_TIMEOUT: float = 120                     # seconds per page model call (0 = none)
+    OCR_FAILOVER_MODEL: str | None = None             # OpenAI vision model for OCR while Gemini is down (e.g. gpt-4o-mini)
     CORS_ORIGINS: str = "*"                           # CORS policy
 
+    # page pre-filter (before OCR)
+    PREFILTER_ENABLED: bool = True                    # drop blank / duplicate pages
+    PREFILTER_BLANK_INK: float = 0.00005              # ink share below which a page is blank
+    PREFILTER_DUP_DISTANCE: int = 8                   # max dHash distance (of 256 bits) for duplicates
+    PREFILTER_TABLE_CHECK: bool = False               # also drop pages without a table-like layout
+
+    # circuit breaker per OCR provider
+    BREAKER_WINDOW: int = 20                          # recent calls considered
+    BREAKER_MIN_CALLS: int = 5                        # calls needed before the breaker may open
+    BREAKER_FAILURE_RATE: float = 0.5                 # share of failed/slow calls that opens it
+    BREAKER_SLOW_SECONDS: float = 60                  # a successful call slower than this counts as failed
+    BREAKER_OPEN_SECONDS: float = 30                  # open -> half-open (one probe call) after this
+
+    # page preprocessing (after the pre-filter, before OCR)
+    PREPROCESS_ENABLED: bool = True                   # crop photos to the sheet, deskew, trim margins
+    PREPROCESS_MAX_SIDE: int = 2048                   # longest page side sent to the model (px)
+    PREPROCESS_DESKEW: bool = True                    # straighten pages tilted by up to 6 degrees
+    PREPROCESS_FLATTEN: bool = False                  # even out shadows / lighting (output is grayscale)
+
+    # async jobs (/api/jobs)
+    JOBS_DB: str | None = None                        # SQLite queue path (default: state/jobs.sqlite3)
+    JOB_WORKERS: int = 2                              # worker threads in the API process (0 = external workers only)
+    JOB_STALE_SECONDS: float = 300                    # running job without a heartbeat -> requeued
+    JOB_MAX_ATTEMPTS: int = 3                         # claimed this often without finishing -> failed (0 = no limit)
+    JOB_RETENTION_HOURS: float = 24                   # finished jobs are purged after this
+
+    # resumable SSE (/api/process/stream)
+    STREAM_RETENTION_SECONDS: float = 600             # finished streams stay replayable this long
+    STREAM_ABANDON_SECONDS: float = 30                # stream without any connected client this long -> OCR cancelled
+
+    # request deadlines (/api/process, /api/process/stream)
+    REQUEST_DEADLINE_SECONDS: float = 0               # max seconds per upload; clients may ask for less via X-Request-Deadline (0 = no limit)
+
+    # state shared by all worker processes (uvicorn --workers N, worker.py)
+    SHARED_STATE_DB: str | None = None                # SQLite path (default: state/shared.sqlite3); same file for every worker
+    RESULT_CACHE_HOURS: float = 0                     # OCR pages / summaries reused across requests and workers (0 = off); stores patient data, see history
+    GOOGLE_RPM: int = 0                               # Gemini calls per minute, all workers together (0 = no limit)
+    GOOGLE_MAX_CONCURRENCY: int = 0                   # Gemini calls in flight, all workers together (0 = no limit)
+    OPENAI_RPM: int = 0                               # OpenAI calls per minute, all workers together (0 = no limit)
+    OPENAI_MAX_CONCURRENCY: int = 0                   # OpenAI calls in flight, all workers together (0 = no limit)
+    RATE_LIMIT_BACKOFF_SECONDS: float = 10            # pause for all workers after a 429 without Retry-After
+
+    # request tracing (X-Request-Id)
+    TRACE_LOG: bool = True                            # one JSON line per timed pipeline span on stdout
+    TRACE_OTLP: str | None = None                     # also export spans as OTLP/JSON: file path, or http://collector:4318/v1/traces
+    TRACE_SERVICE_NAME: str = "bloodlab-api"          # service.name of exported spans
+
+    # memory accounting (/api/usage "memory", ?debug=true on /api/process[/stream])
+    MEMORY_SAMPLE_MS: float = 20                      # RSS sampling interval while requests run (0 = stage boundaries only)
+    MEMORY_TRACEMALLOC: bool = False                  # also trace Python allocations per stage (slows allocation-heavy code)
+
+    # admin endpoints & on-demand profiling (/api/admin/profiles)
+    ADMIN_TOKEN: str | None = None                    # X-Admin-Token for admin endpoints / X-Profile (unset = disabled)
+    PROFILE_SAMPLE_RATE: float = 0.0                  # share of POST /api/... requests profiled without asking (0 = none)
+    PROFILE_DIR: str | None = None                    # where profiles are kept (default: state/profiles)
+    PROFILE_KEEP: int = 50                            # newest profiles kept
+    PROFILE_INTERVAL_MS: float = 5                    # sampling interval
+
+    # patient result history (/api/history)
+    HISTORY_ENABLED: bool = False                     # store reports sent with a patient_id; /api/history needs ADMIN_TOKEN
+    HISTORY_DB: str | None = None                     # SQLite path (default: state/history.sqlite3)
+    # RESULT_CACHE_HOURS > 0 also keeps patient data on disk: every report's OCR'd
+    # results and summaries sit in SHARED_STATE_DB for that long, patient_id or not
+
+    # model usage
+    REQUEST_TOKEN_BUDGET: int = 0                     # max model tokens per upload/job; further pages are skipped (0 = no cap)
+    USAGE_CLIENT_IDS: str = ""                        # comma-separated X-Client-Id values booked under their own name ("" = any well-formed id)
+    USAGE_MAX_CLIENTS: int = 200                      # distinct clients counted in /api/usage; the rest go to "other"
+
+    # /api/summary
+    SUMMARY_MODE: str = "hybrid"                      # local | hybrid (model writes the final summary) | llm | parallel
+    SUMMARY_LLM_TIMEOUT: float = 20                   # seconds before falling back to the local render
+    SUMMARY_BORDERLINE_MARGIN: float = 0.05           # share of the range width counted as borderline
+    SUMMARY_PARALLELISM: int = 6                      # concurrent section calls in parallel mode
+
     class Config:
         env_file = ".env"       #locally
         extra = "ignore"
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlite_store import SQLiteStore
+
+# State shared by every process of a deployment (uvicorn --workers N, worker.py):
+# a result cache (OCR pages by image hash, summaries by report) and per-provider
+# limits that hold for all processes together: calls per minute (token bucket),
+# calls in flight (slots) and a pause after the provider answered 429. It lives
+# in one local SQLite file in WAL mode, so no extra service is needed.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns TEXT NOT NULL,                  -- ocr | summary
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,               -- JSON
+    expires REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    provider TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS slots (
+    id TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    expires REAL NOT NULL              -- a slot of a crashed process frees itself
+);
+CREATE INDEX IF NOT EXISTS slots_provider ON slots(provider, expires);
+"""
+
+BURST_SECONDS = 10         # a bucket holds at most this many seconds of quota
+SLOT_POLL_S = 0.1          # retry interval while all slots are taken
+MAX_SLEEP_S = 0.5          # waits are cut into steps so cancellation is noticed
+PURGE_EVERY = 256          # cache writes between purges of expired entries
+
+class SharedState(SQLiteStore):
+    def __init__(self, path: str, cache_ttl_s: float = 0.0):
+        super().__init__(path, SCHEMA)
+        self.cache_ttl_s = cache_ttl_s
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._waited_s = 0.0
+        self._puts = 0
+
+    def _count(self, name: str, seconds: float = 0.0):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._waited_s += seconds
+
+    # ----- result cache -----
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        if self.cache_ttl_s <= 0:
+            return None
+        with self._tx(write=False) as c:
+            row = c.execute(
+                "SELECT value FROM cache WHERE ns = ? AND key = ? AND expires > ?", (ns, key, time.time())
+            ).fetchone()
+        self._count(f"{ns}_hits" if row else f"{ns}_misses")
+        return json.loads(row[0]) if row else None
+
+    def put(self, ns: str, key: str, value: Any):
+        if self.cache_ttl_s <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._puts += 1
+            purge = self._puts % PURGE_EVERY == 0
+        with self._tx() as c:
+            c.execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                (ns, key, json.dumps(value, ensure_ascii=False), now + self.cache_ttl_s),
+            )
+            if purge:
+                c.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    # ----- provider limits -----
+    def try_acquire(self, provider: str, rpm: int = 0, concurrency: int = 0,
+                    hold_s: float = 600.0) -> Tuple[bool, Optional[str], float]:
+        """
+        One attempt to start a call: (True, slot id or None, 0) when it may start,
+        else (False, None, seconds until it is worth asking again).
+        """
+        now = time.time()
+        if not rpm and not concurrency:
+            # only the shared 429 pause applies: a read, no write lock
+            with self._tx(write=False) as c:
+                row = c.execute("SELECT blocked_until FROM buckets WHERE provider = ?", (provider,)).fetchone()
+            blocked = row[0] if row else 0.0
+            return (True, None, 0.0) if blocked <= now else (False, None, blocked - now)
+
+        burst = max(1.0, rpm * BURST_SECONDS / 60.0)
+        with self._tx() as c:
+            row = c.execute(
+                "SELECT tokens, updated, blocked_until FROM buckets WHERE provider = ?", (provider,)
+            ).fetchone()
+            tokens, updated, blocked = row if row else (burst, now, 0.0)
+            if blocked > now:
+                return False, None, blocked - now
+            if concurrency:
+                c.execute("DELETE FROM slots WHERE provider = ? AND expires < ?", (provider, now))
+                busy = c.execute("SELECT COUNT(*) FROM slots WHERE provider = ?", (provider,)).fetchone()[0]
+                if busy >= concurrency:
+                    return False, None, SLOT_POLL_S
+            if rpm:
+                tokens = min(burst, tokens + (now - updated) * rpm / 60.0)
+                if tokens < 1.0:
+                    return False, None, (1.0 - tokens) * 60.0 / rpm
+                tokens -= 1.0
+            c.execute(
+                "INSERT INTO buckets (provider, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(provider) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (provider, tokens, now),
+            )
+            slot = None
+            if concurrency:
+                slot = uuid.uuid4().hex
+                c.execute("INSERT INTO slots (id, provider, expires) VALUES (?, ?, ?)", (slot, provider, now + hold_s))
+        return True, slot, 0.0
+
+    def acquire(self, provider: str, rpm: int = 0, concurrency: int = 0, hold_s: float = 600.0,
+                check: Optional[Callable[[], None]] = None) -> Optional[str]:
+        """
+        Block until a call to provider may start; returns its slot (pass to release).
+        check() is called before every wait and may raise to give up (e.g. Deadline.check).
+        """
+        t0 = time.monotonic()
+        while True:
+            ok, slot, wait = self.try_acquire(provider, rpm, concurrency, hold_s)
+            if ok:
+                waited = time.monotonic() - t0
+                if waited > 0.01:
+                    self._count(f"{provider}_throttled", waited)
+                return slot
+            if check is not None:
+                check()
+            time.sleep(min(max(wait, 0.01), MAX_SLEEP_S))
+
+    def release(self, slot: Optional[str]):
+        if slot is None:
+            return
+        with self._tx() as c:
+            c.execute("DELETE FROM slots WHERE id = ?", (slot,))
+
+    def backoff(self, provider: str, seconds: float):
+        """The provider answered 429: no process calls it for the next `seconds`."""
+        until = time.time() + seconds
+        with self._tx() as c:
+            c.execute(
+                "INSERT INTO buckets (provider, tokens, updated, blocked_until) VALUES (?, 0, ?, ?) "
+                "ON CONFLICT(provider) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                (provider, time.time(), until),
+            )
+        self._count(f"{provider}_rate_limited")
+        print(f"{provider} rate limited: all workers pause for {seconds:g}s")
+
+    # ----- reading -----
+    def snapshot(self) -> Dict[str, Any]:
+        """Cache size and in-flight slots (all processes), plus this process's hit/throttle counters."""
+        with self._lock:
+            counts = dict(self._counts)
+            waited = self._waited_s
+        shared: Dict[str, Any] = {}
+        if self._ready or os.path.exists(self.path):
+            now = time.time()
+            with self._tx(write=False) as c:
+                shared["cached"] = dict(c.execute(
+                    "SELECT ns, COUNT(*) FROM cache WHERE expires > ? GROUP BY ns", (now,)
+                ).fetchall())
+                shared["in_flight"] = dict(c.execute(
+                    "SELECT provider, COUNT(*) FROM slots WHERE expires >= ? GROUP BY provider", (now,)
+                ).fetchall())
+                shared["paused"] = {p: round(u - now, 1) for p, u in c.execute(
+                    "SELECT provider, blocked_until FROM buckets WHERE blocked_until > ?", (now,)
+                ).fetchall()}
+        return {**shared, "process": {**counts, "throttled_seconds": round(waited, 2), "pid": os.getpid()}}
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional
+
+from deadlines import Cancelled, Deadline
+
+# In-flight call coalescing: concurrent callers with the same key share one
+# execution (e.g. OCR of a page that two tabs / a double click submitted twice).
+# Nothing is cached after the call completes.
+
+WAIT_STEP_S = 0.5          # followers wake up this often to notice a cancelled deadline
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any], deadline: Optional[Deadline] = None) -> Any:
+        """
+        Run fn() or wait for the identical in-flight call; returns its result (or
+        raises its error). A follower waits no longer than its own deadline and then
+        raises Cancelled, as the leader's call would: the leader may have more time.
+        """
+        with self._lock:
+            fut = self._calls.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._calls[key] = fut
+        if not leader:
+            return self._wait(fut, deadline)
+        try:
+            res = fn()
+            fut.set_result(res)
+            return res
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    @staticmethod
+    def _wait(fut: Future, deadline: Optional[Deadline]) -> Any:
+        if deadline is None:
+            return fut.result()
+        while True:
+            deadline.check()
+            left = deadline.remaining()
+            try:
+                return fut.result(timeout=WAIT_STEP_S if left is None else min(left, WAIT_STEP_S))
+            except FutureTimeout:
+                continue
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# Common base of the SQLite-backed stores (jobs, history, shared state): the file
+# and its schema are created on first use, then every call gets its own
+# short-lived connection, so one store is safe across threads and processes.
+
+class SQLiteStore:
+    def __init__(self, path: str, schema: str):
+        self.path = path
+        self.schema = schema
+        self._ready = False
+
+    def _ensure(self):
+        # created on first use, so importing the app (CLI, tools) touches no files
+        if self._ready:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        c = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.executescript(self.schema)
+            self._migrate(c)
+        finally:
+            c.close()
+        self._ready = True
+
+    def _migrate(self, c: sqlite3.Connection):
+        """Bring files created by an older schema up to date (CREATE IF NOT EXISTS adds no columns)."""
+
+    @staticmethod
+    def _add_column(c: sqlite3.Connection, table: str, column: str, ddl: str):
+        if any(r[1] == column for r in c.execute(f"PRAGMA table_info({table})")):
+            return
+        try:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        except sqlite3.OperationalError as e:
+            if "duplicate column" not in str(e):      # another process migrated it first
+                raise
+
+    @contextmanager
+    def _tx(self, write: bool = True):
+        """One transaction on a fresh connection; write=True takes the write lock up front."""
+        self._ensure()
+        c = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield c
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+        finally:
+            c.close()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import uuid
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator
+
+# Server-side buffer for /api/process/stream. The pipeline runs as a background
+# task and appends numbered SSE frames to a session; clients follow the session
+# and, after a dropped connection, replay everything after their Last-Event-ID.
+
+Encoder = Callable[[str, Dict[str, Any], int], bytes]
+
+class StreamSession:
+    def __init__(self, stream_id: str, encode: Encoder):
+        self.id = stream_id
+        self.encode = encode
+        self.frames: List[bytes] = []          # frame i has event id i + 1
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self.followers = 0                     # connected clients
+        self._alone_since: Optional[float] = time.monotonic()
+
+    @property
+    def last_id(self) -> int:
+        return len(self.frames)
+
+    def emit(self, event: str, data: Dict[str, Any]):
+        self.frames.append(self.encode(event, data, len(self.frames) + 1))
+        self._changed.set()
+
+    def close(self):
+        self.done = True
+        self.finished_at = time.time()
+        self._changed.set()
+
+    def abandoned(self, grace_s: float) -> bool:
+        """No client has followed the session for grace_s seconds (time to resume after a drop)."""
+        return self.followers == 0 and self._alone_since is not None and time.monotonic() - self._alone_since >= grace_s
+
+    async def follow(self, after: int = 0, keepalive_s: float = 15.0) -> AsyncIterator[bytes]:
+        """Yield frames with id > after, then live ones until the session closes."""
+        i = max(0, after)
+        self.followers += 1
+        self._alone_since = None
+        try:
+            while True:
+                while i < len(self.frames):
+                    yield self.frames[i]
+                    i += 1
+                if self.done:
+                    return
+                self._changed.clear()
+                if i < len(self.frames) or self.done:
+                    continue
+                try:
+                    await asyncio.wait_for(self._changed.wait(), keepalive_s)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            # runs when the response ends or the client disconnects
+            self.followers -= 1
+            if self.followers == 0:
+                self._alone_since = time.monotonic()
+
+class StreamRegistry:
+    def __init__(self, encode: Encoder, retention_s: float = 600.0):
+        self.encode = encode
+        self.retention_s = retention_s
+        self._sessions: Dict[str, StreamSession] = {}
+
+    def create(self) -> StreamSession:
+        self.purge()
+        s = StreamSession(uuid.uuid4().hex, self.encode)
+        self._sessions[s.id] = s
+        return s
+
+    def get(self, stream_id: str) -> Optional[StreamSession]:
+        self.purge()
+        return self._sessions.get(stream_id)
+
+    def purge(self):
+        cutoff = time.time() - self.retention_s
+        for sid in [sid for sid, s in self._sessions.items() if s.done and s.finished_at < cutoff]:
+            del self._sessions[sid]
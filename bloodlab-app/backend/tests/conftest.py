@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+# backend modules are flat (imported as `import prefilter`), as in main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main reads settings at import: a placeholder key, and state files that are thrown away
+STATE_DIR = tempfile.mkdtemp(prefix="bloodlab-tests-")
+os.environ.setdefault("GOOGLE_API_KEY", "test-placeholder-key")
+for _name, _file in (("JOBS_DB", "jobs.sqlite3"), ("HISTORY_DB", "history.sqlite3"),
+                     ("SHARED_STATE_DB", "shared.sqlite3"), ("PROFILE_DIR", "profiles")):
+    os.environ.setdefault(_name, os.path.join(STATE_DIR, _file))
+os.environ.setdefault("TRACE_LOG", "false")
+
+class FakeResponse:
+    """Enough of a google.generativeai response for ocr_page (plain and streamed)."""
+    def __init__(self, text: str, fail: bool = False):
+        self.text = text
+        self.usage_metadata = None
+        self._fail = fail
+
+    def __iter__(self):
+        yield self
+        if self._fail:
+            raise RuntimeError("connection reset mid-stream")
+
+class FakeModel:
+    """
+    Stand-in for a GenerativeModel. pages maps the call number (1-based) to the
+    measurements it returns, to an Exception it raises, or to a str returned as-is.
+    Unlisted calls return `default`; every call takes `delay` seconds.
+    """
+    model_name = "models/fake"
+
+    def __init__(self, pages=None, default=None, delay: float = 0.0):
+        self.pages = pages or {}
+        self.default = default if default is not None else [{"name": "Glucose", "value": "5.4", "unit": "mmol/L"}]
+        self.delay = delay
+        self.calls = 0
+
+    def generate_content(self, parts, stream=False, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        out = self.pages.get(self.calls, self.default)
+        if isinstance(out, Exception):
+            raise out
+        return FakeResponse(out if isinstance(out, str) else json.dumps({"measurements": out}))
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Every models.get() in main returns one FakeModel; its routing, cache and breakers are reset."""
+    import main
+    model = FakeModel()
+    monkeypatch.setattr(main.models, "get", lambda name: model)
+    monkeypatch.setattr(main, "FAST_MODEL_NAME", None)
+    monkeypatch.setattr(main.settings, "RESULT_CACHE_HOURS", 0)
+    monkeypatch.setattr(main.shared_state, "cache_ttl_s", 0)
+    monkeypatch.setattr(main, "provider_breakers", {n: main._breaker(n) for n in main.provider_breakers})
+    return model
+
+@pytest.fixture
+def client():
+    import main
+    from fastapi.testclient import TestClient
+    return TestClient(main.app)      # no lifespan: job workers stay off
+
+def render_page(lines) -> bytes:
+    img = Image.new("L", (2480, 3508), 250)
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    for i, text in enumerate(lines):
+        d.text((200, 400 + i * 60), text, fill=20, font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def page_png():
+    """Factory: PNG of an A4 page with the given text lines (distinct text = distinct page for the prefilter)."""
+    return render_page
+
+@pytest.fixture
+def result_page():
+    """PNG of an A4 page with one result row: kept by the prefilter, one OCR call."""
+    return render_page(["Glucose   5.4   mmol/L   3.9 - 6.1"])
+
+class FakeOpenAI:
+    """
+    Enough of an OpenAI client for the summary calls. reply(system, user) gives the
+    text; a reply that is an Exception is raised. Calls are kept in `calls`.
+    """
+    def __init__(self, reply=None, cached_tokens: int = 0, delay: float = 0.0):
+        self.reply = reply or (lambda system, user: "model text")
+        self.cached_tokens = cached_tokens
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._create))
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _create(self, model, messages, **kwargs):
+        # summaries send system + user; OCR failover sends one user message with the image
+        system, user = (messages[0]["content"], messages[1]["content"]) if len(messages) > 1 \
+            else ("", messages[0]["content"])
+        with self._lock:
+            self.calls.append((system, user))
+        time.sleep(self.delay)
+        text = self.reply(system, user)
+        if isinstance(text, Exception):
+            raise text
+        usage = types.SimpleNamespace(prompt_tokens=len(str(user)) // 4, completion_tokens=len(text) // 4,
+                                      prompt_tokens_details=types.SimpleNamespace(cached_tokens=self.cached_tokens))
+        return types.SimpleNamespace(usage=usage,
+                                     choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """main.openai_client replaced by a FakeOpenAI; the shared summary cache is off."""
+    import main
+    client = FakeOpenAI()
+    monkeypatch.setattr(main, "openai_client", client)
+    monkeypatch.setattr(main.shared_state, "cache_ttl_s", 0)
+    return client
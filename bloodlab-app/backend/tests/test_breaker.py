@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+
+import main
+from breaker import CircuitBreaker, CircuitOpen
+
+def breaker(**kw):
+    return CircuitBreaker("test", **{"window": 10, "min_calls": 4, "failure_rate": 0.5, "open_seconds": 0.05, **kw})
+
+def test_opens_at_the_failure_rate_once_there_are_enough_calls():
+    b = breaker()
+    for ok in (False, False, False):
+        b.record(ok)
+    assert b.state == "closed"                       # 3 calls < min_calls
+    b.record(True)
+    assert b.state == "open" and b.opened == 1       # 3 of 4 bad
+    assert not b.allow()
+
+def test_stays_closed_below_the_failure_rate():
+    b = breaker()
+    for ok in (True, False, True, True, False, True):
+        b.record(ok)
+    assert b.state == "closed"
+
+def test_slow_successes_count_as_failures():
+    b = breaker(slow_seconds=1.0)
+    for _ in range(4):
+        b.record(True, seconds=2.0)
+    assert b.state == "open"
+
+def trip(b):
+    for _ in range(4):
+        b.record(False)
+    assert b.state == "open"
+
+def test_half_open_lets_one_probe_through():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    assert b.allow() and b.state == "half_open"
+    assert not b.allow()                             # second caller while the probe is out
+    b.record(True)
+    assert b.state == "closed"
+    assert b.snapshot() == {"state": "closed", "recent_calls": 0, "recent_failure_rate": 0.0, "times_opened": 1}
+
+def test_failed_probe_opens_again():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    assert b.allow()
+    b.record(False)
+    assert b.state == "open" and b.opened == 2
+    assert not b.allow()
+
+def test_lost_probe_is_replaced():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    assert b.allow()                                 # probe never reports back (cancelled call)
+    time.sleep(0.06)
+    assert b.allow()
+
+# ---------- OCR with the breaker ----------
+@pytest.fixture
+def google_down(fake_model, monkeypatch):
+    fake_model.default = RuntimeError("503 unavailable")
+    monkeypatch.setitem(main.provider_breakers, "google", breaker(open_seconds=60))
+    monkeypatch.setitem(main.provider_breakers, "openai", breaker(open_seconds=60))
+    return fake_model
+
+def ocr(n):
+    out = []
+    for i in range(n):
+        try:
+            out.append(main.ocr_page(main.models.get(main.MODEL_NAME), b"page %d" % i, "r.pdf", i + 1))
+        except Exception as e:
+            out.append(e)
+    return out
+
+def test_open_breaker_fails_fast_without_failover(google_down, monkeypatch):
+    monkeypatch.setattr(main, "FAILOVER_MODEL", None)
+    results = ocr(6)
+    assert all(isinstance(r, main.OcrFailed) for r in results[:4])
+    assert all(isinstance(r, CircuitOpen) for r in results[4:])
+    assert google_down.calls == 4                    # no calls while open
+
+def test_open_breaker_fails_over_to_openai(google_down, fake_openai, monkeypatch):
+    monkeypatch.setattr(main, "FAILOVER_MODEL", "gpt-4o-mini")
+    fake_openai.reply = lambda system, user: json.dumps({"measurements": [{"name": "Glucose", "value": "5.4"}]})
+    results = ocr(6)
+    assert all(r == {"measurements": [{"name": "Glucose", "value": "5.4"}]} for r in results)
+    assert google_down.calls == 4
+    assert len(fake_openai.calls) == 6               # the 4 failed pages, then 2 routed straight there
+    assert main.provider_breakers["google"].state == "open"
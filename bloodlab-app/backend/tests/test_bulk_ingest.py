@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from bulk_ingest import ingest, iter_input_paths, load_checkpoint
+
+@pytest.fixture
+def archive(tmp_path, page_png):
+    d = tmp_path / "archive"
+    (d / "2023").mkdir(parents=True)
+    (d / "a.png").write_bytes(page_png(["Glucose   5.4   mmol/L"]))
+    (d / "2023" / "b.png").write_bytes(page_png(["Urea   5.0   mmol/L", "Creatinine   80   umol/L"]))
+    (d / "notes.txt").write_text("not a report")
+    return d
+
+def records(path):
+    return [json.loads(line) for line in open(path, encoding="utf-8")]
+
+def test_directory_walk_keeps_reports_only(archive):
+    assert iter_input_paths(str(archive)) == [str(archive / "2023" / "b.png"), str(archive / "a.png")]
+
+def test_manifest_paths_are_relative_to_it(archive):
+    txt = archive / "list.txt"
+    txt.write_text("# reports\na.png\n\n" + str(archive / "2023" / "b.png") + "\n")
+    jsonl = archive / "list.jsonl"
+    jsonl.write_text(json.dumps({"path": "a.png"}) + "\n")
+    assert iter_input_paths(str(txt)) == [str(archive / "a.png"), str(archive / "2023" / "b.png")]
+    assert iter_input_paths(str(jsonl)) == [str(archive / "a.png")]
+
+def test_checkpoint_counts_ok_records_only(tmp_path):
+    out = tmp_path / "out.jsonl"
+    out.write_text(json.dumps({"path": "a", "status": "ok"}) + "\n"
+                   + json.dumps({"path": "b", "status": "partial"}) + "\n"
+                   + '{"path": "c", "sta')                    # torn last line
+    assert load_checkpoint(str(out)) == {"a"}
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == set()
+
+def test_ingest_writes_one_record_per_file_and_resumes(archive, tmp_path, fake_model):
+    out = str(tmp_path / "out.jsonl")
+    paths = iter_input_paths(str(archive))
+    totals = ingest(paths, out, render_workers=1, concurrency=2, model=fake_model)
+    assert (totals["files"], totals["ok"], totals["pages"]) == (2, 2, 2)
+    recs = records(out)
+    assert sorted(r["path"] for r in recs) == sorted(paths)
+    assert all(r["result"]["status"] == "complete" for r in recs)
+
+    calls = fake_model.calls
+    assert ingest(paths, out, render_workers=1, concurrency=2, model=fake_model)["files"] == 0
+    assert fake_model.calls == calls
+
+def test_failed_page_makes_the_file_partial_and_retried(archive, tmp_path, fake_model):
+    out = str(tmp_path / "out.jsonl")
+    path = str(archive / "a.png")
+    fake_model.pages = {1: RuntimeError("upstream 500")}
+    totals = ingest([path], out, render_workers=1, concurrency=1, model=fake_model)
+    assert (totals["partial"], totals["failed_pages"]) == (1, 1)
+    assert records(out)[0]["skipped"][0]["reason"] == "ocr_failed"
+
+    totals = ingest([path], out, render_workers=1, concurrency=1, model=fake_model)     # not in the checkpoint
+    assert totals["ok"] == 1
+
+def test_unreadable_file_is_an_error_record(tmp_path, fake_model):
+    out = str(tmp_path / "out.jsonl")
+    totals = ingest([str(tmp_path / "gone.pdf")], out, render_workers=1, concurrency=1, model=fake_model)
+    assert totals["errors"] == 1
+    assert records(out)[0]["status"] == "error"
@@ -0,0 +1,76 @@
+import pytest
+
+import main
+from main import Row, compute_composites
+
+CREATININE = [Row(name="Creatinine", value="0.9", unit="mg/dL")]
+
+def egfr_card(sex, age, measurements=CREATININE):
+    cards = compute_composites([(measurements, sex, age)])[0]
+    return next((c for c in cards if c.key == "egfr"), None)
+
+@pytest.mark.parametrize("sex", [None, "", "x", "unknown"])
+def test_egfr_needs_a_known_sex(sex):
+    card = egfr_card(sex, 50)
+    assert card.value is None
+    assert card.grade == "Age and sex required"
+
+@pytest.mark.parametrize("age", [None, 0, -3, 250, float("nan")])
+def test_egfr_needs_a_valid_age(age):
+    card = egfr_card("female", age)
+    assert card.value is None
+    assert card.grade == "Age and sex required"
+
+def test_egfr_male():
+    # CKD-EPI 2021: 142 * 0.9938^50 at Scr = kappa (0.9 mg/dL)
+    card = egfr_card("male", 50)
+    assert card.value == 104
+    assert card.grade.startswith("G1")
+
+@pytest.mark.parametrize("sex", ["female", "F", " Female "])
+def test_egfr_female(sex):
+    card = egfr_card(sex, 50)
+    assert card.value == 78
+    assert card.grade.startswith("G2")
+
+def test_reports_in_one_batch_keep_their_own_demographics():
+    res = compute_composites([(CREATININE, "male", 50), (CREATININE, None, 50), (CREATININE, "female", 50)])
+    values = [next(c.value for c in cards if c.key == "egfr") for cards in res]
+    assert values == [104, None, 78]
+
+def test_no_creatinine_no_egfr_card():
+    assert egfr_card(None, None, [Row(name="Glucose", value="5.4", unit="mmol/L")]) is None
+
+def cards_by_key(measurements, sex=None, age=None):
+    return {c.key: c for c in compute_composites([(measurements, sex, age)])[0]}
+
+def test_creatinine_units_give_one_egfr():
+    mgdl = egfr_card("male", 50, [Row(name="Creatinine", value="0.9", unit="mg/dL")])
+    umol = egfr_card("male", 50, [Row(name="Creatinine", value="79.56", unit="µmol/L")])
+    cyr = egfr_card("male", 50, [Row(name="Креатинин", value="79,56", unit="мкмоль/л")])
+    assert mgdl.value == umol.value == cyr.value == 104
+
+def test_lipids_in_mgdl_and_mmol_agree():
+    mmol = cards_by_key([Row(name="Triglycerides", value="1.7", unit="mmol/L"),
+                         Row(name="HDL", value="1.3", unit="mmol/L"),
+                         Row(name="Cholesterol total", value="5.2", unit="mmol/L")])
+    mgdl = cards_by_key([Row(name="Triglycerides", value=f"{1.7 * 88.57:.2f}", unit="mg/dL"),
+                         Row(name="HDL", value=f"{1.3 * 38.67:.2f}", unit="mg/dL"),
+                         Row(name="Cholesterol total", value=f"{5.2 * 38.67:.2f}", unit="mg/dL")])
+    for key in ("aip", "tg_hdl", "tc_hdl"):
+        assert mmol[key].value == mgdl[key].value, key
+    assert mmol["tg_hdl"].value == round((1.7 * 88.57) / (1.3 * 38.67), 2)
+
+def test_norm_value_from_the_pipeline_is_used():
+    row = Row(name="Creatinine", value="0.9", unit="mg/dL")
+    main.normalize_rows([row], main.UNIT_REGISTRY, main.value_to_number)
+    assert row.norm_unit == "µmol/L"
+    assert egfr_card("male", 50, [row]).value == 104
+
+def test_unknown_unit_leaves_the_index_out():
+    assert "egfr" not in cards_by_key([Row(name="Creatinine", value="0.9", unit="furlongs")], "male", 50)
+
+def test_nlr_matches_absolute_counts_across_units():
+    cards = cards_by_key([Row(name="Neutrophils absolute", value="4000", unit="/µl"),
+                          Row(name="Lymphocytes absolute", value="2.0", unit="10^9/L")])
+    assert cards["nlr"].value == 2.0
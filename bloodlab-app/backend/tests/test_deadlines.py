@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+import main
+from deadlines import Cancelled, Deadline, parse_seconds
+
+def test_no_limit():
+    d = Deadline()
+    assert d.remaining() is None
+    assert not d.done and d.why() is None
+    d.check()
+
+def test_expiry():
+    d = Deadline(0.05)
+    assert 0 < d.remaining() <= 0.05
+    time.sleep(0.06)
+    assert d.expired and d.done and d.remaining() == 0.0
+    with pytest.raises(Cancelled) as exc:
+        d.check()
+    assert exc.value.reason == "deadline"
+
+def test_cancel_wins_over_expiry_and_keeps_the_first_reason():
+    d = Deadline(0.01)
+    d.cancel()
+    d.cancel("other")
+    time.sleep(0.02)
+    assert d.why() == "cancelled" and d.reason == "cancelled"
+
+@pytest.mark.parametrize("raw, seconds", [("30", 30.0), ("12.5", 12.5), ("0", 0.0), ("-3", 0.0), ("soon", 0.0),
+                                          (None, 0.0)])
+def test_parse_seconds(raw, seconds):
+    assert parse_seconds(raw) == seconds
+
+def test_call_timeout_follows_the_closer_limit(monkeypatch):
+    monkeypatch.setattr(main.settings, "OCR_CALL_TIMEOUT", 60)
+    assert main.call_timeout(None) == 60
+    assert main.call_timeout(Deadline(10)) == pytest.approx(10, abs=0.1)
+    assert main.call_timeout(Deadline(0.01)) == 1.0              # never below a second
+    assert main.model_call_options(Deadline(10))["request_options"]["timeout"] <= 10
+
+def test_pages_past_the_deadline_are_skipped(client, fake_model, monkeypatch):
+    # pages as uploaded: rendering time must not eat into the deadline under test
+    monkeypatch.setattr(main, "prepare_pages",
+                        lambda files, mem=None: ([(name, 1, raw) for name, _, raw, _ in files], []))
+    fake_model.delay = 0.3
+    files = [("files", (f"p{i}.png", f"page {i}".encode(), "image/png")) for i in (1, 2, 3)]
+    t0 = time.perf_counter()
+    r = client.post("/api/process", files=files, headers={"X-Request-Deadline": "0.45"})
+    elapsed = time.perf_counter() - t0
+    body = r.json()
+    assert body["status"] == "partial"
+    assert "p3.png p1 (deadline)" in body["notes"]
+    assert fake_model.calls == 2                                 # page 3 was never sent
+    assert elapsed < 3 * fake_model.delay
@@ -0,0 +1,49 @@
+import main
+from main import DedupState, Row, dedup_measurements
+
+PAGES = [
+    [Row(name="Hemoglobin", value="135"),
+     Row(name="Neutrophils %", value="55", unit="%"),
+     Row(name="Neutrophils absolute", value="3.1", unit="10^9/L")],
+    [Row(name="Hemoglobin", value="135", unit="g/L", reference_text="120-160", ref_low=120, ref_high=160),
+     Row(name="Glucose", value="5.4", unit="mmol/L")],
+    [Row(name="Glucose", value="5.4"),                       # worse than what we have: no change
+     Row(name="Neutrophils %", value="55", unit="%", reference_text="40-75")],
+]
+
+def replay(changes_per_page):
+    """The client side: apply upsert/replace deltas to a key -> row table."""
+    table = {}
+    for changes in changes_per_page:
+        for op, key, m in changes:
+            assert (op == "replace") == (key in table)
+            table[key] = m
+    return table
+
+def test_incremental_matches_the_batch_dedup():
+    state = DedupState()
+    changes = [state.add(page) for page in PAGES]
+    batch = dedup_measurements([m for page in PAGES for m in page])
+    assert [(m.name, m.unit) for m in state.results()] == [(m.name, m.unit) for m in batch]
+    assert list(replay(changes).values()) == state.results()
+
+def test_deltas_name_only_what_changed():
+    state = DedupState()
+    ops = [[(op, m.name) for op, _, m in state.add(page)] for page in PAGES]
+    assert ops[0] == [("upsert", "Hemoglobin"), ("upsert", "Neutrophils %"), ("upsert", "Neutrophils absolute")]
+    assert ops[1] == [("replace", "Hemoglobin"), ("upsert", "Glucose")]
+    assert ops[2] == [("replace", "Neutrophils %")]
+
+def test_wbc_percent_and_absolute_stay_apart():
+    keys = {main.leukocyte_dedup_key(m) for m in PAGES[0]}
+    assert len(keys) == 3
+
+def test_checksum_follows_the_final_table():
+    # a client that rebuilt the table from the deltas can compare it with done.checksum
+    a, b = DedupState(), DedupState()
+    for page in PAGES:
+        a.add(page)
+    b.add([m for page in PAGES for m in page])
+    assert a.checksum() == b.checksum()
+    b.add([Row(name="Urea", value="5.0", unit="mmol/L")])
+    assert a.checksum() != b.checksum()
@@ -0,0 +1,35 @@
+import pytest
+
+import main
+from history import HistoryStore
+
+@pytest.fixture
+def history(monkeypatch, tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    monkeypatch.setattr(main, "history_store", store)
+    monkeypatch.setattr(main.settings, "HISTORY_ENABLED", True)
+    monkeypatch.setattr(main.settings, "ADMIN_TOKEN", "s3cret-admin")
+    return store
+
+def upload(client, page, headers=None, path="/api/process"):
+    return client.post(path, files={"files": ("report.png", page, "image/png")},
+                       data={"patient_id": "p1"}, headers=headers or {})
+
+@pytest.mark.parametrize("path", ["/api/process", "/api/process/stream"])
+@pytest.mark.parametrize("token", [None, "wrong"])
+def test_patient_id_without_admin_token_stores_nothing(client, fake_model, history, result_page, path, token):
+    r = upload(client, result_page, {"X-Admin-Token": token} if token else None, path)
+    assert r.status_code == 403
+    assert fake_model.calls == 0
+    assert history.latest("p1") == []
+
+def test_patient_id_with_admin_token_is_recorded(client, fake_model, history, result_page):
+    r = upload(client, result_page, {"X-Admin-Token": "s3cret-admin"})
+    assert r.status_code == 200
+    assert r.headers["X-Report-Id"]
+    assert len(history.latest("p1")) == 1
+
+def test_upload_without_patient_id_needs_no_token(client, fake_model, history, result_page):
+    r = client.post("/api/process", files={"files": ("report.png", result_page, "image/png")})
+    assert r.status_code == 200
+    assert history.latest("p1") == []
@@ -0,0 +1,100 @@
+import sqlite3
+import time
+
+import pytest
+
+from jobs import JobStore, WorkerPool
+
+FILES = [("report.pdf", "application/pdf", b"%PDF-1.4 test", 0)]
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+def crash(store, job_id):
+    """What a worker that died mid-job leaves behind: 'running', no heartbeat for a while."""
+    with store._tx() as c:
+        c.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 3600, job_id))
+
+def test_claim_takes_the_oldest_queued_job_once(store):
+    first, second = store.create(FILES), store.create(FILES)
+    assert store.claim() == first
+    assert store.claim() == second
+    assert store.claim() is None
+    assert store.get(first)["status"] == "running"
+    assert store.get(first)["attempts"] == 1
+
+def test_stale_running_job_is_requeued(store):
+    job_id = store.create(FILES)
+    store.claim()
+    assert store.requeue_stale(60, max_attempts=3) == (0, 0)      # heartbeat is fresh
+    crash(store, job_id)
+    assert store.requeue_stale(60, max_attempts=3) == (1, 0)
+    assert store.get(job_id)["status"] == "queued"
+    assert store.load_files(job_id)
+
+def test_job_fails_after_max_attempts(store):
+    job_id = store.create(FILES)
+    for attempt in range(1, 4):
+        assert store.claim() == job_id
+        crash(store, job_id)
+        requeued, failed = store.requeue_stale(60, max_attempts=3)
+        assert (requeued, failed) == ((1, 0) if attempt < 3 else (0, 1))
+    job = store.get(job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == 3
+    assert "3 attempts" in job["error"]
+    assert store.load_files(job_id) == []
+    assert store.claim() is None
+
+def test_no_limit_keeps_requeueing(store):
+    job_id = store.create(FILES)
+    for _ in range(5):
+        store.claim()
+        crash(store, job_id)
+        assert store.requeue_stale(60, max_attempts=0) == (1, 0)
+
+def test_old_file_gets_the_attempts_column(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    c = sqlite3.connect(path)
+    c.executescript("""
+        CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL,
+                           updated_at REAL NOT NULL, total_pages INTEGER, result TEXT, error TEXT);
+        INSERT INTO jobs (id, status, created_at, updated_at) VALUES ('old', 'queued', 0, 0);
+    """)
+    c.commit()
+    c.close()
+    store = JobStore(path)
+    assert store.claim() == "old"
+    assert store.get("old")["attempts"] == 1
+
+def test_page_results_are_kept_for_a_resumed_job(store):
+    job_id = store.create(FILES)
+    store.claim()
+    store.save_page(job_id, "report.pdf", 1, "done", [{"name": "Glucose"}])
+    store.save_page(job_id, "report.pdf", 2, "failed", {"reason": "ocr_failed"})
+    crash(store, job_id)
+    store.requeue_stale(60, max_attempts=3)
+    done = store.page_results(job_id)
+    assert done[("report.pdf", 1)] == {"status": "done", "items": [{"name": "Glucose"}]}
+    assert done[("report.pdf", 2)]["status"] == "failed"
+
+def test_worker_pool_runs_and_fails_jobs(store):
+    ok, bad = store.create(FILES), store.create(FILES)
+
+    def runner(s, job_id):
+        if job_id == bad:
+            raise RuntimeError("boom")
+        s.finish(job_id, {"measurements": []})
+
+    pool = WorkerPool(store, runner, workers=1, poll_interval=0.05)
+    pool.start()
+    try:
+        for _ in range(100):
+            if store.get(ok)["status"] == "done" and store.get(bad)["status"] == "failed":
+                break
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    assert store.get(ok)["status"] == "done"
+    assert store.get(bad)["error"] == "boom"
@@ -0,0 +1,83 @@
+import time
+import tracemalloc
+
+from memstats import (MemoryStats, RequestMemory, RssSampler, page_bytes, payload_bytes, peak_rss_bytes, rss_bytes,
+                      stage)
+
+def test_payload_counts_the_base64_copy():
+    assert payload_bytes(b"x" * 3000) == 3000 + 4000
+    assert payload_bytes(b"x") == 1 + 4
+    assert page_bytes([("a.pdf", 1, b"x" * 10), ("a.pdf", 2, b"y" * 5)]) == 15
+
+def test_rss_is_read_from_proc():
+    assert 0 < rss_bytes() <= peak_rss_bytes()
+
+def test_stage_records_held_bytes_and_rss():
+    mem = RequestMemory()
+    with mem.stage("render") as rec:
+        block = bytearray(32 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])      # touch the pages so they count in RSS
+        rec["held_bytes"] = len(block)
+    summary = mem.finish()
+    render = summary["stages"]["render"]
+    assert render["held_bytes"] == 32 * 1024 * 1024
+    assert render["rss_peak_delta"] >= 16 * 1024 * 1024
+    assert render["calls"] == 1
+    assert summary["peak_rss"] >= summary["start_rss"]
+    del block
+
+def test_repeated_stages_keep_maxima():
+    mem = RequestMemory()
+    for held in (100, 300, 200):
+        with mem.stage("ocr") as rec:
+            rec["held_bytes"] = held
+    ocr = mem.finish()["stages"]["ocr"]
+    assert (ocr["held_bytes"], ocr["calls"]) == (300, 3)
+
+def test_tracemalloc_deltas_when_tracing():
+    tracemalloc.start()
+    try:
+        mem = RequestMemory()
+        with mem.stage("preprocess"):
+            data = [bytes(1024) for _ in range(1000)]
+        rec = mem.finish()["stages"]["preprocess"]
+    finally:
+        tracemalloc.stop()
+    assert rec["traced_delta"] >= 1000 * 1024
+    assert rec["traced_peak_delta"] >= rec["traced_delta"]
+    del data
+
+def test_sampler_sees_a_peak_between_stage_edges():
+    sampler = RssSampler(interval_s=0.005)
+    mem = RequestMemory(sampler)
+    with mem.stage("ocr"):
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])
+        time.sleep(0.05)                                 # sampled while held
+        del block
+    summary = mem.finish()
+    assert summary["stages"]["ocr"]["rss_peak_delta"] >= 32 * 1024 * 1024
+    time.sleep(0.05)
+    assert sampler._thread is None                        # stops with no request left
+
+def test_stage_without_tracking_is_a_noop():
+    with stage(None, "ocr") as rec:
+        rec["held_bytes"] = 1
+
+def test_stats_aggregate_requests():
+    stats = MemoryStats()
+    for held in (10, 30):
+        mem = RequestMemory(stats=stats)
+        with mem.stage("upload") as rec:
+            rec["held_bytes"] = held
+        mem.finish()
+    snap = stats.snapshot()
+    assert snap["requests"] == 2
+    assert snap["stages"]["upload"]["avg_held_bytes"] == 20
+    assert snap["stages"]["upload"]["max_held_bytes"] == 30
+
+def test_debug_response_carries_the_memory_report(client, fake_model, result_page):
+    r = client.post("/api/process?debug=true", files={"files": ("report.png", result_page, "image/png")})
+    memory = r.json()["debug"]["memory"]
+    assert {"upload", "ocr", "response"} <= set(memory["stages"])
+    assert memory["stages"]["upload"]["held_bytes"] == len(result_page)
@@ -0,0 +1,67 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from prefilter import filter_pages
+
+A4 = (2480, 3508)      # 300 dpi
+
+def png(img: Image.Image, fmt: str = "PNG", **kw) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kw)
+    return buf.getvalue()
+
+def draw(lines) -> Image.Image:
+    img = Image.new("L", A4, 250)
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    for i, text in enumerate(lines):
+        d.text((200, 400 + i * 60), text, fill=20, font=font)
+    return img
+
+def page(lines):
+    return png(draw(lines))
+
+def noisy(img: Image.Image, sigma: float) -> Image.Image:
+    """Scanner-like sensor noise."""
+    a = np.asarray(img, dtype=float) + np.random.default_rng(0).normal(0, sigma, img.size[::-1])
+    return Image.fromarray(np.clip(a, 0, 255).astype(np.uint8))
+
+def test_one_result_page_is_kept():
+    pages = [("report.pdf", 1, page(["Glucose   5.4   mmol/L   3.9 - 6.1"]))]
+    kept, skipped = filter_pages(pages)
+    assert [p[:2] for p in kept] == [("report.pdf", 1)]
+    assert skipped == []
+
+def test_empty_page_is_blank():
+    pages = [("scan.pdf", 2, png(Image.new("L", A4, 250)))]
+    kept, skipped = filter_pages(pages)
+    assert kept == []
+    assert skipped == [{"filename": "scan.pdf", "page": 2, "reason": "blank"}]
+
+def test_noisy_blank_page_is_blank():
+    pages = [("scan.pdf", 2, png(noisy(Image.new("L", A4, 250), 6)))]
+    kept, skipped = filter_pages(pages)
+    assert kept == []
+    assert [s["reason"] for s in skipped] == ["blank"]
+
+def test_jpeg_blank_page_is_blank():
+    # noise plus JPEG ringing, on paper that is darker on one side (uneven lighting)
+    shade = np.tile(np.linspace(232, 250, A4[0]), (A4[1], 1)).astype(np.uint8)
+    pages = [("photo.jpg", 1, png(noisy(Image.fromarray(shade), 3), "JPEG", quality=70))]
+    kept, skipped = filter_pages(pages)
+    assert kept == []
+    assert [s["reason"] for s in skipped] == ["blank"]
+
+def test_one_short_row_is_kept():
+    pages = [("report.pdf", 1, page(["Hb   135   g/L"]))]
+    kept, skipped = filter_pages(pages)
+    assert [p[:2] for p in kept] == [("report.pdf", 1)]
+    assert skipped == []
+
+def test_one_row_jpeg_scan_is_kept():
+    img = noisy(draw(["Glucose   5.4   mmol/L   3.9 - 6.1"]), 3)
+    kept, skipped = filter_pages([("scan.jpg", 1, png(img, "JPEG", quality=70))])
+    assert [p[:2] for p in kept] == [("scan.jpg", 1)]
+    assert skipped == []
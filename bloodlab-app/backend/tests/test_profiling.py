@@ -0,0 +1,82 @@
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import ProfileMiddleware, ProfileStore, RequestProfile, admin_ok, fold, profiled
+
+@profiled
+def busy_work(n: int) -> int:
+    total = 0
+    for i in range(n):
+        total += i * i % 7
+    return total
+
+@pytest.fixture
+def store(tmp_path):
+    return ProfileStore(str(tmp_path / "profiles"), keep=3)
+
+def make_client(store, sample_rate=0.0):
+    app = FastAPI()
+
+    @app.post("/api/work")
+    def work():
+        return {"total": busy_work(300_000)}
+
+    @app.get("/api/health")
+    def health():
+        return {"ok": True}
+
+    app.add_middleware(ProfileMiddleware, store=store, admin_token="s3cret-admin", sample_rate=sample_rate,
+                       interval_s=0.001)
+    return TestClient(app)
+
+def test_admin_header_profiles_the_request(store):
+    r = make_client(store).post("/api/work", headers={"X-Profile": "1", "X-Admin-Token": "s3cret-admin"})
+    profile_id = r.headers["X-Profile-Id"]
+    [meta] = store.list()
+    assert meta["id"] == profile_id and meta["reason"] == "header" and meta["path"] == "/api/work"
+    assert meta["cpu_s"] > 0
+    with open(store.folded_path(profile_id), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert any("test_profiling.py:busy_work" in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+@pytest.mark.parametrize("headers", [{"X-Profile": "1"}, {"X-Profile": "1", "X-Admin-Token": "wrong"}])
+def test_no_profile_without_the_admin_token(store, headers):
+    r = make_client(store).post("/api/work", headers=headers)
+    assert "X-Profile-Id" not in r.headers
+    assert store.list() == []
+
+def test_sampling_covers_pipeline_posts_only(store):
+    client = make_client(store, sample_rate=1.0)
+    assert "X-Profile-Id" in client.post("/api/work").headers
+    assert "X-Profile-Id" not in client.get("/api/health").headers
+    assert [m["reason"] for m in store.list()] == ["sampled"]
+
+def test_store_keeps_the_newest(store):
+    client = make_client(store, sample_rate=1.0)
+    ids = [client.post("/api/work").headers["X-Profile-Id"] for _ in range(5)]
+    assert [m["id"] for m in store.list()] == ids[:-4:-1]
+    assert store.folded_path(ids[0]) is None
+
+def test_folded_path_rejects_path_tricks(store):
+    assert store.folded_path("../../etc/passwd") is None
+
+def test_profiled_is_transparent_without_a_profile():
+    assert busy_work(10) == sum(i * i % 7 for i in range(10))
+
+def test_fold_is_root_first():
+    stack = fold(sys._getframe())
+    assert stack.endswith("test_profiling.py:test_fold_is_root_first")
+
+def test_profile_meta_before_any_work():
+    prof = RequestProfile("POST", "/api/x", "header", interval_s=0.001)
+    prof.stop()
+    assert prof.meta()["samples"] == 0 and prof.stacks == {}
+
+@pytest.mark.parametrize("token, admin, ok", [("a", "a", True), ("a", "b", False), (None, "a", False),
+                                              ("a", None, False), ("", "", False)])
+def test_admin_ok(token, admin, ok):
+    assert admin_ok(token, admin) is ok
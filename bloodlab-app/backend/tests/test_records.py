@@ -0,0 +1,22 @@
+import pytest
+
+from main import Measurement, Row, to_measurements
+from records import FIELDS
+
+def test_row_fields_match_the_api_model():
+    assert set(FIELDS) == set(Measurement.model_fields)
+
+def test_row_has_no_instance_dict():
+    r = Row(name="Glucose", value="5.4")
+    with pytest.raises(AttributeError):
+        r.extra = 1
+    assert not hasattr(r, "__dict__")
+
+def test_dict_round_trip():
+    d = {k: None for k in FIELDS} | {"name": "Glucose", "value": "5.4", "unit": "mmol/L", "page": 2, "norm_value": 5.4}
+    assert Row.from_dict(d).as_dict() == d
+    assert Row.from_dict({"name": "Glucose", "value": "5.4"}).unit is None
+
+def test_api_boundary_builds_the_same_model_as_validation():
+    r = Row(name="Glucose", value="5.4", unit="mmol/L", ref_low=3.9, ref_high=6.1, flag="normal")
+    assert to_measurements([r])[0].model_dump() == Measurement(**r.as_dict()).model_dump()
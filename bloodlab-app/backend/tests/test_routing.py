@@ -0,0 +1,38 @@
+import io
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from routing import MIN_CONTRAST, MIN_SHARPNESS, score_page
+
+A4 = (2480, 3508)      # 300 dpi
+
+def page(lines, fill=20, paper=250, blur=0.0) -> bytes:
+    img = Image.new("L", A4, paper)
+    d = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=36)
+    for i, text in enumerate(lines):
+        d.text((200, 400 + i * 60), text, fill=fill, font=font)
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(blur))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def test_sparse_page_is_not_low_contrast():
+    # one result line: the 1st percentile of the whole page is paper
+    r = score_page(page(["Glucose   5.4   mmol/L   3.9 - 6.1"]))
+    assert r["features"]["contrast"] >= MIN_CONTRAST
+    assert r["features"]["sharpness"] >= MIN_SHARPNESS
+    assert r["reasons"] == []
+
+def test_sparse_and_full_pages_score_alike():
+    sparse = score_page(page(["Glucose   5.4   mmol/L   3.9 - 6.1"]))["features"]
+    full = score_page(page([f"Analyte {i}   5.{i}   mmol/L   3.9 - 6.1" for i in range(40)]))["features"]
+    assert abs(sparse["contrast"] - full["contrast"]) < 0.1
+    assert abs(sparse["sharpness"] - full["sharpness"]) < 0.2 * full["sharpness"]
+
+def test_faint_and_blurred_pages_go_to_the_strong_model():
+    faint = score_page(page([f"Analyte {i}   5.{i}" for i in range(30)], fill=165, paper=200))
+    assert "low_contrast" in faint["reasons"]
+    blurred = score_page(page([f"Analyte {i}   5.{i}" for i in range(30)], blur=6))
+    assert "blurry" in blurred["reasons"] and blurred["tier"] == "strong"
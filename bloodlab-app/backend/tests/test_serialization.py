@@ -0,0 +1,30 @@
+import json
+
+from main import ParseResponse, Row, to_measurements
+from serialization import FastJSONResponse, compact, dumps
+
+ROWS = [Row(name="Гемоглобин", value="135", unit="g/L", ref_low=120.0, ref_high=160.0, flag="normal",
+            source_file="report.pdf", page=1),
+        Row(name="Glucose", value="5.4")]
+
+def test_dumps_matches_pydantic_model_dump():
+    resp = ParseResponse.model_construct(measurements=to_measurements(ROWS), notes="Processed 1 pages",
+                                         composites=[], status="complete")
+    assert json.loads(dumps(resp)) == ParseResponse.model_validate(resp.model_dump()).model_dump(mode="json")
+
+def test_non_ascii_is_kept_as_utf8():
+    assert "Гемоглобин".encode("utf-8") in dumps({"m": ROWS[0]})
+
+def test_rows_and_models_encode_alike():
+    assert json.loads(dumps(ROWS[0])) == json.loads(dumps(to_measurements(ROWS[:1])[0]))
+
+def test_compact_drops_only_none():
+    assert compact(ROWS[1]) == {"name": "Glucose", "value": "5.4"}
+    assert compact(to_measurements(ROWS[:1])[0])["ref_low"] == 120.0
+
+def test_fast_response_is_valid_against_the_response_model(client, fake_model, result_page):
+    r = client.post("/api/process", files={"files": ("report.png", result_page, "image/png")})
+    assert r.headers["content-type"] == "application/json"
+    resp = ParseResponse.model_validate(r.json())
+    assert [m.name for m in resp.measurements] == ["Glucose (fasting)"]
+    assert FastJSONResponse(resp).body == dumps(resp)
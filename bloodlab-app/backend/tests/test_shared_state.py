@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+
+import pytest
+
+from deadlines import Cancelled, Deadline
+from shared_state import SharedState
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "shared.sqlite3")
+
+# ---------- result cache ----------
+def test_cache_is_shared_by_every_instance_on_the_file(path):
+    a, b = SharedState(path, cache_ttl_s=60), SharedState(path, cache_ttl_s=60)
+    a.put("ocr", "k", {"measurements": [{"name": "Glucose"}]})
+    assert b.get("ocr", "k") == {"measurements": [{"name": "Glucose"}]}
+    assert b.get("summary", "k") is None                    # namespaces are separate
+    assert b.snapshot()["process"]["ocr_hits"] == 1
+
+def test_cache_entries_expire(path):
+    s = SharedState(path, cache_ttl_s=0.05)
+    s.put("ocr", "k", 1)
+    time.sleep(0.06)
+    assert s.get("ocr", "k") is None
+
+def test_ttl_zero_disables_the_cache(path):
+    s = SharedState(path, cache_ttl_s=0)
+    s.put("ocr", "k", 1)
+    assert s.get("ocr", "k") is None
+
+# ---------- provider limits ----------
+def test_concurrency_slots_hold_across_instances(path):
+    a, b = SharedState(path), SharedState(path)
+    ok, slot, _ = a.try_acquire("google", concurrency=1)
+    assert ok and slot
+    assert b.try_acquire("google", concurrency=1)[0] is False
+    a.release(slot)
+    assert b.try_acquire("google", concurrency=1)[0] is True
+
+def test_slot_of_a_crashed_process_frees_itself(path):
+    s = SharedState(path)
+    assert s.try_acquire("google", concurrency=1, hold_s=0.05)[0]
+    time.sleep(0.06)
+    assert s.try_acquire("google", concurrency=1)[0]
+
+def test_rpm_bucket_limits_the_call_rate(path):
+    s = SharedState(path)
+    burst = 2                                               # rpm 12 -> 10 s of quota = 2 calls
+    assert all(s.try_acquire("openai", rpm=12)[0] for _ in range(burst))
+    ok, _, wait = s.try_acquire("openai", rpm=12)
+    assert not ok and 0 < wait <= 5.0
+
+def test_backoff_pauses_every_instance(path):
+    a, b = SharedState(path), SharedState(path)
+    a.backoff("google", 30)
+    ok, _, wait = b.try_acquire("google")
+    assert not ok and 29 < wait <= 30
+    assert b.snapshot()["paused"]["google"] == pytest.approx(30, abs=1)
+
+def test_acquire_gives_up_when_the_deadline_passes(path):
+    s = SharedState(path)
+    s.backoff("google", 30)
+    t0 = time.monotonic()
+    with pytest.raises(Cancelled):
+        s.acquire("google", check=Deadline(0.2).check)
+    assert time.monotonic() - t0 < 1.5
+
+def _hold_slot(path, out):
+    s = SharedState(path)
+    slot = s.acquire("google", concurrency=1)
+    start = time.time()
+    time.sleep(0.2)
+    out.put((start, time.time()))
+    s.release(slot)
+
+def test_concurrency_limit_holds_across_processes(path):
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_hold_slot, args=(path, out)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    spans = sorted(out.get(timeout=10) for _ in procs)
+    for p in procs:
+        p.join(5)
+    assert all(prev[1] <= nxt[0] + 0.01 for prev, nxt in zip(spans, spans[1:]))     # never two at once
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from deadlines import Cancelled, Deadline
+from singleflight import SingleFlight
+
+def start_leader(flight, key="k", result="rows", error=None):
+    """Leader call that blocks until release is set; returns (release, thread, box)."""
+    release, box = threading.Event(), {}
+
+    def fn():
+        release.wait(5)
+        if error:
+            raise error
+        return result
+
+    def run():
+        try:
+            box["result"] = flight.do(key, fn)
+        except Exception as e:
+            box["error"] = e
+
+    t = threading.Thread(target=run)
+    t.start()
+    while not flight.in_flight(key):
+        time.sleep(0.001)
+    return release, t, box
+
+def test_followers_share_the_leaders_call():
+    flight = SingleFlight()
+    release, t, box = start_leader(flight)
+    calls = []
+    follower = threading.Thread(target=lambda: calls.append(flight.do("k", lambda: "own call")))
+    follower.start()
+    release.set()
+    t.join()
+    follower.join()
+    assert box["result"] == "rows"
+    assert calls == ["rows"]
+    assert not flight.in_flight("k")
+
+def test_leader_error_reaches_followers():
+    flight = SingleFlight()
+    release, t, box = start_leader(flight, error=ValueError("bad json"))
+    errors = []
+
+    def follow():
+        try:
+            flight.do("k", lambda: "own call")
+        except ValueError as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    release.set()
+    t.join()
+    follower.join()
+    assert isinstance(box["error"], ValueError) and len(errors) == 1
+
+def test_follower_stops_at_its_own_deadline():
+    flight = SingleFlight()
+    release, t, _ = start_leader(flight)
+    started = time.monotonic()
+    with pytest.raises(Cancelled) as exc:
+        flight.do("k", lambda: "own call", Deadline(0.2))
+    assert exc.value.reason == "deadline"
+    assert time.monotonic() - started < 1.0
+    assert flight.in_flight("k")          # the leader keeps going
+    release.set()
+    t.join()
+
+def test_follower_notices_cancellation():
+    flight = SingleFlight()
+    release, t, _ = start_leader(flight)
+    deadline = Deadline()
+    threading.Timer(0.1, deadline.cancel).start()
+    with pytest.raises(Cancelled) as exc:
+        flight.do("k", lambda: "own call", deadline)
+    assert exc.value.reason == "cancelled"
+    release.set()
+    t.join()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+import main
+
+def sse_events(body: str):
+    """[(id, event, data)] of an SSE body."""
+    out = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((int(fields["id"]) if "id" in fields else None, fields["event"], json.loads(fields["data"])))
+    return out
+
+def stream(client, pages):
+    files = [("files", (f"p{i}.png", png, "image/png")) for i, png in enumerate(pages, start=1)]
+    r = client.post("/api/process/stream", files=files)
+    assert r.status_code == 200
+    return r.headers["X-Stream-Id"], sse_events(r.text)
+
+@pytest.fixture
+def three_pages(page_png):
+    # different row counts, so the prefilter does not take them for duplicates
+    return [page_png([f"Analyte {k}   {n}.{k}   mmol/L" for k in range(4 * n)]) for n in (1, 2, 3)]
+
+def test_all_pages_ok_is_complete(client, fake_model, three_pages):
+    _, events = stream(client, three_pages)
+    done = events[-1][2]
+    assert events[-1][1] == "done"
+    assert done["status"] == "complete"
+    assert "skip" not in [e for _, e, _ in events]
+
+def test_model_error_on_one_page_is_partial(client, fake_model, three_pages):
+    fake_model.pages = {2: RuntimeError("upstream 500")}
+    _, events = stream(client, three_pages)
+    skips = [d for _, e, d in events if e == "skip"]
+    assert skips == [{"filename": "p2.png#2", "page": 1, "reason": "ocr_failed"}]
+    assert events[-1][2]["status"] == "partial"
+    assert [d["filename"] for _, e, d in events if e == "page"] == ["p1.png#1", "p3.png#3"]
+
+def test_unexpected_error_on_one_page_is_partial(client, fake_model, three_pages, monkeypatch):
+    rows_from_ocr = main.rows_from_ocr
+
+    def broken(data_json, filename, page_num):
+        if filename == "p2.png#2":
+            raise KeyError("measurements")
+        return rows_from_ocr(data_json, filename, page_num)
+
+    monkeypatch.setattr(main, "rows_from_ocr", broken)
+    _, events = stream(client, three_pages)
+    skips = [d for _, e, d in events if e == "skip"]
+    assert skips == [{"filename": "p2.png#2", "page": 1, "reason": "error"}]
+    assert events[-1][2]["status"] == "partial"
+    assert events[-1][2]["count"] == 1
+
+# ---------- resume (Last-Event-ID) ----------
+def test_resume_replays_events_after_last_event_id(client, fake_model, three_pages):
+    stream_id, events = stream(client, three_pages)
+    calls = fake_model.calls
+    assert [i for i, _, _ in events] == list(range(1, len(events) + 1))
+
+    r = client.get(f"/api/process/stream/{stream_id}", headers={"Last-Event-ID": "3"})
+    assert r.status_code == 200
+    assert sse_events(r.text) == events[3:]
+    assert fake_model.calls == calls          # replayed from the session, no new model calls
+
+    r = client.get(f"/api/process/stream/{stream_id}", params={"after": len(events) - 1})
+    assert [e for _, e, _ in sse_events(r.text)] == ["done"]
+
+def test_resume_with_a_bad_last_event_id_replays_everything(client, fake_model, three_pages):
+    stream_id, events = stream(client, three_pages)
+    r = client.get(f"/api/process/stream/{stream_id}", headers={"Last-Event-ID": "garbage"})
+    assert sse_events(r.text) == events
+
+def test_resume_unknown_stream_is_404(client):
+    assert client.get("/api/process/stream/nope").status_code == 404
+
+def test_follower_gets_live_frames_after_its_replay():
+    from streams import StreamRegistry
+
+    async def run():
+        reg = StreamRegistry(lambda e, d, i: f"{i}:{e}".encode())
+        s = reg.create()
+        s.emit("meta", {})
+        s.emit("page", {})
+
+        async def produce():
+            await asyncio.sleep(0.01)
+            s.emit("done", {})
+            s.close()
+
+        producer = asyncio.create_task(produce())
+        got = [f async for f in s.follow(after=1)]
+        await producer
+        return got, s.followers
+
+    got, followers = asyncio.run(run())
+    assert got == [b"2:page", b"3:done"]
+    assert followers == 0
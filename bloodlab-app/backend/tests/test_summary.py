@@ -0,0 +1,95 @@
+import threading
+
+import main
+
+REPORT = {"measurements": [
+    {"name": "Hemoglobin", "value": "135", "unit": "g/L", "ref_low": 120, "ref_high": 160},
+    {"name": "Glucose (fasting)", "value": "7.2", "unit": "mmol/L", "ref_low": 3.9, "ref_high": 6.1},
+    {"name": "Sodium (Na)", "value": "140", "unit": "mmol/L", "ref_low": 135, "ref_high": 145},
+]}
+
+def summarize(client, mode, report=REPORT, locale="en"):
+    r = client.post("/api/summary", json={"report": report, "mode": mode, "locale": locale})
+    assert r.status_code == 200
+    return r.json()
+
+def is_section(system):
+    return system == main.SECTION_SYSTEM
+
+# ---------- mode=parallel ----------
+def test_sections_are_written_concurrently(client, fake_openai):
+    n = len(main.grade_sections([main.Row.from_dict(m) for m in REPORT["measurements"]]))
+    assert n > 1
+    barrier = threading.Barrier(n, timeout=5)       # only passes if all sections are in flight together
+
+    def reply(system, user):
+        if is_section(system):
+            barrier.wait()
+        return "section text" if is_section(system) else "final text"
+
+    fake_openai.reply = reply
+    out = summarize(client, "parallel")
+    assert out["model"] == main.SUMMARY_MODEL
+    assert sum(is_section(s) for s, _ in fake_openai.calls) == n
+    assert out["usage"]["calls"] == n + 1
+
+def test_sections_keep_template_order(client, fake_openai):
+    fake_openai.reply = lambda system, user: user.split("\n", 1)[0] if is_section(system) else "final text"
+    md = summarize(client, "parallel")["summary_md"]
+    keys = list(main.grade_sections([main.Row.from_dict(m) for m in REPORT["measurements"]]))
+    assert len(keys) > 1
+    pos = [md.index(main.heading(k, "en")) for k in keys]
+    assert pos == sorted(pos)
+    assert md.rstrip().endswith("final text")
+
+def test_each_section_sees_only_its_measurements(client, fake_openai):
+    summarize(client, "parallel")
+    section_prompts = [u for s, u in fake_openai.calls if is_section(s)]
+    assert sum("Glucose (fasting)" in u for u in section_prompts) == 1
+    assert all(u.count('"name"') == 1 for u in section_prompts)
+
+def test_a_failed_section_is_rendered_locally(client, fake_openai):
+    fake_openai.reply = lambda system, user: (RuntimeError("503") if is_section(system) and "Glucose" in user
+                                              else "model text")
+    out = summarize(client, "parallel")
+    assert out["model"] == f"local+{main.SUMMARY_MODEL}"
+    assert "Glucose" in out["summary_md"] or "7.2" in out["summary_md"]
+
+def test_without_openai_parallel_falls_back_to_local(client, monkeypatch):
+    monkeypatch.setattr(main, "openai_client", None)
+    assert summarize(client, "parallel")["model"] == "local"
+
+# ---------- prompt layout for provider prompt caching ----------
+def other_report():
+    return {"measurements": [dict(m, value="99") for m in REPORT["measurements"]]}
+
+def test_full_summary_prompts_share_a_stable_prefix(client, fake_openai):
+    summarize(client, "llm")
+    summarize(client, "llm", other_report(), locale="ru")
+    (s1, u1), (s2, u2) = fake_openai.calls
+    assert s1 == s2 == main.SUMMARY_SYSTEM
+    assert u1.startswith(main.SUMMARY_DB_BLOCK) and u2.startswith(main.SUMMARY_DB_BLOCK)
+    # everything request-specific comes after the DB block
+    assert u1[len(main.SUMMARY_DB_BLOCK):].startswith("2) Final extracted report")
+
+def test_db_block_is_byte_identical_across_reloads():
+    block = main.SUMMARY_DB_BLOCK
+    main.load_db()
+    assert main.SUMMARY_DB_BLOCK == block
+
+def test_cached_tokens_are_reported(client, fake_openai):
+    before = main.summary_usage.snapshot().get("full", {}).get("cached_tokens", 0)
+    fake_openai.cached_tokens = 1024
+    out = summarize(client, "llm")
+    assert out["usage"]["cached_tokens"] == 1024
+    assert main.summary_usage.snapshot()["full"]["cached_tokens"] - before == 1024
+    assert client.get("/api/summary/usage").json()["full"]["calls"] >= 1
+
+def test_usage_counts_reads_cached_tokens_from_old_and_new_sdks():
+    from types import SimpleNamespace as NS
+    from llm_usage import usage_counts
+    new = NS(usage=NS(prompt_tokens=2000, completion_tokens=50, prompt_tokens_details=NS(cached_tokens=1536)))
+    old = NS(usage=NS(prompt_tokens=2000, completion_tokens=50, prompt_tokens_details={"cached_tokens": 1536}))
+    assert usage_counts(new) == usage_counts(old) == {"prompt_tokens": 2000, "cached_tokens": 1536,
+                                                      "completion_tokens": 50}
+    assert usage_counts(NS(usage=None)) == {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
@@ -0,0 +1,107 @@
+import io
+import json
+import threading
+
+import pytest
+
+from tracing import (RequestIdStream, Tracer, annotate, current_request_id, parse_traceparent, span, trace_id_for,
+                     traced)
+
+def spans(out: io.StringIO):
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+@pytest.fixture
+def tracer():
+    return Tracer("test", out=io.StringIO())
+
+def test_span_outside_a_request_is_a_no_op(tracer):
+    with span("page", page=1) as attrs:
+        attrs["x"] = 1
+        annotate(cache="hit")
+    assert current_request_id() is None
+    assert tracer.out.getvalue() == ""
+
+def test_child_spans_share_the_request_and_link_to_parent(tracer):
+    with tracer.request("req-1", "POST /api/process"):
+        assert current_request_id() == "req-1"
+        with span("page", page=2) as attrs:
+            attrs["rows"] = 7
+            annotate(cache="miss")
+    assert current_request_id() is None
+    child, root = spans(tracer.out)          # written as each span finishes
+    assert (child["span"], root["span"]) == ("page", "POST /api/process")
+    assert child["request_id"] == root["request_id"] == "req-1"
+    assert child["trace_id"] == root["trace_id"] == trace_id_for("req-1")
+    assert child["parent_id"] == root["span_id"] and root["parent_id"] is None
+    assert (child["page"], child["rows"], child["cache"]) == (2, 7, "miss")
+    assert child["status"] == root["status"] == "ok"
+
+def test_error_is_recorded_and_reraised(tracer):
+    with pytest.raises(ValueError):
+        with tracer.request("req-2", "job"), span("ocr"):
+            raise ValueError("bad page")
+    child, root = spans(tracer.out)
+    assert child["status"] == root["status"] == "error"
+    assert child["error"] == "ValueError: bad page"
+
+def test_traced_decorator(tracer):
+    @traced("summary")
+    def summarise(x):
+        annotate(n=x)
+        return x * 2
+
+    assert summarise(2) == 4                 # untraced call: no span
+    with tracer.request("req-3", "GET /"):
+        assert summarise(3) == 6
+    child, _ = spans(tracer.out)
+    assert (child["span"], child["n"]) == ("summary", 3)
+
+def test_ids_follow_the_context_not_the_thread(tracer):
+    seen = {}
+
+    def worker(rid):
+        with tracer.request(rid, "job"):
+            seen[rid] = current_request_id()
+
+    threads = [threading.Thread(target=worker, args=(f"job-{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen == {f"job-{i}": f"job-{i}" for i in range(4)}
+
+def test_trace_ids_and_traceparent():
+    tid = "0af7651916cd43dd8448eb211c80319c"
+    assert trace_id_for(tid) == tid
+    assert len(trace_id_for("abc")) == 32 and trace_id_for("abc") == trace_id_for("abc")
+    assert parse_traceparent(f"00-{tid}-b7ad6b7169203331-01") == (tid, "b7ad6b7169203331")
+    assert parse_traceparent("garbage") == (None, None)
+    assert parse_traceparent(None) == (None, None)
+
+def test_log_lines_get_the_request_prefix(tracer):
+    inner = io.StringIO()
+    stream = RequestIdStream(inner)
+    stream.write("before\n")
+    with tracer.request("req-4", "job"):
+        stream.write("one\ntwo")
+        stream.write(" more\n")
+    assert inner.getvalue() == "before\n[req-4] one\n[req-4] two more\n"
+
+def test_request_id_header_round_trip(client, monkeypatch):
+    import main
+    out = io.StringIO()
+    monkeypatch.setattr(main.tracer, "log", True)
+    monkeypatch.setattr(main.tracer, "out", out)
+
+    r = client.get("/api/health", headers={"X-Request-Id": "client-42"})
+    assert r.headers["x-request-id"] == "client-42"
+    root = spans(out)[-1]
+    assert (root["request_id"], root["span"], root["http.status_code"]) == ("client-42", "GET /api/health", 200)
+
+    r = client.get("/api/health", headers={"X-Request-Id": "not valid!"})
+    assert r.headers["x-request-id"] != "not valid!" and len(r.headers["x-request-id"]) == 16
+
+    tid = "0af7651916cd43dd8448eb211c80319c"
+    client.get("/api/health", headers={"traceparent": f"00-{tid}-b7ad6b7169203331-01"})
+    root = spans(out)[-1]
+    assert (root["trace_id"], root["parent_id"]) == (tid, "b7ad6b7169203331")
@@ -0,0 +1,50 @@
+import pytest
+
+import main
+from main import Row, value_to_number
+from units import compile_registry, norm_unit, normalize_rows, unit_factor
+
+@pytest.mark.parametrize("raw, norm", [
+    ("x10^9/L", "10^9/l"), ("10*9/l", "10^9/l"), ("×10⁹/л", "10^9/l"),
+    ("umol/L", "µmol/l"), ("μmol/l", "µmol/l"), ("мкмоль/л", "µmol/l"),
+    ("mcg/L", "µg/l"), ("cells/mm3", "/µl"), ("г/дл", "g/dl"), ("", ""), (None, ""),
+])
+def test_unit_spellings_normalize(raw, norm):
+    assert norm_unit(raw) == norm
+
+def normalized(name, value, unit):
+    r = Row(name=name, value=value, unit=unit)
+    normalize_rows([r], main.UNIT_REGISTRY, value_to_number)
+    return r.norm_value, r.norm_unit
+
+@pytest.mark.parametrize("name, value, unit, expected", [
+    ("Hemoglobin", "13.5", "g/dL", (135.0, "g/L")),
+    ("Glucose (fasting)", "90", "mg/dL", (pytest.approx(4.995559), "mmol/L")),
+    ("Creatinine", "0.9", "mg/dL", (pytest.approx(79.56), "µmol/L")),
+    ("Platelets", "250000", "/µl", (250.0, "10^9/L")),
+    ("Platelets", "250", "G/L", (250.0, "10^9/L")),
+    ("Hemoglobin", "135", None, (135.0, "g/L")),      # no unit: taken as the DB unit
+])
+def test_rows_are_normalized_to_the_db_unit(name, value, unit, expected):
+    assert normalized(name, value, unit) == expected
+
+def test_unknown_unit_or_value_is_left_alone():
+    assert normalized("Hemoglobin", "135", "furlongs") == (None, None)
+    assert normalized("Hemoglobin", "see note", "g/L") == (None, None)
+    assert normalized("Not in the DB", "1", "g/L") == (None, None)
+
+def test_printed_value_and_unit_are_kept():
+    r = Row(name="Hemoglobin", value="13,5", unit="g/dL")
+    assert normalize_rows([r], main.UNIT_REGISTRY, value_to_number) == 1
+    assert (r.value, r.unit, r.norm_value) == ("13,5", "g/dL", 135.0)
+
+def test_spellings_are_resolved_per_metric():
+    reg = compile_registry([
+        {"canonical_name": "Platelets", "unit": "G/L"},
+        {"canonical_name": "Hemoglobin", "unit": "g/L"},
+        {"canonical_name": "Comment"},                     # no unit: not in the registry
+    ])
+    assert unit_factor(reg, "Platelets", "/µl") == 1e-3    # G/L means giga-cells here
+    assert unit_factor(reg, "Hemoglobin", "g/dl") == 10    # and grams here
+    assert unit_factor(reg, "Hemoglobin", "/µl") is None
+    assert unit_factor(reg, "Comment", None) is None
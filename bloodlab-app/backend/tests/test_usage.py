@@ -0,0 +1,68 @@
+import pytest
+
+import main
+from llm_usage import RequestUsage, UsageStats, cost_usd
+
+TOKENS = {"prompt_tokens": 600, "cached_tokens": 0, "completion_tokens": 100}
+
+@pytest.fixture
+def billed(monkeypatch, fake_model):
+    """Every model call costs 700 tokens; pages as uploaded, so each file is one page."""
+    monkeypatch.setattr(main, "genai_usage_counts", lambda resp: dict(TOKENS))
+    monkeypatch.setattr(main, "prepare_pages",
+                        lambda files, mem=None: ([(name, 1, raw) for name, _, raw, _ in files], []))
+    monkeypatch.setattr(main, "client_usage", UsageStats(max_kinds=2))
+    return fake_model
+
+def upload(n):
+    return [("files", (f"p{i}.png", f"page {i}".encode(), "image/png")) for i in range(1, n + 1)]
+
+def test_request_usage_budget_and_ledger():
+    ledger = UsageStats()
+    u = RequestUsage(1000, "lab-a", ledger)
+    u.add("gpt-4o-mini", TOKENS)
+    assert not u.exhausted
+    u.add("gpt-4o-mini", TOKENS)
+    assert u.exhausted and u.total_tokens == 1400
+    assert u.as_dict()["cost_usd"] == round(2 * cost_usd("gpt-4o-mini", TOKENS), 6)
+    assert ledger.snapshot()["lab-a"]["calls"] == 2
+    assert not RequestUsage(0).exhausted                      # 0 = no cap
+
+def test_cached_tokens_are_cheaper():
+    cached = dict(TOKENS, cached_tokens=600)
+    assert cost_usd("gpt-4o-mini", cached) < cost_usd("gpt-4o-mini", TOKENS)
+    assert cost_usd("some-unpriced-model", TOKENS) == 0.0
+
+def test_ledger_caps_distinct_clients():
+    ledger = UsageStats(max_kinds=2)
+    for client in ("a", "b", "c", "d"):
+        ledger.record(client, TOKENS, 0.1)
+    assert set(ledger.snapshot()) == {"a", "b", UsageStats.OTHER}
+    assert ledger.snapshot()[UsageStats.OTHER]["calls"] == 2
+    assert ledger.total()["calls"] == 4
+
+def test_budget_cuts_off_remaining_pages(client, billed):
+    r = client.post("/api/process", files=upload(3), data={"token_budget": "1000"})
+    body = r.json()
+    assert billed.calls == 2                                  # the second call crossed the budget
+    assert body["status"] == "partial" and "p3.png p1 (token_budget)" in body["notes"]
+    assert body["usage"]["total_tokens"] == 1400 and body["usage"]["budget_tokens"] == 1000
+    assert r.headers["X-Result-Status"] == "partial" and r.headers["X-Usage-Tokens"] == "1400"
+
+def test_server_budget_caps_a_larger_client_budget(client, billed, monkeypatch):
+    monkeypatch.setattr(main.settings, "REQUEST_TOKEN_BUDGET", 500)
+    body = client.post("/api/process", files=upload(3), data={"token_budget": "5000"}).json()
+    assert billed.calls == 1 and body["usage"]["budget_tokens"] == 500
+
+def test_no_budget_processes_every_page(client, billed):
+    body = client.post("/api/process", files=upload(3)).json()
+    assert billed.calls == 3 and body["status"] == "complete"
+
+def test_per_client_usage_needs_the_admin_token(client, billed, monkeypatch):
+    monkeypatch.setattr(main.settings, "ADMIN_TOKEN", "s3cret-admin")
+    client.post("/api/process", files=upload(1), headers={"X-Client-Id": "lab-a"})
+    assert "clients" not in client.get("/api/usage").json()
+    assert "clients" not in client.get("/api/usage", headers={"X-Admin-Token": "wrong"}).json()
+    usage = client.get("/api/usage", headers={"X-Admin-Token": "s3cret-admin"}).json()
+    assert usage["clients"]["lab-a"]["calls"] == 1
+    assert usage["total"]["prompt_tokens"] == 600
@@ -0,0 +1,261 @@
+import contextvars
+import functools
+import hashlib
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+
+# Request tracing. Every request gets an id (X-Request-Id, or generated) that
+# follows it through threads via context variables. Pipeline steps run inside
+# span()s; each finished span is one JSON line on stdout and, optionally, goes
+# to an OTLP/JSON exporter (a file for the collector's otlpjsonfile receiver, or
+# an OTLP/HTTP endpoint). Existing print() lines made while serving a request
+# are prefixed with "[<request id>]". Outside a request span() does nothing.
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+def trace_id_for(request_id: str) -> str:
+    """32-hex OTLP trace id; a request id that already is one is kept."""
+    if re.fullmatch(r"[0-9a-f]{32}", request_id):
+        return request_id
+    return hashlib.sha256(request_id.encode("utf-8")).hexdigest()[:32]
+
+def parse_traceparent(value: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """W3C traceparent -> (trace id, parent span id), or (None, None)."""
+    m = TRACEPARENT_RE.match((value or "").strip())
+    return (m.group(1), m.group(2)) if m else (None, None)
+
+class Span:
+    __slots__ = ("tracer", "request_id", "trace_id", "span_id", "parent_id", "name", "kind",
+                 "attrs", "start_ns", "_t0")
+
+    def __init__(self, tracer: "Tracer", request_id: str, trace_id: str, parent_id: Optional[str],
+                 name: str, attrs: Dict[str, Any], kind: int = 1):
+        self.tracer = tracer
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind                  # OTLP SpanKind: 1 internal, 2 server
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self._t0 = time.perf_counter()
+
+@contextmanager
+def _run_span(s: Span):
+    token = _current.set(s)
+    error: Optional[BaseException] = None
+    try:
+        yield s.attrs
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        s.tracer.finish(s, time.perf_counter() - s._t0, error)
+
+@contextmanager
+def span(name: str, **attrs):
+    """Timed child span of the current one; yields its attribute dict (add to it freely)."""
+    parent = _current.get()
+    if parent is None:
+        yield attrs
+        return
+    with _run_span(Span(parent.tracer, parent.request_id, parent.trace_id, parent.span_id, name, attrs)) as a:
+        yield a
+
+def annotate(**attrs):
+    """Add attributes to the current span (no-op outside a traced request)."""
+    s = _current.get()
+    if s is not None:
+        s.attrs.update(attrs)
+
+def traced(name: str):
+    """Decorator: run the function inside span(name)."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def current_request_id() -> Optional[str]:
+    s = _current.get()
+    return s.request_id if s is not None else None
+
+class Tracer:
+    def __init__(self, service: str = "bloodlab-api", log: bool = True, otlp: Optional[str] = None,
+                 out=None):
+        self.service = service
+        self.log = log
+        self.out = out or sys.stdout
+        self.exporter = OtlpExporter(otlp, service) if otlp else None
+
+    def request(self, request_id: str, name: str, trace_id: Optional[str] = None,
+                parent_id: Optional[str] = None, kind: int = 2, **attrs):
+        """Root span of one request / job; everything inside it carries request_id."""
+        return _run_span(Span(self, request_id, trace_id or trace_id_for(request_id), parent_id, name, attrs, kind))
+
+    def finish(self, s: Span, seconds: float, error: Optional[BaseException]):
+        if self.log:
+            line = {
+                "ts": datetime.fromtimestamp(s.start_ns / 1e9, timezone.utc).isoformat(timespec="milliseconds"),
+                "request_id": s.request_id, "span": s.name, "ms": round(seconds * 1000, 1),
+                "trace_id": s.trace_id, "span_id": s.span_id, "parent_id": s.parent_id,
+                "status": "error" if error is not None else "ok", **s.attrs,
+            }
+            if error is not None:
+                line["error"] = f"{type(error).__name__}: {error}"
+            self.out.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        if self.exporter is not None:
+            self.exporter.add(s, s.start_ns + int(seconds * 1e9), error)
+
+# ---------- OTLP/JSON export ----------
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+class OtlpExporter:
+    """
+    Batches finished spans into ExportTraceServiceRequest JSON and ships them from
+    a background thread: appended as one line per batch to a file, or POSTed to
+    an OTLP/HTTP endpoint (http(s)://.../v1/traces). Export failures are logged
+    and the batch dropped; they never reach a request.
+    """
+    BATCH = 256
+    FLUSH_S = 1.0
+
+    def __init__(self, dest: str, service: str):
+        self.dest = dest
+        self.http = dest.startswith(("http://", "https://"))
+        self._resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]}
+        self._q: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self._client = httpx.Client(timeout=5.0) if self.http else None
+        self._thread = threading.Thread(target=self._run, name="otlp-export", daemon=True)
+        self._thread.start()
+
+    def add(self, s: Span, end_ns: int, error: Optional[BaseException]):
+        item: Dict[str, Any] = {
+            "traceId": s.trace_id, "spanId": s.span_id, "name": s.name, "kind": s.kind,
+            "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(end_ns),
+            "attributes": [{"key": "request.id", "value": {"stringValue": s.request_id}}] +
+                          [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items() if v is not None],
+            "status": {"code": 2, "message": f"{type(error).__name__}: {error}"} if error is not None else {"code": 1},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            pass        # exporter is behind: drop rather than slow requests down
+
+    def _run(self):
+        while True:
+            batch: List[Dict[str, Any]] = [self._q.get()]
+            deadline = time.monotonic() + self.FLUSH_S
+            while len(batch) < self.BATCH:
+                try:
+                    batch.append(self._q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            body = json.dumps({"resourceSpans": [{
+                "resource": self._resource,
+                "scopeSpans": [{"scope": {"name": "bloodlab"}, "spans": batch}],
+            }]}, ensure_ascii=False, default=str)
+            try:
+                if self.http:
+                    self._client.post(self.dest, content=body, headers={"Content-Type": "application/json"}).raise_for_status()
+                else:
+                    if os.path.dirname(self.dest):
+                        os.makedirs(os.path.dirname(self.dest), exist_ok=True)
+                    with open(self.dest, "a", encoding="utf-8") as f:
+                        f.write(body + "\n")
+            except Exception as e:
+                print(f"OTLP export of {len(batch)} spans failed: {e}")
+
+# ---------- log prefix ----------
+class RequestIdStream:
+    """Text stream wrapper: lines written while serving a request start with "[<request id>] "."""
+    def __init__(self, inner):
+        self._inner = inner
+        self._line = threading.local()      # per thread: next write starts a new line
+
+    def write(self, s: str) -> int:
+        at_start = getattr(self._line, "start", True)
+        if s:
+            self._line.start = s.endswith("\n")
+        rid = current_request_id()
+        if rid is None or not s:
+            return self._inner.write(s)
+        prefix = f"[{rid}] "
+        lines = s.split("\n")
+        out = [prefix + lines[0] if at_start and lines[0] else lines[0]]
+        out += [prefix + line if line else line for line in lines[1:]]
+        self._inner.write("\n".join(out))
+        return len(s)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+def install_log_prefix() -> Any:
+    """Wraps sys.stdout once; returns the unwrapped stream (for the JSON span lines)."""
+    if not isinstance(sys.stdout, RequestIdStream):
+        sys.stdout = RequestIdStream(sys.stdout)
+    return sys.stdout._inner
+
+# ---------- ASGI middleware ----------
+class TraceMiddleware:
+    """
+    Root span per HTTP request. The id comes from X-Request-Id (if well-formed) or
+    is generated; a W3C traceparent header continues the caller's trace. The id is
+    returned in X-Request-Id.
+    """
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1").strip()
+        if not REQUEST_ID_RE.match(rid):
+            rid = new_request_id()
+        trace_id, parent_id = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        method, path = scope.get("method", ""), scope.get("path", "")
+
+        with self.tracer.request(rid, f"{method} {path}", trace_id, parent_id,
+                                 **{"http.method": method, "http.path": path}) as attrs:
+            async def send_with_id(message):
+                if message["type"] == "http.response.start":
+                    attrs["http.status_code"] = message["status"]
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-request-id", rid.encode())]}
+                await send(message)
+
+            await self.app(scope, receive, send_with_id)
@@ -0,0 +1,130 @@
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+# Unit-conversion registry. Compiled from the metrics DB at load time into
+# canonical metric -> {normalized unit spelling -> factor into the DB unit}, so
+# normalizing a row is one dict lookup and a multiply. Spellings are resolved per
+# metric on purpose: "G/L" is giga-cells for platelets but grams for hemoglobin.
+
+# ---------- spelling normalization ----------
+_SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹", "0123456789")
+_CYRILLIC = [
+    ("мккат", "µkat"), ("ммоль", "mmol"), ("мкмоль", "µmol"), ("нмоль", "nmol"), ("пмоль", "pmol"),
+    ("мкг", "µg"), ("нг", "ng"), ("пг", "pg"), ("мг", "mg"), ("г", "g"),
+    ("мкл", "µl"), ("мл", "ml"), ("дл", "dl"), ("л", "l"), ("фл", "fl"),
+    ("ед", "u"), ("мм/ч", "mm/h"), ("мин", "min"),
+]
+
+def norm_unit(unit: Optional[str]) -> str:
+    u = (unit or "").strip()
+    if not u:
+        return ""
+    u = u.translate(_SUPERSCRIPTS).replace("μ", "µ").replace("×", "x").replace("*", "^")
+    u = re.sub(r"\s+", "", u).lower()
+    for cyr, lat in _CYRILLIC:
+        u = u.replace(cyr, lat)
+    u = re.sub(r"(?<![a-z])(?:mc|u)(?=mol|g\b|l\b|iu|kat|m\^?3)", "µ", u)   # umol, mcg, /ul -> µ
+    u = re.sub(r"^x?10\^?(\d+)", r"10^\1", u)                    # x10^9/l, 10*9/l, 109/l -> 10^9/l
+    u = u.replace("mm3", "µl").replace("mm^3", "µl").replace("cells/", "/")
+    return u
+
+# ---------- conversion tables ----------
+# by canonical unit: spelling -> factor into that unit
+FAMILIES: Dict[str, Dict[str, float]] = {
+    "10^9/l": {"10^9/l": 1, "g/l": 1, "giga/l": 1, "10^3/µl": 1, "k/µl": 1, "/nl": 1, "/µl": 1e-3},
+    "10^12/l": {"10^12/l": 1, "t/l": 1, "tera/l": 1, "10^6/µl": 1, "m/µl": 1},
+    "g/l": {"g/l": 1, "g/dl": 10, "mg/dl": 0.01},
+    "mg/l": {"mg/l": 1, "mg/dl": 10, "g/l": 1000},
+    "mmol/l": {"mmol/l": 1, "µmol/l": 1e-3},
+    "µmol/l": {"µmol/l": 1, "mmol/l": 1e3},
+    "nmol/l": {"nmol/l": 1, "pmol/l": 1e-3},
+    "pmol/l": {"pmol/l": 1, "nmol/l": 1e3},
+    "µg/l": {"µg/l": 1, "ng/ml": 1},
+    "u/l": {"u/l": 1, "iu/l": 1, "µkat/l": 60},
+    "µiu/ml": {"µiu/ml": 1, "miu/l": 1, "mu/l": 1, "µu/ml": 1},
+    "fl": {"fl": 1, "µm^3": 1, "µm3": 1},
+    "pg": {"pg": 1},
+    "%": {"%": 1},
+    "fraction": {"fraction": 1, "l/l": 1, "%": 0.01},
+    "l/l": {"l/l": 1, "fraction": 1, "%": 0.01},
+    "mm/h": {"mm/h": 1, "mm/hr": 1, "mm/1h": 1},
+    "mmhg": {"mmhg": 1},
+    "cm": {"cm": 1, "m": 100, "mm": 0.1},
+    "kg": {"kg": 1, "g": 1e-3, "lb": 0.45359237},
+    "/min": {"/min": 1, "bpm": 1},
+    "ml/min/1.73m2": {"ml/min/1.73m2": 1, "ml/min": 1},
+}
+
+# analyte-specific (molar mass, valence) conversions, into the DB unit
+ANALYTE: Dict[str, Dict[str, float]] = {
+    "Glucose (fasting)": {"mg/dl": 1 / 18.016},
+    "Cholesterol total": {"mg/dl": 1 / 38.67},
+    "HDL": {"mg/dl": 1 / 38.67},
+    "LDL": {"mg/dl": 1 / 38.67},
+    "VLDL": {"mg/dl": 1 / 38.67},
+    "Triglycerides": {"mg/dl": 1 / 88.57},
+    "Creatinine": {"mg/dl": 88.4},
+    "Uric acid": {"mg/dl": 59.48},
+    "Urea": {"mg/dl": 1 / 6.006},
+    "Calcium": {"mg/dl": 1 / 4.008, "meq/l": 0.5},
+    "Potassium": {"meq/l": 1},
+    "Potassium (K)": {"meq/l": 1},
+    "Sodium (Na)": {"meq/l": 1},
+    "Folate": {"ng/ml": 2.266, "µg/l": 2.266},
+    "B12 (cobalamine)": {"pg/ml": 0.7378, "ng/l": 0.7378},
+    "Proteine C reactive": {"mg/dl": 10},
+}
+
+def _family_key(db_unit: str) -> str:
+    # capital G/L in the DB means giga-cells, not grams
+    if db_unit.strip() == "G/L":
+        return "10^9/l"
+    return norm_unit(db_unit)
+
+Registry = Dict[str, Tuple[str, Dict[str, float]]]
+
+def compile_registry(metrics: List[Dict[str, Any]]) -> Registry:
+    """canonical name -> (DB unit, {normalized spelling: factor into it}); metrics without a unit are left out."""
+    reg: Registry = {}
+    for m in metrics:
+        canon, db_unit = m.get("canonical_name"), m.get("unit")
+        if not (canon and db_unit):
+            continue
+        key = _family_key(db_unit)
+        table = {key: 1.0}
+        table.update(FAMILIES.get(key, {}))
+        table.update(ANALYTE.get(canon, {}))
+        reg[canon] = (db_unit, table)
+    return reg
+
+def unit_factor(registry: Registry, canon: str, unit: Optional[str]) -> Optional[float]:
+    """Factor from `unit` into the DB unit of `canon` (no unit = the DB unit); None when unknown."""
+    entry = registry.get(canon)
+    if entry is None:
+        return None
+    return entry[1].get(norm_unit(unit)) if unit else 1.0
+
+# ---------- batch normalization ----------
+def normalize_rows(rows: List[Any], registry: Registry, to_number) -> int:
+    """
+    Fill norm_value/norm_unit on rows whose unit is known for their metric;
+    value/unit stay as printed. Returns how many rows were normalized.
+    """
+    factors: Dict[Tuple[str, str], Optional[float]] = {}
+    done = 0
+    for r in rows:
+        entry = registry.get(r.name)
+        v = to_number(r.value) if entry else None
+        if v is None:
+            continue
+        db_unit = entry[0]
+        key = (r.name, r.unit or "")
+        if key not in factors:
+            factors[key] = unit_factor(registry, r.name, r.unit)
+        f = factors[key]
+        if f is None:
+            continue
+        r.norm_value = round(v * f, 6)
+        r.norm_unit = db_unit
+        done += 1
+    return done
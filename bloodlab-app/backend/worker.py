@@ -0,0 +1,18 @@
+# Standalone job worker: scales /api/jobs processing independently of the API.
+# Run the API with JOB_WORKERS=0 and start `python worker.py` next to it,
+# pointing JOBS_DB at the same file (e.g. a shared volume).
+import signal
+import sys
+import threading
+
+from main import job_pool, settings
+
+if __name__ == "__main__":
+    job_pool.workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(1, settings.JOB_WORKERS)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    job_pool.start()
+    print(f"Job worker started: {job_pool.workers} threads, model {settings.GENAI_MODEL}")
+    stop.wait()
+    job_pool.stop()
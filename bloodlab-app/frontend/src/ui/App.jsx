@@ -61,21 +61,27 @@ export default function App() {
     setResults(null);
     setProgress({ total: 0, step: 0, percent: 0, filename: "", page: 0, pages_in_file: 0 });
 
-    try {
-      const fd = new FormData();
-      files.forEach(f => fd.append("files", f));
-
-      const resp = await fetch(`${API_BASE}/api/process/stream`, {
-        method: "POST",
-        body: fd,
-      });
-
+    // stream state kept across reconnects (server replays events after lastId)
+    let streamId = null;
+    let lastId = 0;
+    let finished = false;
+    // deduplicated table, built from upsert/replace deltas (key -> measurement)
+    const best = new Map();
+    // rows streamed while their page is still being read (key -> {page, m}); shown
+    // until the page commits them via upsert/replace or a retract withdraws them
+    const provisional = new Map();
+    const table = () => [
+      ...best.values(),
+      ...[...provisional].filter(([k]) => !best.has(k)).map(([, p]) => p.m),
+    ];
+
+    const consume = async (resp) => {
       if (!resp.ok || !resp.body) throw new Error(`HTTP ${resp.status}`);
+      streamId = resp.headers.get("X-Stream-Id") || streamId;
 
       const reader = resp.body.getReader();
       const decoder = new TextDecoder("utf-8");
       let buffer = "";
-      let finished = false;
 
       while (!finished) {
         const { done, value } = await reader.read();
@@ -88,16 +94,19 @@ export default function App() {
           buffer = buffer.slice(idx + 2);
 
           const lines = chunk.split("\n").map(l => l.trim());
-          let event = null, dataStr = null;
+          let event = null, dataStr = null, id = null;
           for (const l of lines) {
             if (l.startsWith("event:")) event = l.slice(6).trim();
             else if (l.startsWith("data:")) dataStr = l.slice(5).trim();
+            else if (l.startsWith("id:")) id = Number(l.slice(3).trim());
           }
           if (!event || !dataStr) continue;
+          if (id) lastId = id;
 
           const data = JSON.parse(dataStr);
 
           if (event === "meta") {
+            if (data.stream_id) streamId = data.stream_id;
             setProgress(p => ({ ...p, total: data.total_steps || 0 }));
           } else if (event === "progress") {
             setProgress({
@@ -108,8 +117,22 @@ export default function App() {
               page: data.page,
               pages_in_file: data.pages_in_file
             });
+          } else if (event === "row") {
+            provisional.set(data.key, { page: `${data.filename}#${data.page}`, m: data.m });
+            setResults({ measurements: table(), notes: null });
+          } else if (event === "retract") {
+            for (const key of data.keys || []) provisional.delete(key);
+            setResults({ measurements: table(), notes: null });
+          } else if (event === "page") {
+            const page = `${data.filename}#${data.page}`;
+            for (const [k, p] of provisional) if (p.page === page) provisional.delete(k);
+            setResults({ measurements: table(), notes: null });
+          } else if (event === "upsert" || event === "replace") {
+            for (const { key, m } of data.items || []) best.set(key, m);
+            setResults({ measurements: table(), notes: null });
           } else if (event === "done") {
-            setResults(data);
+            if (data.count !== best.size) console.warn("stream result mismatch", data.count, best.size);
+            setResults({ measurements: [...best.values()], notes: data.notes });
             setIsLoading(false);
             finished = true;
 
@@ -121,6 +144,33 @@ export default function App() {
           }
         }
       }
+    };
+
+    try {
+      const fd = new FormData();
+      files.forEach(f => fd.append("files", f));
+
+      try {
+        await consume(await fetch(`${API_BASE}/api/process/stream`, {
+          method: "POST",
+          body: fd,
+        }));
+      } catch (e) {
+        if (!streamId) throw e;
+      }
+
+      // connection dropped: resume the same server-side stream, no re-upload
+      for (let attempt = 1; !finished && streamId && attempt <= 5; attempt++) {
+        await new Promise(r => setTimeout(r, 1000 * attempt));
+        try {
+          await consume(await fetch(`${API_BASE}/api/process/stream/${streamId}`, {
+            headers: { "Last-Event-ID": String(lastId) },
+          }));
+        } catch (e) {
+          if (attempt === 5) throw e;
+        }
+      }
+      if (!finished) throw new Error("stream ended before results");
     } catch (e) {
       alert("Error: " + e.message);
       setIsLoading(false);